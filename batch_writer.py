@@ -0,0 +1,238 @@
+import io
+import os
+import threading
+import time
+from datetime import datetime
+from psycopg2.extras import execute_values
+import database
+
+
+# Escape one value for PostgreSQL's COPY text format
+def copy_text(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    if isinstance(value, str):
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    return str(value)
+
+
+# Days a replayed segment's key is kept. A key is only needed until its segment file is
+# deleted, right after the commit or on the next replay after a crash.
+REPLAY_KEY_RETENTION_DAYS = float(os.environ.get('SPOOL_REPLAY_KEY_RETENTION_DAYS', '7'))
+
+# Errors that mean the database is unavailable rather than that a spooled segment is bad
+TRANSIENT_ERRORS = database.CONNECTION_ERRORS + (database.PoolError,)
+
+
+# Function to create the table recording replayed spool segments; a segment's rows and
+# its record are committed together, so a segment is never inserted twice
+def ensure_replay_table():
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fo_spool_replayed (
+            segment TEXT PRIMARY KEY,
+            replayed_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        ''')
+        cursor.close()
+
+
+# Function to delete replayed segment keys older than the retention window
+def prune_replay_keys(days=REPLAY_KEY_RETENTION_DAYS):
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM fo_spool_replayed WHERE replayed_at < NOW() - %s * INTERVAL '1 day'", (days,))
+        cursor.close()
+
+
+# Buffered writer that group-commits rows into one table.
+# Rows are collected in memory and written with a single multi-row INSERT (or COPY, for
+# high-rate streams) and a single commit once max_rows are buffered or the oldest buffered
+# row is max_delay seconds old, so at most max_delay seconds of samples are lost if the
+# process dies. With a spool, batches that cannot be written are moved to disk instead of
+# being held in memory, and replayed in bulk once the database accepts writes again.
+class BatchWriter:
+    def __init__(self, table, columns, max_rows=100, max_delay=60.0, max_buffered=None, use_copy=False, spool=None):
+        self.table = table
+        self.columns = list(columns)
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_buffered = max_buffered or max_rows * 50  # Cap on rows held while the database is failing
+        self.use_copy = use_copy
+        self.spool = spool
+        self._query = f"INSERT INTO {table} ({', '.join(self.columns)}) VALUES %s"
+        self._copy_query = f"COPY {table} ({', '.join(self.columns)}) FROM STDIN"
+        self._rows = []
+        self._oldest = None  # Monotonic time the oldest buffered row was added
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # Serializes flushes so batches commit in order
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._replay_table_ready = False
+        self.stats = {
+            'rows_written': 0,
+            'batches': 0,
+            'failed_batches': 0,
+            'dropped_rows': 0,
+            'last_flush_seconds': 0.0
+        }
+
+    # Start the background thread that flushes on the time threshold
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"writer-{self.table}", daemon=True)
+            self._thread.start()
+        return self
+
+    # Queue one row; values must be in the order of self.columns
+    def add(self, row):
+        with self._lock:
+            self._rows.append(row)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            full = len(self._rows) >= self.max_rows
+        if full:
+            self._wakeup.set()
+
+    # Number of rows waiting to be written
+    def pending(self):
+        with self._lock:
+            return len(self._rows)
+
+    # Write everything buffered so far in one transaction; returns False if the write failed
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+                oldest, self._oldest = self._oldest, None
+
+            if rows:
+                started = time.monotonic()
+                try:
+                    self._write(rows)
+                except Exception as e:
+                    print(f"Error writing {len(rows)} rows to {self.table}: {e}")
+                    self.stats['failed_batches'] += 1
+                    self._store_failed(rows, oldest)
+                    return False
+
+                self.stats['rows_written'] += len(rows)
+                self.stats['batches'] += 1
+                self.stats['last_flush_seconds'] = time.monotonic() - started
+                print(f"Saved {len(rows)} rows to {self.table}.")
+
+            if self.spool is not None and self.spool.depth():
+                return self._replay_spool()
+            return True
+
+    # Stop the background thread and flush whatever is still buffered
+    def close(self):
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        flushed = self.flush()
+        if self.spool is not None:
+            self.spool.close()
+        return flushed
+
+    # Write one batch in a single transaction
+    def _write(self, rows):
+        with database.connection() as conn:
+            cursor = conn.cursor()
+            self._insert(cursor, rows)
+            cursor.close()
+
+    # Write one spool segment in a single transaction with its replay record; a segment
+    # already recorded (committed before a crash stopped the spool deleting it) is skipped
+    def _write_segment(self, rows, key):
+        with database.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO fo_spool_replayed (segment) VALUES (%s) ON CONFLICT DO NOTHING", (key,))
+            if cursor.rowcount:
+                self._insert(cursor, rows)
+            else:
+                print(f"Skipped spool segment {key}: already replayed into {self.table}.")
+            cursor.close()
+
+    def _insert(self, cursor, rows):
+        if self.use_copy:
+            cursor.copy_expert(self._copy_query, self._copy_buffer(rows))
+        else:
+            execute_values(cursor, self._query, rows, page_size=len(rows))
+
+    # Move a failed batch to the spool, or keep it in memory when there is no spool
+    def _store_failed(self, rows, oldest):
+        if self.spool is not None:
+            try:
+                self.spool.append(rows)
+                self.spool.sync()
+                print(f"Spooled {len(rows)} rows for {self.table}; spool depth {self.spool.depth()} rows.")
+                return
+            except OSError as e:
+                print(f"Error spooling rows for {self.table}: {e}")
+        self._requeue(rows, oldest)
+
+    # Bulk-load spooled rows back into the table, oldest segment first
+    def _replay_spool(self):
+        try:
+            if not self._replay_table_ready:
+                ensure_replay_table()
+                self._replay_table_ready = True
+            replayed = self.spool.replay(self._write_segment, transient=TRANSIENT_ERRORS)
+        except Exception as e:
+            print(f"Error replaying spool for {self.table}: {e}")
+            return False
+        try:
+            prune_replay_keys()
+        except Exception as e:
+            print(f"Error pruning spool replay keys: {e}")
+        stats = self.spool.stats()
+        print(f"Replayed {replayed} spooled rows into {self.table} "
+              f"({stats['replay_rows_per_second']:.0f} rows/s, {stats['depth_rows']} rows left).")
+        return True
+
+    # Render rows in COPY text format
+    @staticmethod
+    def _copy_buffer(rows):
+        lines = ['\t'.join([copy_text(value) for value in row]) for row in rows]
+        lines.append('')
+        return io.StringIO('\n'.join(lines))
+
+    # Put a failed batch back in front of newer rows, dropping the oldest beyond max_buffered
+    def _requeue(self, rows, oldest):
+        with self._lock:
+            self._rows[:0] = rows
+            self._oldest = oldest if oldest is not None else time.monotonic()
+            overflow = len(self._rows) - self.max_buffered
+            if overflow > 0:
+                del self._rows[:overflow]
+                self.stats['dropped_rows'] += overflow
+                print(f"Dropped {overflow} buffered rows for {self.table}: buffer full.")
+
+    def _run(self):
+        while not self._stopping:
+            with self._lock:
+                oldest = self._oldest
+                full = len(self._rows) >= self.max_rows
+            if full:
+                timeout = 0
+            elif oldest is None:
+                timeout = self.max_delay
+            else:
+                timeout = max(0.0, oldest + self.max_delay - time.monotonic())
+            if timeout and self._wakeup.wait(timeout):
+                self._wakeup.clear()
+                if self._stopping:
+                    break
+                if self.pending() < self.max_rows:
+                    continue
+            if not self.flush():
+                # Back off before retrying so a database outage does not spin this thread
+                self._wakeup.wait(self.max_delay)
+                self._wakeup.clear()
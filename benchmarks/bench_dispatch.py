@@ -0,0 +1,74 @@
+# Per-message cost of MQTT payload parsing and dispatch: the original if/elif chain with
+# json.loads + float against the sensor registry's dispatch table and float fast path,
+# for plain and JSON-encoded payloads. Run with: python -m benchmarks.bench_dispatch
+import json
+import timeit
+
+import sensor_registry
+
+TOPICS = ['cstr-ph', 'feed-ec', 'cstr-orp', 'cstr-temp', 'cstr-level',
+          'feed-level', 'feed-tds', 'feed-temp', 'ds-tds', 'ds-level', 'ds-ec', 'weight']
+
+
+# The dispatch data_control used before the registry
+def legacy(data, topic, raw_payload):
+    payload = json.loads(raw_payload.decode())
+    if topic == 'cstr-ph':
+        data['cstr_ph'] = float(payload)
+    elif topic == 'feed-ec':
+        data['feed_ec'] = float(payload)
+    elif topic == 'cstr-orp':
+        data['cstr_orp'] = float(payload)
+    elif topic == 'cstr-temp':
+        data['cstr_temp'] = float(payload)
+    elif topic == 'cstr-level':
+        data['cstr_level'] = float(payload)
+    elif topic == 'feed-level':
+        data['feed_level'] = float(payload)
+    elif topic == 'feed-tds':
+        data['feed_tds'] = float(payload)
+    elif topic == 'feed-temp':
+        data['feed_temp'] = float(payload)
+    elif topic == 'ds-tds':
+        data['ds_tds'] = float(payload)
+    elif topic == 'ds-ec':
+        data['ds_ec'] = float(payload)
+    elif topic == 'ds-level':
+        data['ds_level'] = float(payload)
+    elif topic == 'weight':
+        data['weight'] = float(payload)
+
+
+def registry(data, topic, raw_payload, sensors=sensor_registry.dispatch_table(TOPICS)):
+    sensor = sensors.get(topic)
+    if sensor is None:
+        return
+    value = sensor.parse(raw_payload)
+    if value is not None:
+        data[sensor.column] = value
+
+
+def measure(fn, messages, repeat=5):
+    data = {}
+
+    def run():
+        for topic, payload in messages:
+            fn(data, topic, payload)
+
+    best = min(timeit.repeat(run, number=20, repeat=repeat))
+    return best / (20 * len(messages)) * 1e6
+
+
+def main():
+    plain = [(topic, f"{i % 13 + 0.25}".encode()) for i in range(100) for topic in TOPICS]
+    quoted = [(topic, json.dumps(f"{i % 13 + 0.25}").encode()) for i in range(100) for topic in TOPICS]
+
+    print(f"{'payload':<10}{'legacy us/msg':>16}{'registry us/msg':>18}{'speedup':>10}")
+    for name, messages in (('plain', plain), ('json', quoted)):
+        before = measure(legacy, messages)
+        after = measure(registry, messages)
+        print(f"{name:<10}{before:>16.3f}{after:>18.3f}{before / after:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+# Draw time of a 1-day, full-rate series (86,400 points) on an 800 px wide Agg canvas,
+# plotted raw and after LTTB and min/max downsampling to the canvas width, with the same
+# marker style as the viewers. Run with: python -m benchmarks.bench_downsample
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+import downsample
+
+POINTS = 86400
+WIDTH_PX = 800
+
+
+def draw(x, y, repeat=3):
+    best = None
+    for _ in range(repeat):
+        fig, ax = plt.subplots(figsize=(WIDTH_PX / 100, 4), dpi=100)
+        started = time.perf_counter()
+        ax.plot(x, y, marker='o', linestyle='-')
+        fig.canvas.draw()
+        elapsed = time.perf_counter() - started
+        plt.close(fig)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    rng = np.random.default_rng(0)
+    timestamps = pd.Series(pd.date_range('2024-01-01', periods=POINTS, freq='s'))
+    values = pd.Series(7 + np.cumsum(rng.normal(scale=0.01, size=POINTS)))
+
+    print(f"{'series':<10}{'points':>8}{'reduce ms':>11}{'draw ms':>10}")
+    print(f"{'raw':<10}{POINTS:>8}{0.0:>11.1f}{draw(timestamps, values) * 1000:>10.1f}")
+    for method in ('lttb', 'minmax'):
+        started = time.perf_counter()
+        x, y = downsample.for_plot(timestamps, values, WIDTH_PX, method)
+        reduced = time.perf_counter() - started
+        print(f"{method:<10}{len(y):>8}{reduced * 1000:>11.1f}{draw(x, y) * 1000:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# File size and write/read time of a multi-month export as CSV and as zstd Parquet.
+# Without arguments a synthetic 90-day range at the 30 s sample rate (259,200 rows, 17
+# sensor columns) is written from memory; with a date range the real exports run against
+# the database. Run with: python -m benchmarks.bench_export [FROM TO]
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import export
+
+DAYS = 90
+SAMPLE_SECONDS = 30
+COLUMNS = ['cstr_ph', 'cstr_orp', 'cstr_temp', 'cstr_level', 'feed_level', 'feed_tds', 'feed_temp', 'vol_to_ds',
+           'com_vol_fs', 'flux', 'increase_in_fs', 'ds_tds', 'ds_level', 'feed_ec', 'ds_ec', 'weight', 'cstr_ec']
+
+
+def synthetic_frame():
+    rng = np.random.default_rng(0)
+    timestamps = pd.date_range('2024-01-01', periods=DAYS * 86400 // SAMPLE_SECONDS, freq=f'{SAMPLE_SECONDS}s')
+    data = {'timestamp': timestamps}
+    for i, column in enumerate(COLUMNS):
+        # Sensor-like readings: a slow random walk at two decimals
+        data[column] = np.round(10 * (i + 1) + np.cumsum(rng.normal(scale=0.05, size=len(timestamps))), 2)
+    return pd.DataFrame(data)
+
+
+def write_synthetic(frame, path):
+    if path.endswith('.parquet'):
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        pq.write_table(table, path, compression=export.PARQUET_COMPRESSION, row_group_size=export.PARQUET_ROW_GROUP)
+    else:
+        frame.to_csv(path, index=False)
+
+
+def read(path):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path, parse_dates=['timestamp'])
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    frame = None if len(sys.argv) > 2 else synthetic_frame()
+
+    print(f"{'format':<10}{'rows':>10}{'size MB':>10}{'write s':>10}{'read s':>9}")
+    for name in ('export.csv', 'export.parquet'):
+        path = os.path.join(directory, name)
+        started = time.perf_counter()
+        if frame is None:
+            export.export_file(path, sys.argv[1], sys.argv[2])
+        else:
+            write_synthetic(frame, path)
+        written = time.perf_counter() - started
+
+        started = time.perf_counter()
+        rows = len(read(path))
+        loaded = time.perf_counter() - started
+        size = os.path.getsize(path) / 1e6
+        print(f"{name.split('.')[1]:<10}{rows:>10}{size:>10.1f}{written:>10.2f}{loaded:>9.2f}")
+        os.remove(path)
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    main()
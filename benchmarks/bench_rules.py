@@ -0,0 +1,56 @@
+# Per-message control cost with hundreds of rules: the dependency-indexed engine only
+# evaluates the rules reading the changed sensor, compared with evaluating every rule on
+# every message. Run with: python -m benchmarks.bench_rules
+import contextlib
+import io
+import random
+import time
+
+import control_engine
+import control_rules
+import sensor_registry
+
+RULE_COUNTS = [3, 100, 500]
+MESSAGES = 20000
+
+
+def make_rules(count, topics):
+    rng = random.Random(0)
+    rules = []
+    for i in range(count):
+        low = rng.uniform(10, 40)
+        rules.append({'name': f'rule-{i}', 'input': topics[i % len(topics)], 'outputs': [f'out/{i}'],
+                      'on': ['<=', low], 'off': ['>=', ['set_offset', low]]})
+    return rules
+
+
+def run(definitions, every_rule):
+    sensor_values, settings = {}, {'set_offset': 5.0}
+    engine = control_engine.ControlEngine(lambda topic, state: None)
+    rules = control_rules.compile_rules(definitions, engine, sensor_values, settings)
+    topics = control_rules.input_topics(rules)
+    rng = random.Random(1)
+    messages = [(rng.choice(topics), rng.uniform(0, 60)) for _ in range(MESSAGES)]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        for topic, value in messages:
+            sensor_values[topic] = value
+            if every_rule:
+                engine.run_all()
+            else:
+                engine.changed(topic)
+        elapsed = time.perf_counter() - started
+    return elapsed / MESSAGES * 1e6
+
+
+def main():
+    topics = [sensor.topic for sensor in sensor_registry.SENSORS if not sensor.derived]
+    print(f"{'rules':>6}{'all rules us/msg':>18}{'indexed us/msg':>16}")
+    for count in RULE_COUNTS:
+        definitions = control_rules.DEFAULT_RULES if count == 3 else make_rules(count, topics)
+        print(f"{count:>6}{run(definitions, True):>18.1f}{run(definitions, False):>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
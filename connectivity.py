@@ -0,0 +1,113 @@
+import threading
+import time
+import requests
+
+try:
+    import httpx  # Used by the supabase client
+except ImportError:
+    httpx = None
+
+# Errors meaning the upload target could not be reached at all, as opposed to an HTTP
+# error status (e.g. a rejected batch), which says nothing about the link
+TRANSPORT_ERRORS = (requests.ConnectionError, requests.Timeout) + ((httpx.TransportError,) if httpx else ())
+
+
+# Background health monitor for the upload target.
+# The last known state is cached, so is_up() never blocks the caller. While the link is up
+# it is re-probed only when nothing has confirmed it for ttl seconds; while it is down,
+# probes back off exponentially. Real upload outcomes reported through report_success()
+# and report_failure() switch the state immediately, and listeners are called on every
+# up/down transition.
+class HealthMonitor:
+    def __init__(self, url, ttl=60.0, timeout=5.0, min_backoff=5.0, max_backoff=300.0):
+        self.url = url
+        self.ttl = ttl
+        self.timeout = timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self._up = False
+        self._confirmed_at = 0.0
+        self._backoff = min_backoff
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._up_event = threading.Event()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="health-monitor", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+
+    # Cached link state; never performs I/O
+    def is_up(self):
+        return self._up
+
+    # Block until the link is up or timeout seconds pass; returns the state
+    def wait_until_up(self, timeout=None):
+        return self._up_event.wait(timeout)
+
+    # Register fn(up) to be called on every state transition
+    def add_listener(self, fn):
+        self._listeners.append(fn)
+
+    # Record a real upload success
+    def report_success(self):
+        self._set_state(True)
+
+    # Record a real upload failure and schedule a probe with backoff
+    def report_failure(self):
+        self._set_state(False)
+        self._wakeup.set()
+
+    def _set_state(self, up):
+        with self._lock:
+            changed = up != self._up
+            self._up = up
+            if up:
+                self._confirmed_at = time.monotonic()
+                self._backoff = self.min_backoff
+                self._up_event.set()
+            else:
+                self._up_event.clear()
+        if changed:
+            print(f"Upload target {self.url} is {'up' if up else 'down'}")
+            for fn in self._listeners:
+                try:
+                    fn(up)
+                except Exception as e:
+                    print(f"Error in connectivity listener: {e}")
+
+    # Any HTTP response means the target is reachable; only network errors count as down
+    def _probe(self):
+        try:
+            requests.head(self.url, timeout=self.timeout)
+            return True
+        except requests.RequestException:
+            return False
+
+    def _run(self):
+        self._set_state(self._probe())
+        while not self._stopping:
+            if self._up:
+                wait = max(0.0, self._confirmed_at + self.ttl - time.monotonic())
+            else:
+                wait = self._backoff
+            if self._wakeup.wait(wait):
+                self._wakeup.clear()
+                continue  # State was reported in the meantime; recompute the wait
+
+            if self._up and time.monotonic() - self._confirmed_at < self.ttl:
+                continue
+            if self._probe():
+                self._set_state(True)
+            else:
+                if not self._up:
+                    self._backoff = min(self.max_backoff, self._backoff * 2)
+                self._set_state(False)
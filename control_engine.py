@@ -0,0 +1,107 @@
+import bisect
+import time
+
+# Upper bounds (ms) of the actuation latency histogram buckets; the last bucket is open
+LATENCY_BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+
+# Fixed-bucket latency histogram with count, mean, max and bucket-resolution percentiles
+class LatencyHistogram:
+    def __init__(self, buckets_ms=LATENCY_BUCKETS_MS):
+        self.buckets_ms = list(buckets_ms)
+        self.counts = [0] * (len(self.buckets_ms) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.buckets_ms, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    # Upper bound (ms) of the bucket holding the given fraction of samples
+    def percentile(self, fraction):
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets_ms + [self.max], self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'avg_ms': self.total / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(0.5),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': self.max
+        }
+
+
+# Control loops evaluated only when one of their inputs changes.
+# Each loop declares the sensor topics and setting names it reads; changed(names) runs
+# just the loops depending on those names, each once, in registration order. Loops drive
+# outputs through actuate(), which publishes only on a state change and records the time
+# from the triggering input's arrival to the publish in a per-output latency histogram.
+# Evaluations without an arrival time (periodic reconciles, run_all) record no latency.
+class ControlEngine:
+    def __init__(self, publish, states=None):
+        self.publish = publish
+        self.states = states if states is not None else {}  # output topic -> last published state
+        self.loops = []
+        self._by_input = {}           # input name -> indices of the loops reading it
+        self._received = None         # Arrival time of the input being evaluated
+        self.latency = {}             # output topic -> LatencyHistogram
+        self.stats = {'evaluations': 0, 'loop_runs': 0, 'actuations': 0}
+
+    # Register fn as a control loop reading the given inputs
+    def loop(self, name, fn, inputs):
+        index = len(self.loops)
+        self.loops.append((name, fn))
+        for input_name in inputs:
+            self._by_input.setdefault(input_name, []).append(index)
+
+    # Remove every loop, e.g. before registering a reloaded set; states and latency are kept
+    def clear(self):
+        self.loops = []
+        self._by_input = {}
+
+    # Run the loops affected by the changed inputs; received is the monotonic time the
+    # change arrived, if known
+    def changed(self, *names, received=None):
+        indices = sorted({index for name in names for index in self._by_input.get(name, ())})
+        self._received = received
+        self.stats['evaluations'] += 1
+        try:
+            for index in indices:
+                name, fn = self.loops[index]
+                self.stats['loop_runs'] += 1
+                try:
+                    fn()
+                except Exception as e:
+                    print(f"Error in control loop {name}: {e}")
+        finally:
+            self._received = None
+
+    # Run every loop, e.g. after a reconnect
+    def run_all(self, received=None):
+        self.changed(*self._by_input, received=received)
+
+    # Publish state on topic if it differs from the last published state
+    def actuate(self, topic, state):
+        if self.states.get(topic) == state:
+            return
+        self.publish(topic, state)
+        self.states[topic] = state
+        self.stats['actuations'] += 1
+        if self._received is not None:
+            self.latency.setdefault(topic, LatencyHistogram()).record(time.monotonic() - self._received)
+        print(f"Published state change: {topic} -> {state}")
+
+    def metrics(self):
+        return dict(self.stats, latency={topic: histogram.summary() for topic, histogram in self.latency.items()})
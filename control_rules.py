@@ -0,0 +1,186 @@
+import json
+import operator
+import os
+import time
+import database
+import sensor_registry
+
+# On/off control rules. Each rule is a JSON object:
+#   name     unique rule name
+#   input    sensor topic the rule reads (must be in the sensor registry)
+#   outputs  actuator topics driven together
+#   on/off   [comparison, threshold]: the outputs switch on when the on condition holds,
+#            off when the off condition holds, and keep their state in between (hysteresis)
+#   states   optional [on payload, off payload], default ["on", "off"]
+# A threshold is a number, a setting name (a column of the latest fo_setting row), or a
+# list of such terms that are added up; a name prefixed with '-' is subtracted. A rule is
+# skipped while its input or any setting it uses is unknown.
+DEFAULT_RULES = [
+    {'name': 'cstr-heaters', 'input': 'cstr-temp', 'outputs': ['cstr/heater1', 'cstr/heater2'],
+     'on': ['<', 'set_cstr_temp'], 'off': ['>=', 'set_cstr_temp']},
+    {'name': 'feed-in', 'input': 'feed-level', 'outputs': ['cstr/in'],
+     'on': ['<=', 20], 'off': ['>=', 25]},
+    {'name': 'ds-out', 'input': 'ds-tds', 'outputs': ['ds/out'],
+     'on': ['>=', ['set_tds', 'hyst_tds']], 'off': ['<', ['set_tds', '-hyst_tds']]},
+]
+
+RULES_TABLE = 'fo_control_rule'
+RULES_FILE = os.environ.get('CONTROL_RULES_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'control_rules.json'))
+
+_COMPARISONS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+
+# Function to create the rule table; each row holds one rule definition as JSON
+def ensure_rule_table():
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {RULES_TABLE} (
+            id SERIAL PRIMARY KEY,
+            name TEXT UNIQUE NOT NULL,
+            definition JSONB NOT NULL,
+            enabled BOOLEAN NOT NULL DEFAULT TRUE
+        )
+        ''')
+        cursor.close()
+
+
+# Function to load the rule definitions: the enabled rows of the rule table if it has any,
+# otherwise the rules file if it exists, otherwise DEFAULT_RULES. Returns (rules, source).
+# Database errors are raised: the file and the defaults only stand in for a reachable but
+# empty rule table, never for a database that is down.
+def load_rules(path=RULES_FILE):
+    ensure_rule_table()
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT name, definition FROM {RULES_TABLE} WHERE enabled ORDER BY id")
+        rows = cursor.fetchall()
+        cursor.close()
+    if rows:
+        return [dict(definition, name=name) for name, definition in rows], RULES_TABLE
+
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f), path
+    return DEFAULT_RULES, 'defaults'
+
+
+# Function to load the rules, retrying with backoff until the rule table is reachable
+def wait_for_rules(path=RULES_FILE, max_backoff=60.0):
+    backoff = 1.0
+    while True:
+        try:
+            return load_rules(path)
+        except database.CONNECTION_ERRORS + (database.PoolError,) as e:
+            print(f"Control rules unavailable, retrying in {backoff:.0f}s: {e}")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, max_backoff)
+
+
+# Compile a threshold into a function of the settings dict returning a number or None
+def _compile_threshold(threshold):
+    if isinstance(threshold, (int, float)):
+        value = float(threshold)
+        return lambda settings: value, ()
+    terms = threshold if isinstance(threshold, list) else [threshold]
+    constant = 0.0
+    names = []  # (setting name, sign)
+    for term in terms:
+        if isinstance(term, (int, float)):
+            constant += term
+        elif term.startswith('-'):
+            names.append((term[1:], -1.0))
+        else:
+            names.append((term, 1.0))
+    if not names:
+        return lambda settings: constant, ()
+    if len(names) == 1 and names[0][1] > 0 and not constant:
+        name = names[0][0]
+        return lambda settings: settings.get(name), (name,)
+
+    def threshold_value(settings):
+        total = constant
+        for name, sign in names:
+            value = settings.get(name)
+            if value is None:
+                return None
+            total += sign * float(value)
+        return total
+    return threshold_value, tuple(name for name, _ in names)
+
+
+# One compiled rule: thresholds and comparisons resolved up front, so evaluating it is a
+# couple of lookups and comparisons
+class Rule:
+    def __init__(self, definition):
+        self.name = definition['name']
+        self.input = definition['input']
+        if self.input not in sensor_registry.BY_TOPIC:
+            raise ValueError(f"Rule {self.name}: unknown input {self.input}")
+        self.outputs = list(definition['outputs'])
+        self.on_state, self.off_state = definition.get('states', ['on', 'off'])
+        (on_op, on_threshold), (off_op, off_threshold) = definition['on'], definition['off']
+        self._on_compare = _COMPARISONS[on_op]
+        self._off_compare = _COMPARISONS[off_op]
+        self._on_threshold, on_settings = _compile_threshold(on_threshold)
+        self._off_threshold, off_settings = _compile_threshold(off_threshold)
+        self.settings = sorted(set(on_settings) | set(off_settings))
+
+    @property
+    def inputs(self):
+        return [self.input] + self.settings
+
+    # Output state for the given readings, or None to keep the current state
+    def decide(self, sensor_values, settings):
+        value = sensor_values.get(self.input)
+        if value is None:
+            return None
+        on_threshold = self._on_threshold(settings)
+        off_threshold = self._off_threshold(settings)
+        if on_threshold is None or off_threshold is None:
+            return None
+        if self._on_compare(value, on_threshold):
+            return self.on_state
+        if self._off_compare(value, off_threshold):
+            return self.off_state
+        return None
+
+
+# Function to compile rule definitions, raising ValueError (or KeyError for a missing
+# field) on an invalid one. Returns the compiled rules.
+def parse_rules(definitions):
+    rules = [Rule(definition) for definition in definitions]
+    names = [rule.name for rule in rules]
+    if len(set(names)) != len(names):
+        raise ValueError("Rule names must be unique")
+    return rules
+
+
+# Function to register compiled rules as loops of the control engine, keyed by their input
+# and the settings they use, so a change only evaluates the rules that read it.
+# sensor_values and settings are read live on every evaluation.
+def register_rules(rules, engine, sensor_values, settings):
+    for rule in rules:
+        engine.loop(rule.name, _rule_loop(rule, engine, sensor_values, settings), rule.inputs)
+
+
+# Function to compile rule definitions and register them with the control engine.
+# Returns the compiled rules.
+def compile_rules(definitions, engine, sensor_values, settings):
+    rules = parse_rules(definitions)
+    register_rules(rules, engine, sensor_values, settings)
+    return rules
+
+
+def _rule_loop(rule, engine, sensor_values, settings):
+    def run():
+        state = rule.decide(sensor_values, settings)
+        if state is not None:
+            for output in rule.outputs:
+                engine.actuate(output, state)
+    return run
+
+
+# Sensor topics read by the rules, to subscribe to
+def input_topics(rules):
+    return list(dict.fromkeys(rule.input for rule in rules))
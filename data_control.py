@@ -1,36 +1,47 @@
 import paho.mqtt.client as mqtt
-import psycopg2
-import json
 import time
 from datetime import datetime, timedelta
-import requests
 from dotenv import load_dotenv
 import os
+import signal
+import sys
 from supabase import create_client, Client
+from lag_buffer import LagBuffer
+import sensor_registry
+import database
+from batch_writer import BatchWriter
+from spool import Spool
+from connectivity import HealthMonitor, TRANSPORT_ERRORS
+from uploader import ChunkedUploader, UploadWorker
+from rollups import RollupRefresher
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Database configuration
-DATABASE_CONFIG = {
-    'dbname': 'sensordata',
-    'user': 'postgres',
-    'password': os.environ.get('DB_PASSWORD'),
-    'host': 'localhost',  # Assuming the database is hosted on the Raspberry Pi
-    'port': '5432'        # Default PostgreSQL port
-}
-
 # MQTT configuration
 MQTT_BROKER = '192.168.18.28'
 MQTT_PORT = 1883
-MQTT_TOPICS = ['cstr-ph', 'feed-ec', 'cstr-orp', 'cstr-temp', 'cstr-level', 
+MQTT_TOPICS = ['cstr-ph', 'feed-ec', 'cstr-orp', 'cstr-temp', 'cstr-level',
                'feed-level', 'feed-tds', 'feed-temp', 'ds-tds', 'ds-level', 'ds-ec', 'weight']
+SENSORS = sensor_registry.dispatch_table(MQTT_TOPICS)
 
 # Supabase configuration
 SUPABASE_URL = os.environ.get('SUPABASE_URL')
 SUPABASE_KEY = os.environ.get('SUPABASE_KEY')
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# Background health monitor probing the upload target; replaces the per-cycle HTTP check
+health = HealthMonitor(f"{SUPABASE_URL}/rest/v1/")
+
+# Sampling and upload schedules; uploads run on their own worker so they never delay sampling
+SAMPLE_INTERVAL = 30
+UPLOAD_INTERVAL = float(os.environ.get('UPLOAD_INTERVAL', '30'))
+UPLOAD_MAX_IN_FLIGHT = int(os.environ.get('UPLOAD_MAX_IN_FLIGHT', '2'))
+
+# Dashboard rollups (1 min / 15 min / 1 h) are folded in incrementally on their own thread
+ROLLUP_INTERVAL = float(os.environ.get('ROLLUP_INTERVAL', '60'))
+rollup_refresher = RollupRefresher(interval=ROLLUP_INTERVAL)
+
 # Global variables to store sensor data
 sensor_data = {
     'cstr_ph': None,
@@ -53,6 +64,33 @@ sensor_data = {
     'weight' : None
 }
 
+# Buffered, group-committed writer for sensor snapshots. BATCH_MAX_DELAY bounds how many
+# seconds of samples can be lost on a crash; BATCH_MAX_ROWS caps the size of one batch.
+# Batches that cannot be written while PostgreSQL is down are spooled to disk and replayed.
+BATCH_MAX_ROWS = int(os.environ.get('BATCH_MAX_ROWS', '100'))
+BATCH_MAX_DELAY = float(os.environ.get('BATCH_MAX_DELAY', '60'))
+SENSOR_COLUMNS = ['timestamp', 'cstr_ph', 'feed_ec', 'cstr_orp', 'ds_ec', 'cstr_temp', 'cstr_level', 'feed_level', 'feed_tds',
+                  'feed_temp', 'ds_tds', 'ds_level', 'vol_to_ds', 'com_vol_fs', 'flux', 'increase_in_fs', 'published', 'weight']
+sensor_writer = BatchWriter('fo_sensor_data', SENSOR_COLUMNS, max_rows=BATCH_MAX_ROWS, max_delay=BATCH_MAX_DELAY,
+                            spool=Spool('fo_sensor_data'))
+
+# Opt-in full-rate raw ingestion: every MQTT sample is stored in fo_sensor_raw with its own
+# arrival timestamp, via COPY in large batches. The 30 s wide snapshots in fo_sensor_data
+# keep being derived from the same samples.
+RAW_INGESTION = os.environ.get('RAW_INGESTION', '0').lower() in ('1', 'true', 'yes')
+RAW_BATCH_MAX_ROWS = int(os.environ.get('RAW_BATCH_MAX_ROWS', '5000'))
+RAW_BATCH_MAX_DELAY = float(os.environ.get('RAW_BATCH_MAX_DELAY', '5'))
+raw_writer = BatchWriter('fo_sensor_raw', ['timestamp', 'sensor', 'value'], max_rows=RAW_BATCH_MAX_ROWS,
+                         max_delay=RAW_BATCH_MAX_DELAY, max_buffered=RAW_BATCH_MAX_ROWS * 100, use_copy=True,
+                         spool=Spool('fo_sensor_raw'))
+
+# Lagged-value histories used for the derived metrics (vol_to_ds, flux, increase_in_fs)
+LAG_INTERVAL = timedelta(seconds=30)
+LAG_BUFFER_CAPACITY = 4096
+feed_level_history = LagBuffer(LAG_BUFFER_CAPACITY)
+feed_tds_history = LagBuffer(LAG_BUFFER_CAPACITY)
+LAG_HISTORIES = {'feed_level': feed_level_history, 'feed_tds': feed_tds_history}
+
 # Utility function to convert datetime to string
 def datetime_to_str(dt):
     return dt.strftime('%Y-%m-%d %H:%M:%S') if dt else None
@@ -64,45 +102,51 @@ def on_connect(client, userdata, flags, rc):
         client.subscribe(topic)
 
 def on_message(client, userdata, msg):
+    process_message(msg.topic, msg.payload, datetime.now())
+    publish_derived(client)
+
+# Last derived values published, so unchanged values are not sent again
+published_derived = {}
+
+# Function to push the derived metrics to the dashboards as retained MQTT messages, so a
+# dashboard gets the current value on subscribe and never has to query the database for it
+def publish_derived(client):
+    for sensor in sensor_registry.DERIVED:
+        value = sensor_data.get(sensor.column)
+        if value is not None and published_derived.get(sensor.column) != value:
+            client.publish(sensor.topic, value, retain=True)
+            published_derived[sensor.column] = value
+
+# Function to apply one sensor sample received at the given time
+def process_message(topic, raw_payload, now):
     global sensor_data
-    topic = msg.topic
-    payload = json.loads(msg.payload.decode())
-    sensor_data['timestamp'] = datetime.now()
+    sensor = SENSORS.get(topic)
+    if sensor is None:
+        return
+    value = sensor.parse(raw_payload)
+    if value is None:
+        print(f"Rejected payload on {topic}: {raw_payload!r}")
+        return
 
     # Update sensor data based on MQTT topic
-    if topic == 'cstr-ph':
-        sensor_data['cstr_ph'] = float(payload)
-    elif topic == 'feed-ec':
-        sensor_data['feed_ec'] = float(payload)
-    elif topic == 'cstr-orp':
-        sensor_data['cstr_orp'] = float(payload)
-    elif topic == 'cstr-temp':
-        sensor_data['cstr_temp'] = float(payload)
-    elif topic == 'cstr-level':
-        sensor_data['cstr_level'] = float(payload)
-    elif topic == 'feed-level':
-        sensor_data['feed_level'] = float(payload)
-    elif topic == 'feed-tds':
-        sensor_data['feed_tds'] = float(payload)
-    elif topic == 'feed-temp':
-        sensor_data['feed_temp'] = float(payload)
-    elif topic == 'ds-tds':
-        sensor_data['ds_tds'] = float(payload)
-    elif topic == 'ds-ec':
-        sensor_data['ds_ec'] = float(payload)
-    elif topic == 'ds-level':
-        sensor_data['ds_level'] = float(payload)
-    elif topic == 'weight':
-        sensor_data['weight'] = float(payload)
-    
+    sensor_data['timestamp'] = now
+    sensor_data[sensor.column] = value
+    history = LAG_HISTORIES.get(sensor.column)
+    if history is not None:
+        history.append(now, value)
+
+    # Record the individual sample when full-rate ingestion is enabled
+    if RAW_INGESTION:
+        raw_writer.add((now, sensor.column, value))
+
     # Calculate vol_to_ds, com_vol_fs, flux, and increase_in_fs based on the formulas
-    calculate_additional_params()
+    calculate_additional_params(now)
 
-def calculate_additional_params():
+def calculate_additional_params(now):
     global sensor_data
     
-    # Fetch previous values and ensure they are not None
-    previous_feed_level = fetch_previous_feed_level()
+    # Look up previous values from the in-memory history and ensure they are not None
+    previous_feed_level = feed_level_history.value_at(now - LAG_INTERVAL)
     current_feed_level = sensor_data['feed_level']
     if previous_feed_level is not None and current_feed_level is not None:
         sensor_data['vol_to_ds'] = previous_feed_level - current_feed_level
@@ -122,156 +166,108 @@ def calculate_additional_params():
     else:
         sensor_data['flux'] = None
     
-    # Fetch previous feed tds and ensure it's not None
-    previous_feed_tds = fetch_previous_feed_tds()
+    # Look up previous feed tds and ensure it's not None
+    previous_feed_tds = feed_tds_history.value_at(now - LAG_INTERVAL)
     current_feed_tds = sensor_data['feed_tds']
     if previous_feed_tds is not None and current_feed_tds is not None:
         sensor_data['increase_in_fs'] = current_feed_tds - previous_feed_tds
     else:
         sensor_data['increase_in_fs'] = None
 
-def fetch_previous_feed_level():
+# Function to warm the lagged-value histories from the database once at startup
+def warm_lag_buffers():
     try:
-        conn = psycopg2.connect(**DATABASE_CONFIG)
-        cursor = conn.cursor()
-        thirty_seconds_ago = datetime.now() - timedelta(seconds=30)
+        lagged_time = datetime.now() - LAG_INTERVAL
+        # Start from the last row at or before the lag horizon so the first lookups resolve
         query = '''
-        SELECT feed_level 
-        FROM fo_sensor_data 
-        WHERE timestamp <= %s 
-        ORDER BY timestamp DESC 
-        LIMIT 1;
+        SELECT timestamp, feed_level, feed_tds
+        FROM fo_sensor_data
+        WHERE timestamp >= COALESCE(
+            (SELECT MAX(timestamp) FROM fo_sensor_data WHERE timestamp <= %s), %s)
+        ORDER BY timestamp DESC
+        LIMIT %s;
         '''
-        cursor.execute(query, (thirty_seconds_ago,))
-        result = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        return result[0] if result else None
+        with database.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, (lagged_time, lagged_time, LAG_BUFFER_CAPACITY))
+            rows = cursor.fetchall()[::-1]
+            cursor.close()
+        feed_level_history.extend((row[0], row[1]) for row in rows)
+        feed_tds_history.extend((row[0], row[2]) for row in rows)
+        print(f"Warmed lag buffers with {len(rows)} rows from database.")
     except Exception as e:
-        print(f"Error fetching previous feed level: {e}")
-        return None
+        print(f"Error warming lag buffers: {e}")
 
-def fetch_previous_feed_tds():
-    try:
-        conn = psycopg2.connect(**DATABASE_CONFIG)
+# Function to create the narrow raw sample table used by full-rate ingestion
+def ensure_raw_table():
+    with database.connection() as conn:
         cursor = conn.cursor()
-        thirty_seconds_ago = datetime.now() - timedelta(seconds=30)
-        query = '''
-        SELECT feed_tds 
-        FROM fo_sensor_data 
-        WHERE timestamp <= %s 
-        ORDER BY timestamp DESC 
-        LIMIT 1;
-        '''
-        cursor.execute(query, (thirty_seconds_ago,))
-        result = cursor.fetchone()
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fo_sensor_raw (
+            timestamp TIMESTAMP NOT NULL,
+            sensor TEXT NOT NULL,
+            value DOUBLE PRECISION
+        );
+        CREATE INDEX IF NOT EXISTS fo_sensor_raw_sensor_timestamp_idx ON fo_sensor_raw (sensor, timestamp);
+        ''')
         cursor.close()
-        conn.close()
-        return result[0] if result else None
-    except Exception as e:
-        print(f"Error fetching previous feed tds: {e}")
-        return None
 
-# Ensure timestamp is valid before saving
+# Ensure timestamp is valid before queueing the snapshot for the next batch insert
 def save_to_database(data):
     if data['timestamp'] is None:
         print("Error: Timestamp is None, cannot save data to database.")
         return False
 
-    try:
-        conn = psycopg2.connect(**DATABASE_CONFIG)
-        cursor = conn.cursor()
-        insert_query = '''
-        INSERT INTO fo_sensor_data (timestamp, cstr_ph, feed_ec, cstr_orp, ds_ec, cstr_temp, cstr_level, feed_level, feed_tds, feed_temp, ds_tds, ds_level, vol_to_ds, com_vol_fs, flux, increase_in_fs, published, weight)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        '''
-        cursor.execute(insert_query, (data['timestamp'], data['cstr_ph'], data['feed_ec'], data['cstr_orp'], data['ds_ec'],
-                                     data['cstr_temp'], data['cstr_level'], data['feed_level'], data['feed_tds'], data['feed_temp'], data['ds_tds'], data['ds_level'], data['vol_to_ds'], data['com_vol_fs'], data['flux'], data['increase_in_fs'], data['published'], data['weight']))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        print("Data saved to database.")
-        return True
-    except Exception as e:
-        print(f"Error saving data to database: {e}")
-        return False
+    sensor_writer.add(tuple(data[column] for column in SENSOR_COLUMNS))
+    return True
 
-# Function to check internet connectivity
+# Function to check connectivity to the upload target (cached; never blocks)
 def is_connected():
-    try:
-        requests.get('http://www.google.com', timeout=5)
-        return True
-    except requests.ConnectionError:
-        return False
+    return health.is_up()
 
-# Function to upload unpublished data to an external service (e.g., Supabase)
-def upload_unpublished_data():
-    try:
-        conn = psycopg2.connect(**DATABASE_CONFIG)
-        cursor = conn.cursor()
-        
-        # Fetch and upload unpublished sensor data
-        cursor.execute("SELECT * FROM fo_sensor_data WHERE published = FALSE")
-        data = cursor.fetchall()
-        if data:
-            formatted_data = []
-            ids = []
-            for row in data:
-                ids.append(row[0])  # Assuming id is the first column
-                formatted_data.append({
-                    'timestamp': datetime_to_str(row[1]),
-                    'cstr_ph': row[2],
-                    'cstr_orp': row[3],
-                    'cstr_temp': row[4],
-                    'cstr_level': row[5],
-                    'feed_level': row[6],
-                    'feed_tds': row[7],
-                    'feed_temp': row[8],
-                    'vol_to_ds': row[9],
-                    'com_vol_fs': row[10],
-                    'flux': row[11],
-                    'increase_in_fs': row[12],
-                    'ds_tds': row[13],
-                    'ds_level': row[14],
-                    'feed_ec': row[15],
-                    'ds_ec': row[16],
-                    'weight' : row[17]
-                })
-            response = upload_data_to_external_service(formatted_data)
-            if response and response.data:
-                update_published_status(ids)
-                print("Sensor data uploaded and marked as published successfully.")
-            else:
-                print("Error uploading sensor data to external service")
+# Function to wake the upload worker as soon as the link comes back
+def on_connectivity_change(up):
+    if up:
+        upload_worker.wake()
 
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        print(f"Error uploading unpublished data: {e}")
+# Function to convert a fo_sensor_data row into the external service format
+def format_sensor_row(row):
+    return {
+        'timestamp': datetime_to_str(row[1]),
+        'cstr_ph': row[2],
+        'cstr_orp': row[3],
+        'cstr_temp': row[4],
+        'cstr_level': row[5],
+        'feed_level': row[6],
+        'feed_tds': row[7],
+        'feed_temp': row[8],
+        'vol_to_ds': row[9],
+        'com_vol_fs': row[10],
+        'flux': row[11],
+        'increase_in_fs': row[12],
+        'ds_tds': row[13],
+        'ds_level': row[14],
+        'feed_ec': row[15],
+        'ds_ec': row[16],
+        'weight' : row[17]
+    }
 
 # Function to upload sensor data to an external service (e.g., Supabase)
 def upload_data_to_external_service(data):
     try:
         response = supabase.table('fo_sensor_data').insert(data).execute()
+        health.report_success()
         return response
     except Exception as e:
+        if isinstance(e, TRANSPORT_ERRORS):
+            health.report_failure()  # Only a network error means the link is down
         print(f"Error uploading data to external service: {e}")
         return None
 
-# Function to update published status in the PostgreSQL database
-def update_published_status(ids):
-    try:
-        conn = psycopg2.connect(**DATABASE_CONFIG)
-        cursor = conn.cursor()
-        ids_tuple = tuple(ids)
-        update_query = "UPDATE fo_sensor_data SET published = TRUE WHERE id IN %s"
-        cursor.execute(update_query, (ids_tuple,))
-        conn.commit()
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        print(f"Error updating published status: {e}")
+# Streaming uploader for fo_sensor_data, tracked in the fo_sync_watermark table;
+# chunk size adapts to upload latency and failures
+sensor_uploader = ChunkedUploader('fo_sensor_data', format_sensor_row, upload_data_to_external_service)
+upload_worker = UploadWorker([sensor_uploader], health=health, interval=UPLOAD_INTERVAL, max_in_flight=UPLOAD_MAX_IN_FLIGHT)
 
 # Main loop to handle data processing
 def main_loop():
@@ -279,21 +275,50 @@ def main_loop():
     client.on_connect = on_connect
     client.on_message = on_message
 
+    warm_lag_buffers()
+    sensor_writer.start()
+    if RAW_INGESTION:
+        ensure_raw_table()
+        raw_writer.start()
+        print("Full-rate raw ingestion enabled.")
+    health.add_listener(on_connectivity_change)
+    health.start()
+    upload_worker.start()
+    rollup_refresher.start()
     client.connect(MQTT_BROKER, MQTT_PORT, 60)
     client.loop_start()
 
-    while True:
-        time.sleep(30)  # Check every minute
+    # Turn SIGTERM into a normal exit so buffered rows are flushed on shutdown
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        next_sample = time.monotonic()
+        while True:
+            # Sleep until the next sample on a fixed schedule, however long the last iteration took
+            next_sample += SAMPLE_INTERVAL
+            time.sleep(max(0.0, next_sample - time.monotonic()))
 
-        # Save data to local database if timestamp is valid
-        if sensor_data['timestamp'] is not None:
-            success = save_to_database(sensor_data)
-            if success:
-                sensor_data['published'] = False
+            # Save data to local database if timestamp is valid
+            if sensor_data['timestamp'] is not None:
+                success = save_to_database(sensor_data)
+                if success:
+                    sensor_data['published'] = False
 
-        # Check for internet connection and upload unpublished data
-        if is_connected():
-            upload_unpublished_data()
+            # Report upload lag from the background worker
+            for table, metrics in upload_worker.metrics().items():
+                if metrics['lag_rows']:
+                    print(f"Upload lag for {table}: {metrics['lag_rows']} rows, {metrics['lag_seconds']:.0f} s")
+    except KeyboardInterrupt:
+        print("Exiting")
+    finally:
+        client.loop_stop()
+        health.stop()
+        upload_worker.stop(timeout=10)
+        rollup_refresher.stop(timeout=10)
+        sensor_writer.close()
+        if RAW_INGESTION:
+            raw_writer.close()
+        database.pool.closeall()
 
 if __name__ == '__main__':
     main_loop()
\ No newline at end of file
@@ -0,0 +1,192 @@
+import asyncio
+import signal
+import time
+from datetime import datetime
+import paho.mqtt.client as mqtt
+import data_control
+import database
+
+# Pipeline configuration
+QUEUE_SIZE = 1000          # Bound on every inter-stage queue
+SNAPSHOT_INTERVAL = 30     # Seconds between wide snapshots in fo_sensor_data
+METRICS_INTERVAL = 60      # Seconds between metrics reports
+
+# Marker pushed through the queues to shut the stages down in order
+STOP = object()
+
+
+# Per-stage counters: items processed, throughput and latency from the time the item
+# entered the stage's input queue until the stage finished with it
+class StageMetrics:
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.dropped = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.started = time.monotonic()
+
+    def record(self, enqueued_at):
+        latency = time.monotonic() - enqueued_at
+        self.count += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'stage': self.name,
+            'count': self.count,
+            'dropped': self.dropped,
+            'per_second': self.count / elapsed if elapsed else 0.0,
+            'latency_avg_ms': self.latency_total / self.count * 1000 if self.count else 0.0,
+            'latency_max_ms': self.latency_max * 1000
+        }
+
+
+# asyncio version of the data_control pipeline: MQTT receive -> derive -> persist.
+# paho's network thread only hands messages to the event loop; derived metrics (published
+# back to MQTT for the dashboards) and database writes run in their own stages, and
+# uploads run on data_control's background upload worker, so neither a slow query nor a
+# slow upload stalls MQTT processing.
+class IngestionPipeline:
+    def __init__(self, loop):
+        self.loop = loop
+        self.incoming = asyncio.Queue(QUEUE_SIZE)
+        self.snapshots = asyncio.Queue(QUEUE_SIZE)
+        self.stopping = asyncio.Event()
+        self.metrics = {name: StageMetrics(name) for name in ('receive', 'derive', 'persist')}
+        self.client = mqtt.Client()
+        self.client.on_connect = data_control.on_connect
+        self.client.on_message = self._on_message
+
+    # Runs on paho's network thread; only timestamps the message and hands it over
+    def _on_message(self, client, userdata, msg):
+        item = (msg.topic, msg.payload, datetime.now(), time.monotonic())
+        self.loop.call_soon_threadsafe(self._enqueue, item)
+
+    def _enqueue(self, item):
+        try:
+            self.incoming.put_nowait(item)
+            self.metrics['receive'].record(item[3])
+        except asyncio.QueueFull:
+            self.metrics['receive'].dropped += 1
+
+    # Derive stage: apply samples, update lagged metrics and emit a snapshot every interval
+    async def derive(self):
+        metrics = self.metrics['derive']
+        next_snapshot = time.monotonic() + SNAPSHOT_INTERVAL
+        while True:
+            try:
+                item = await asyncio.wait_for(self.incoming.get(), max(0.0, next_snapshot - time.monotonic()))
+            except asyncio.TimeoutError:
+                item = None
+
+            if item is STOP:
+                await self.snapshots.put(STOP)
+                return
+            if item is not None:
+                topic, payload, received_at, enqueued_at = item
+                try:
+                    data_control.process_message(topic, payload, received_at)
+                    data_control.publish_derived(self.client)
+                except Exception as e:
+                    print(f"Error processing message on {topic}: {e}")
+                metrics.record(enqueued_at)
+
+            if time.monotonic() >= next_snapshot:
+                next_snapshot += SNAPSHOT_INTERVAL
+                if data_control.sensor_data['timestamp'] is not None:
+                    row = tuple(data_control.sensor_data[column] for column in data_control.SENSOR_COLUMNS)
+                    try:
+                        self.snapshots.put_nowait((row, time.monotonic()))
+                    except asyncio.QueueFull:
+                        metrics.dropped += 1
+
+    # Persist stage: group-commit snapshots, flushing in a worker thread
+    async def persist(self):
+        metrics = self.metrics['persist']
+        writer = data_control.sensor_writer
+        pending = []
+        oldest = None
+        while True:
+            timeout = None if oldest is None else max(0.0, oldest + writer.max_delay - time.monotonic())
+            try:
+                item = await asyncio.wait_for(self.snapshots.get(), timeout)
+            except asyncio.TimeoutError:
+                item = None
+
+            if item is not None and item is not STOP:
+                row, enqueued_at = item
+                writer.add(row)
+                pending.append(enqueued_at)
+                oldest = oldest or time.monotonic()
+
+            due = oldest is not None and time.monotonic() - oldest >= writer.max_delay
+            if item is STOP or due or len(pending) >= writer.max_rows:
+                if await self.loop.run_in_executor(None, writer.flush):
+                    for enqueued_at in pending:
+                        metrics.record(enqueued_at)
+                    pending, oldest = [], None
+                elif item is not STOP:
+                    oldest = time.monotonic()  # Retry after another max_delay
+            if item is STOP:
+                return
+
+    # Periodic per-stage latency and throughput report
+    async def report(self):
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), METRICS_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.print_metrics()
+
+    def print_metrics(self):
+        for metrics in self.metrics.values():
+            print(metrics.summary())
+        print({'stage': 'queues', 'incoming': self.incoming.qsize(), 'snapshots': self.snapshots.qsize()})
+        print({'stage': 'upload', **data_control.upload_worker.metrics()})
+
+    async def run(self):
+        await self.loop.run_in_executor(None, data_control.warm_lag_buffers)
+        if data_control.RAW_INGESTION:
+            await self.loop.run_in_executor(None, data_control.ensure_raw_table)
+            data_control.raw_writer.start()
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(signum, self.stopping.set)
+
+        data_control.health.add_listener(data_control.on_connectivity_change)
+        data_control.health.start()
+        data_control.upload_worker.start()
+        data_control.rollup_refresher.start()
+        self.client.connect(data_control.MQTT_BROKER, data_control.MQTT_PORT, 60)
+        self.client.loop_start()
+        stages = [asyncio.create_task(stage) for stage in (self.derive(), self.persist())]
+        reporter = asyncio.create_task(self.report())
+
+        await self.stopping.wait()
+        print("Exiting")
+
+        # Stop receiving, then drain derive and persist before tearing everything down
+        self.client.loop_stop()
+        data_control.health.stop()
+        await self.loop.run_in_executor(None, data_control.upload_worker.stop, 10)
+        await self.loop.run_in_executor(None, data_control.rollup_refresher.stop, 10)
+        await self.incoming.put(STOP)
+        await asyncio.gather(*stages)
+        await reporter
+        if data_control.RAW_INGESTION:
+            await self.loop.run_in_executor(None, data_control.raw_writer.close)
+        self.print_metrics()
+        database.pool.closeall()
+
+
+async def main():
+    pipeline = IngestionPipeline(asyncio.get_running_loop())
+    await pipeline.run()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,183 @@
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+import os
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Database configuration shared by every script
+DATABASE_CONFIG = {
+    'dbname': os.environ.get('DB_NAME', 'sensordata'),
+    'user': os.environ.get('DB_USER', 'postgres'),
+    'password': os.environ.get('DB_PASSWORD'),
+    'host': os.environ.get('DB_HOST', 'localhost'),  # Assuming the database is hosted on the Raspberry Pi
+    'port': os.environ.get('DB_PORT', '5432')        # Default PostgreSQL port
+}
+
+# Pool configuration
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))  # Seconds to wait for a free connection
+HEALTH_CHECK_AFTER = 30.0  # Idle seconds after which a connection is pinged before reuse
+
+# Errors after which a connection can no longer be trusted and is replaced
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+# Bounded, thread-safe pool of PostgreSQL connections.
+# Connections are opened lazily, pinged before reuse when they have been idle for a while,
+# and dropped and reopened when they turn out to be broken.
+class ConnectionPool:
+    def __init__(self, config, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT, check_after=HEALTH_CHECK_AFTER):
+        self.config = config
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_after = check_after
+        self._idle = []  # Stack of (connection, last_used) so the warmest connection is reused first
+        self._open = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            'checkouts': 0,
+            'connects': 0,
+            'reconnects': 0,
+            'failed_health_checks': 0,
+            'timeouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0
+        }
+
+    # Check a connection out of the pool, waiting up to timeout seconds for one to be free
+    def getconn(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        conn = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._open < self.max_size:
+                    self._open += 1
+                    last_used = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolError(f"No database connection available after {self.timeout}s")
+                self._cond.wait(remaining)
+            waited = time.monotonic() - started
+            self._stats['checkouts'] += 1
+            self._stats['wait_time_total'] += waited
+            self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+
+        try:
+            if conn is None:
+                conn = self._connect()
+            elif not self._is_healthy(conn, last_used):
+                self._stats['failed_health_checks'] += 1
+                self._stats['reconnects'] += 1
+                self._close_quietly(conn)
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    # Return a connection to the pool, or close it when it is broken or discard is set
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except CONNECTION_ERRORS:
+                discard = True
+        with self._cond:
+            if discard or conn.closed:
+                self._close_quietly(conn)
+                self._open -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    # Context manager yielding a pooled connection; commits on success, rolls back on error
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+            conn.commit()
+        except CONNECTION_ERRORS:
+            discard = True
+            raise
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    # Snapshot of pool counters, including connection wait times in seconds
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['open'] = self._open
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._open - len(self._idle)
+        stats['wait_time_avg'] = stats['wait_time_total'] / stats['checkouts'] if stats['checkouts'] else 0.0
+        return stats
+
+    # Close every idle connection, e.g. on shutdown
+    def closeall(self):
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._close_quietly(conn)
+                self._open -= 1
+            self._cond.notify_all()
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.config)
+        with self._cond:
+            self._stats['connects'] += 1
+        return conn
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except CONNECTION_ERRORS:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+# Process-wide pool used by every script
+pool = ConnectionPool(DATABASE_CONFIG)
+
+
+# Shortcut for pool.connection()
+def connection():
+    return pool.connection()
+
+
+# Shortcut for pool.stats()
+def pool_stats():
+    return pool.stats()
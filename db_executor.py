@@ -0,0 +1,124 @@
+import queue
+import threading
+import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Runs database queries and data preparation on worker threads for a Tk application and
+# delivers the results back on the Tk main thread.
+# Workers never touch Tk: finished futures are queued, and a poll scheduled with
+# root.after() drains the queue and calls on_done(result) or on_error(exception). Requests
+# submitted under a key supersede earlier ones with the same key, so when the user changes
+# the range only the newest result is delivered; stale ones are dropped (or cancelled if
+# they have not started yet). An optional LoadingLabel is shown until the newest request
+# for its key has been handled.
+class TkExecutor:
+    def __init__(self, root, workers=2, poll_ms=50):
+        self.root = root
+        self.poll_ms = poll_ms
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db")
+        self._results = queue.SimpleQueue()
+        self._latest = {}    # key -> future of the newest request for that key
+        self._pending = 0    # Submitted requests whose callbacks have not run yet
+        self._polling = False
+        self._lock = threading.Lock()
+
+    # Run fn(*args) on a worker; returns the Future. Must be called on the Tk thread.
+    def submit(self, fn, *args, on_done=None, on_error=None, key=None, loading=None):
+        if loading is not None:
+            loading.show()
+        future = self._pool.submit(fn, *args)
+        if key is not None:
+            previous = self._latest.get(key)
+            if previous is not None:
+                previous.cancel()
+            self._latest[key] = future
+        with self._lock:
+            self._pending += 1
+        future.add_done_callback(lambda f: self._results.put((f, key, on_done, on_error, loading)))
+        self._schedule_poll()
+        return future
+
+    # Drop the result of the outstanding request for key, if any
+    def cancel(self, key, loading=None):
+        future = self._latest.pop(key, None)
+        if future is not None:
+            future.cancel()
+        if loading is not None:
+            loading.hide()
+
+    # True while a request for key (or any request, without a key) is outstanding
+    def loading(self, key=None):
+        if key is None:
+            with self._lock:
+                return self._pending > 0
+        future = self._latest.get(key)
+        return future is not None and not future.done()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _schedule_poll(self):
+        if not self._polling:
+            self._polling = True
+            self.root.after(self.poll_ms, self._poll)
+
+    def _poll(self):
+        while True:
+            try:
+                future, key, on_done, on_error, loading = self._results.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._pending -= 1
+            if key is not None:
+                if self._latest.get(key) is not future:
+                    continue  # Superseded or cancelled; the newer request owns the loading state
+                del self._latest[key]
+            if future.cancelled():
+                continue
+            error = future.exception()
+            try:
+                if loading is not None:
+                    loading.hide()
+                if error is None:
+                    if on_done is not None:
+                        on_done(future.result())
+                elif on_error is not None:
+                    on_error(error)
+                else:
+                    print(f"Error in background request: {error}")
+            except Exception as e:
+                print(f"Error in background request callback: {e}")
+
+        with self._lock:
+            pending = self._pending
+        if pending:
+            self.root.after(self.poll_ms, self._poll)
+        else:
+            self._polling = False
+
+
+# "Loading..." overlay placed over a widget while its data is being fetched. All
+# LoadingLabels for the same widget share one label, so a superseded request's overlay is
+# the same one the newer request hides.
+class LoadingLabel:
+    NAME = 'loading'
+
+    def __init__(self, master, text="Loading...", **kwargs):
+        self.master = master
+        self.text = text
+        self.kwargs = kwargs
+
+    def show(self):
+        label = self.master.children.get(self.NAME)
+        if label is None:
+            label = tk.Label(self.master, name=self.NAME, **self.kwargs)
+        label.configure(text=self.text)
+        label.place(relx=0.5, rely=0.5, anchor="center")
+        label.lift()
+
+    def hide(self):
+        label = self.master.children.get(self.NAME)
+        if label is not None:
+            label.place_forget()
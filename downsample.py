@@ -0,0 +1,106 @@
+import os
+import numpy as np
+
+# Plot point budget: points per pixel of canvas width, and the budget used before the
+# canvas has been laid out. DOWNSAMPLE_METHOD is 'lttb' (shape-preserving) or 'minmax'
+# (keeps every spike).
+POINTS_PER_PIXEL = float(os.environ.get('PLOT_POINTS_PER_PIXEL', '1'))
+DEFAULT_POINT_BUDGET = int(os.environ.get('PLOT_POINT_BUDGET', '1000'))
+DOWNSAMPLE_METHOD = os.environ.get('DOWNSAMPLE_METHOD', 'lttb')
+MIN_POINT_BUDGET = 100
+
+
+# Largest-Triangle-Three-Buckets: indices of n_out points that keep the visual shape of
+# the series. x must be ascending; both arrays must be finite floats.
+def lttb_indices(x, y, n_out):
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # Buckets between the fixed first and last points, and the centroid of each one
+    every = (n - 2) / (n_out - 2)
+    edges = np.floor(np.arange(n_out - 1) * every).astype(np.int64) + 1
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[:-1], edges[:-1]) / counts
+    avg_y = np.add.reduceat(y[:-1], edges[:-1]) / counts
+    avg_x = np.append(avg_x[1:], x[-1])
+    avg_y = np.append(avg_y[1:], y[-1])
+
+    out = np.empty(n_out, dtype=np.int64)
+    out[0] = 0
+    out[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Twice the area of the triangle (selected point, candidate, next bucket centroid)
+        area = np.abs((x[a] - avg_x[i]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y[i] - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+
+# Min/max decimation: the lowest and highest point of each of n_out / 2 equal buckets,
+# plus the end points, so no spike is lost. y must be finite.
+def minmax_indices(y, n_out):
+    n = len(y)
+    if n_out >= n or n_out < 4:
+        return np.arange(n)
+
+    size = -(-n // (n_out // 2))
+    buckets = -(-n // size)
+    padded_min = np.full(buckets * size, np.inf)
+    padded_max = np.full(buckets * size, -np.inf)
+    padded_min[:n] = y
+    padded_max[:n] = y
+    offsets = np.arange(buckets) * size
+    lows = offsets + padded_min.reshape(buckets, size).argmin(axis=1)
+    highs = offsets + padded_max.reshape(buckets, size).argmax(axis=1)
+    return np.unique(np.concatenate(([0, n - 1], lows, highs)))
+
+
+# Min/max decimation over fixed buckets of the given width, aligned to x = 0: indices of
+# the lowest and highest point of every bucket, in order. Bucket edges do not depend on
+# the data, so a growing series can be decimated once per bucket as each one completes.
+# x must be ascending; y must be finite.
+def bucket_minmax_indices(x, y, width):
+    if not len(x):
+        return np.empty(0, dtype=np.int64)
+    buckets = np.floor(x / width).astype(np.int64)
+    order = np.lexsort((y, buckets))  # By bucket, then by value within each bucket
+    sorted_buckets = buckets[order]
+    first = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])
+    last = np.r_[first[1:] - 1, len(order) - 1]
+    return np.unique(np.concatenate((order[first], order[last])))
+
+
+# Point budget for a matplotlib Tk canvas: about one point per horizontal pixel
+def point_budget(canvas=None):
+    if canvas is not None:
+        width = canvas.get_tk_widget().winfo_width()
+        if width > 1:  # 1 until the widget has been laid out
+            return max(MIN_POINT_BUDGET, int(width * POINTS_PER_PIXEL))
+    return DEFAULT_POINT_BUDGET
+
+
+# Reduce a series to at most budget points before plotting; returns (x, y).
+# x may be datetimes (pandas or numpy); missing values are dropped first.
+def for_plot(x, y, budget=None, method=None):
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=np.float64)
+    budget = budget or DEFAULT_POINT_BUDGET
+    method = method or DOWNSAMPLE_METHOD
+
+    finite = np.isfinite(y)
+    if not finite.all():
+        x, y = x[finite], y[finite]
+    if len(y) <= budget:
+        return x, y
+
+    if method == 'minmax':
+        indices = minmax_indices(y, budget)
+    else:
+        # Work on float offsets from the first sample so datetimes keep their precision
+        xs = x.astype('datetime64[ns]').astype(np.int64) if np.issubdtype(x.dtype, np.datetime64) else x
+        xs = (xs - xs[0]).astype(np.float64)
+        indices = lttb_indices(xs, y, budget)
+    return x[indices], y[indices]
@@ -0,0 +1,234 @@
+import os
+import threading
+import time
+import psycopg2.extensions
+import database
+import rollups
+
+EXPORT_TABLE = 'fo_sensor_data'
+PARQUET_ROW_GROUP = 100000    # Rows fetched from the server-side cursor per Parquet row group
+PARQUET_COMPRESSION = 'zstd'
+
+
+# Raised inside an export when its job was cancelled
+class ExportCancelled(Exception):
+    pass
+
+
+# State shared between an export running on a worker thread and the UI polling it:
+# rows written so far, the expected total, and a cancel flag checked between chunks
+class ExportJob:
+    def __init__(self):
+        self.rows = 0
+        self.total = None
+        self.cancelled = threading.Event()
+        self.started = time.monotonic()
+        self.finished = None
+
+    def cancel(self):
+        self.cancelled.set()
+
+    # Fraction done in [0, 1], or None while the total is unknown
+    @property
+    def progress(self):
+        if not self.total:
+            return None
+        return min(1.0, self.rows / self.total)
+
+
+# Writable wrapper for the COPY target: counts exported rows and aborts on cancel
+class _CountingWriter:
+    def __init__(self, file, job, header):
+        self.file = file
+        self.job = job
+        self.header = header
+
+    def write(self, data):
+        if self.job.cancelled.is_set():
+            raise ExportCancelled()
+        self.file.write(data)
+        rows = data.count(b'\n' if isinstance(data, bytes) else '\n')
+        if self.header and rows:
+            rows -= 1
+            self.header = False
+        self.job.rows += rows
+
+
+# Function to list every column of the export table in table order
+def table_columns():
+    return list(column_types())
+
+
+# Function to map every column of the export table to its Postgres data type, in table order
+def column_types():
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_name = %s ORDER BY ordinal_position
+        ''', (EXPORT_TABLE,))
+        types = dict(cursor.fetchall())
+        cursor.close()
+    return types
+
+
+# Function to build the export query for [start, end], optionally limited to the times of
+# day [day_start, day_end] (e.g. '08:00' to '17:00'; a range past midnight wraps around).
+# resolution is 'raw' for the source rows or a rollup name ('1m', '15m', '1h') for bucket
+# averages, one row per bucket. Columns are checked against the table so they can be
+# interpolated safely. Returns (query, count query, params, columns).
+def export_query(columns, start, end, day_start=None, day_end=None, resolution='raw'):
+    if resolution == 'raw':
+        known = table_columns()
+        time_column = 'timestamp'
+    else:
+        known = ['timestamp'] + rollups.sensor_columns()
+        time_column = 'bucket'
+        if columns:
+            # Table columns that are not rolled up (id, published) have nothing to export
+            table = table_columns()
+            columns = [column for column in columns if column in known or column not in table]
+    columns = list(columns) if columns else known
+    unknown = [column for column in columns if column not in known]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+
+    where = f"{time_column} BETWEEN %s AND %s"
+    params = [start, end]
+    if day_start is not None and day_end is not None:
+        joiner = 'AND' if day_start <= day_end else 'OR'
+        where += f" AND ({time_column}::time >= %s {joiner} {time_column}::time <= %s)"
+        params += [day_start, day_end]
+
+    if resolution == 'raw':
+        query = f"SELECT {', '.join(columns)} FROM {EXPORT_TABLE} WHERE {where} ORDER BY timestamp"
+        count_query = f"SELECT COUNT(*) FROM {EXPORT_TABLE} WHERE {where}"
+    else:
+        table = next(r[1] for r in rollups.RESOLUTIONS if r[0] == resolution)
+        selected = ', '.join('bucket AS timestamp' if column == 'timestamp' else
+                             f"MAX(sum / count) FILTER (WHERE sensor = '{column}') AS {column}" for column in columns)
+        query = f"SELECT {selected} FROM {table} WHERE {where} GROUP BY bucket ORDER BY bucket"
+        count_query = f"SELECT COUNT(DISTINCT bucket) FROM {table} WHERE {where}"
+    return query, count_query, params, columns
+
+
+# Function to stream an export to a CSV file with COPY ... TO STDOUT. Postgres writes the
+# rows straight into the file in chunks, so memory use does not grow with the range.
+# Returns the number of rows written; raises ExportCancelled if job was cancelled. The
+# partial file is removed when the export is cancelled or fails.
+def export_csv(file_path, start, end, columns=None, day_start=None, day_end=None, job=None, resolution='raw'):
+    job = job or ExportJob()
+    query, count_query, params, _ = export_query(columns, start, end, day_start, day_end, resolution)
+    conn = database.pool.getconn()
+    discard = False
+    opened = False  # Whether file_path has been (re)created, so a failure must remove it
+    try:
+        cursor = conn.cursor()
+        cursor.execute(count_query, params)
+        job.total = cursor.fetchone()[0]
+        if job.cancelled.is_set():
+            raise ExportCancelled()
+        copy = f"COPY ({cursor.mogrify(query, params).decode()}) TO STDOUT WITH (FORMAT csv, HEADER)"
+        opened = True
+        with open(file_path, 'wb') as f:
+            cursor.copy_expert(copy, _CountingWriter(f, job, header=True))
+        cursor.close()
+        conn.commit()
+    except Exception as e:
+        # Cancelled or failed (database or disk error): never leave a truncated file
+        if opened:
+            _remove_quietly(file_path)
+        if opened or isinstance(e, database.CONNECTION_ERRORS):
+            discard = True  # The connection may still be in the middle of the COPY
+        elif not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        database.pool.putconn(conn, discard=discard)
+        job.finished = time.monotonic()
+    return job.rows
+
+
+# Numeric columns are read as floats so they fit the float64 Parquet columns
+_DECIMAL_AS_FLOAT = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values, 'DECIMAL_AS_FLOAT', lambda value, cursor: float(value) if value is not None else None)
+
+
+# Arrow type for a Postgres column type; rollup averages are always doubles
+def _arrow_type(data_type):
+    import pyarrow as pa
+    if data_type.startswith('timestamp'):
+        return pa.timestamp('us')
+    if data_type in ('integer', 'bigint', 'smallint'):
+        return pa.int64()
+    if data_type == 'boolean':
+        return pa.bool_()
+    if data_type in ('double precision', 'real', 'numeric'):
+        return pa.float64()
+    return pa.string()
+
+
+# Function to stream an export to a zstd-compressed Parquet file. Rows are read through a
+# server-side cursor PARQUET_ROW_GROUP at a time and each batch is written as one row group
+# of typed columns, so memory use is bounded by the row group size. Same arguments and
+# cancellation behaviour as export_csv, and the partial file is removed on any error;
+# needs pyarrow.
+def export_parquet(file_path, start, end, columns=None, day_start=None, day_end=None, job=None, resolution='raw'):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)") from e
+
+    job = job or ExportJob()
+    query, count_query, params, columns = export_query(columns, start, end, day_start, day_end, resolution)
+    types = column_types() if resolution == 'raw' else {}
+    schema = pa.schema([(column, _arrow_type(types.get(column, 'timestamp' if column == 'timestamp' else 'double precision')))
+                        for column in columns])
+    opened = False  # Whether file_path has been (re)created, so a failure must remove it
+    try:
+        with database.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(count_query, params)
+            job.total = cursor.fetchone()[0]
+            cursor.close()
+
+            cursor = conn.cursor(name='fo_export')  # Server-side: rows stay on the server until fetched
+            cursor.itersize = PARQUET_ROW_GROUP
+            psycopg2.extensions.register_type(_DECIMAL_AS_FLOAT, cursor)
+            cursor.execute(query, params)
+            opened = True
+            with pq.ParquetWriter(file_path, schema, compression=PARQUET_COMPRESSION) as writer:
+                while True:
+                    if job.cancelled.is_set():
+                        raise ExportCancelled()
+                    rows = cursor.fetchmany(PARQUET_ROW_GROUP)
+                    if not rows:
+                        break
+                    batch = pa.table([pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)],
+                                     schema=schema)
+                    writer.write_table(batch)
+                    job.rows += len(rows)
+            cursor.close()
+    except Exception:
+        # Cancelled or failed (database, type or disk error): never leave a truncated file
+        if opened:
+            _remove_quietly(file_path)
+        raise
+    finally:
+        job.finished = time.monotonic()
+    return job.rows
+
+
+# Function to export to CSV or Parquet depending on the file extension
+def export_file(file_path, *args, **kwargs):
+    if file_path.lower().endswith('.parquet'):
+        return export_parquet(file_path, *args, **kwargs)
+    return export_csv(file_path, *args, **kwargs)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,55 @@
+import threading
+
+
+# Fixed-capacity ring buffer of (timestamp, value) samples for a single sensor.
+# Samples are kept in arrival order, so "value at or before t" is a binary search
+# over the live window instead of a database round trip.
+class LagBuffer:
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self._times = [None] * capacity
+        self._values = [None] * capacity
+        self._start = 0  # Physical index of the oldest sample
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    # Append a sample; out-of-order samples are dropped to keep the buffer sorted
+    def append(self, timestamp, value):
+        if value is None:
+            return False
+        with self._lock:
+            if self._size:
+                newest = (self._start + self._size - 1) % self.capacity
+                if timestamp < self._times[newest]:
+                    return False
+            if self._size < self.capacity:
+                index = (self._start + self._size) % self.capacity
+                self._size += 1
+            else:
+                index = self._start
+                self._start = (self._start + 1) % self.capacity
+            self._times[index] = timestamp
+            self._values[index] = value
+            return True
+
+    # Latest value recorded at or before the given timestamp, or None
+    def value_at(self, timestamp):
+        with self._lock:
+            low, high = 0, self._size
+            while low < high:
+                mid = (low + high) // 2
+                if self._times[(self._start + mid) % self.capacity] <= timestamp:
+                    low = mid + 1
+                else:
+                    high = mid
+            if low == 0:
+                return None
+            return self._values[(self._start + low - 1) % self.capacity]
+
+    # Warm the buffer from (timestamp, value) rows, e.g. a database query result
+    def extend(self, rows):
+        for timestamp, value in rows:
+            self.append(timestamp, value)
@@ -0,0 +1,37 @@
+import threading
+
+
+# Thread-safe store of the newest value per key.
+# Writers (e.g. paho's network thread) only overwrite the value and mark the key changed;
+# the UI takes the changed values once per frame, so a burst of messages for one key costs
+# a single redraw. A write that replaces a value the UI has not taken yet is counted as
+# coalesced.
+class LatestValues:
+    def __init__(self, keys=()):
+        self._lock = threading.Lock()
+        self._values = dict.fromkeys(keys)
+        self._changed = set()
+        self.stats = {'updates': 0, 'coalesced': 0}
+
+    def set(self, key, value):
+        with self._lock:
+            if key in self._changed:
+                self.stats['coalesced'] += 1
+            self._values[key] = value
+            self._changed.add(key)
+            self.stats['updates'] += 1
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._values.get(key, default)
+
+    # Values set since the last call, as {key: value}
+    def take_changed(self):
+        with self._lock:
+            changed = {key: self._values[key] for key in self._changed}
+            self._changed.clear()
+        return changed
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
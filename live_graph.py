@@ -0,0 +1,171 @@
+import matplotlib.dates as mdates
+import numpy as np
+import downsample
+
+
+# Growable x/y buffer for one line: appends cost O(new points) amortized, and trimming
+# the start of the window only moves an offset, so neither copies the whole history
+class _SeriesBuffer:
+    def __init__(self, capacity=1024):
+        self._x = np.empty(capacity)
+        self._y = np.empty(capacity)
+        self._start = 0
+        self._end = 0
+
+    @property
+    def x(self):
+        return self._x[self._start:self._end]
+
+    @property
+    def y(self):
+        return self._y[self._start:self._end]
+
+    def append(self, x, y):
+        n = len(x)
+        if self._end + n > len(self._x):
+            size = self._end - self._start
+            if 2 * (size + n) > len(self._x):
+                # Grow, leaving room for as many points again
+                capacity = 2 * (size + n)
+                self._x = np.concatenate((self.x, np.empty(capacity - size)))
+                self._y = np.concatenate((self.y, np.empty(capacity - size)))
+            else:
+                # Plenty of room once the trimmed points are dropped: move the live part to the front
+                self._x[:size] = self.x
+                self._y[:size] = self.y
+            self._start, self._end = 0, size
+        self._x[self._end:self._end + n] = x
+        self._y[self._end:self._end + n] = y
+        self._end += n
+
+    # Drop the points before start
+    def trim(self, start):
+        self._start += int(np.searchsorted(self.x, start))
+
+
+# Sliding-window graph that is refreshed incrementally.
+# Each update() appends only rows newer than the last one seen, trims points that fell
+# out of the window, and blits just the lines over a cached background. Lines are
+# decimated to the canvas point budget with min/max over fixed time buckets: a bucket is
+# decimated once, when it completes, and only the still-filling bucket is drawn raw, so
+# an update costs in proportion to the new rows and the budget, not the window, and the
+# drawn line does not shift between updates. Axes limits are padded by margin so a full
+# redraw (ticks, labels, background) is only needed when new data leaves the current limits.
+class LiveGraph:
+    def __init__(self, ax, canvas, columns, window, margin=0.05):
+        self.ax = ax
+        self.canvas = canvas
+        self.columns = list(columns)
+        self.window = window
+        self.margin = margin
+        self.last = None  # Timestamp of the newest row appended so far
+        self.lines = {
+            column: ax.plot([], [], marker='o', linestyle='-', label=column, animated=True)[0]
+            for column in self.columns
+        }
+        self._raw = {column: _SeriesBuffer() for column in self.columns}
+        self._decimated = {column: (np.empty(0), np.empty(0)) for column in self.columns}  # Completed buckets
+        self._decimated_until = {column: -np.inf for column in self.columns}  # Start of the first undecimated bucket
+        self._bucket_width = None  # In days, the unit of the date axis
+        self._plotted_y = {column: np.empty(0) for column in self.columns}
+        self._background = None
+        ax.xaxis_date()
+        self.stats = {'full_draws': 0, 'blits': 0, 'points_appended': 0}
+        canvas.mpl_connect('draw_event', self._on_draw)
+
+    # Append the rows of frame (timestamp column plus self.columns) newer than self.last,
+    # drop points older than now - window and redraw
+    def update(self, frame, now):
+        if self.last is not None:
+            frame = frame[frame['timestamp'] > self.last]
+        if len(frame):
+            self.last = frame['timestamp'].iloc[-1]
+
+        x_new = mdates.date2num(frame['timestamp'].to_numpy())
+        start = mdates.date2num(np.datetime64(now - self.window))
+        width = self._width_for(downsample.point_budget(self.canvas))
+        if width != self._bucket_width:
+            # Canvas resized past a power of two: decimate the window again with the new buckets
+            self._bucket_width = width
+            for column in self.columns:
+                self._decimated[column] = (np.empty(0), np.empty(0))
+                self._decimated_until[column] = -np.inf
+
+        for column in self.columns:
+            y_new = frame[column].to_numpy(dtype=np.float64)
+            keep = np.isfinite(y_new)
+            raw = self._raw[column]
+            raw.append(x_new[keep], y_new[keep])
+            raw.trim(start)
+            self.stats['points_appended'] += int(keep.sum())
+            self.lines[column].set_data(*self._line_data(column, start))
+
+        if self._rescale(start, mdates.date2num(np.datetime64(now))) or self._background is None:
+            self.canvas.draw()
+        else:
+            self._blit()
+
+    # Bucket width giving at most budget points over the window (two per bucket), with
+    # the bucket count rounded down to a power of two so small resizes keep the buckets
+    def _width_for(self, budget):
+        buckets = 2 ** max(1, int(np.log2(max(2, budget // 2))))
+        return (self.window.total_seconds() / 86400) / buckets
+
+    # Decimate the buckets completed since the last update, drop decimated points that left
+    # the window, and return the decimated points followed by the raw still-filling bucket
+    def _line_data(self, column, start):
+        x, y = self._raw[column].x, self._raw[column].y
+        decimated_x, decimated_y = self._decimated[column]
+        if len(x):
+            open_bucket = np.floor(x[-1] / self._bucket_width) * self._bucket_width
+            lo = int(np.searchsorted(x, self._decimated_until[column]))
+            hi = int(np.searchsorted(x, open_bucket))
+            if hi > lo:
+                indices = downsample.bucket_minmax_indices(x[lo:hi], y[lo:hi], self._bucket_width) + lo
+                decimated_x = np.concatenate((decimated_x, x[indices]))
+                decimated_y = np.concatenate((decimated_y, y[indices]))
+            self._decimated_until[column] = open_bucket
+        cut = int(np.searchsorted(decimated_x, start))
+        decimated_x, decimated_y = decimated_x[cut:], decimated_y[cut:]
+        self._decimated[column] = (decimated_x, decimated_y)
+
+        tail = int(np.searchsorted(x, self._decimated_until[column]))
+        line_x = np.concatenate((decimated_x, x[tail:]))
+        line_y = np.concatenate((decimated_y, y[tail:]))
+        self._plotted_y[column] = line_y
+        return line_x, line_y
+
+    # Widen the limits when data left them; returns True if they changed
+    def _rescale(self, start, end):
+        span = end - start
+        x_min, x_max = self.ax.get_xlim()
+        changed = False
+        if end > x_max or x_min < start - span * self.margin:
+            self.ax.set_xlim(start, end + span * self.margin)
+            changed = True
+
+        # Min/max decimation keeps every extreme, so the plotted points give the data range
+        values = [self._plotted_y[column] for column in self.columns if len(self._plotted_y[column])]
+        if values:
+            low = min(float(v.min()) for v in values)
+            high = max(float(v.max()) for v in values)
+            y_min, y_max = self.ax.get_ylim()
+            if changed or low < y_min or high > y_max:
+                pad = (high - low) * self.margin or abs(high) * self.margin or 1.0
+                self.ax.set_ylim(low - pad, high + pad)
+                changed = True
+        return changed
+
+    def _blit(self):
+        self.canvas.restore_region(self._background)
+        for line in self.lines.values():
+            self.ax.draw_artist(line)
+        self.canvas.blit(self.ax.bbox)
+        self.stats['blits'] += 1
+
+    # After every full draw, cache the background without the lines, then draw the lines on top
+    def _on_draw(self, event):
+        self._background = self.canvas.copy_from_bbox(self.ax.bbox)
+        for line in self.lines.values():
+            self.ax.draw_artist(line)
+        self.stats['full_draws'] += 1
@@ -1,25 +1,23 @@
 import paho.mqtt.client as mqtt
-import psycopg2
-import json
 import time
 from datetime import datetime, timedelta
-import requests
 from supabase import create_client, Client
 from dotenv import load_dotenv
 import os
+import signal
+import sys
+from lag_buffer import LagBuffer
+import sensor_registry
+import database
+from batch_writer import BatchWriter
+from spool import Spool
+from connectivity import HealthMonitor, TRANSPORT_ERRORS
+from uploader import ChunkedUploader, UploadWorker
+from rollups import RollupRefresher
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Database configuration
-DATABASE_CONFIG = {
-    'dbname': 'sensordata',
-    'user': 'postgres',
-    'password': os.environ.get('DB_PASSWORD'),
-    'host': 'localhost',  # Assuming the database is hosted on the Raspberry Pi
-    'port': '5432'        # Default PostgreSQL port
-}
-
 # Supabase configuration
 SUPABASE_URL = os.environ.get('SUPABASE_URL')
 SUPABASE_KEY = os.environ.get('SUPABASE_KEY')
@@ -27,11 +25,24 @@ SUPABASE_KEY = os.environ.get('SUPABASE_KEY')
 # Create Supabase client
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# Background health monitor probing the upload target; replaces the per-cycle HTTP check
+health = HealthMonitor(f"{SUPABASE_URL}/rest/v1/")
+
+# Sampling and upload schedules; uploads run on their own worker so they never delay sampling
+SAMPLE_INTERVAL = 30
+UPLOAD_INTERVAL = float(os.environ.get('UPLOAD_INTERVAL', '30'))
+UPLOAD_MAX_IN_FLIGHT = int(os.environ.get('UPLOAD_MAX_IN_FLIGHT', '2'))
+
+# Dashboard rollups (1 min / 15 min / 1 h) are folded in incrementally on their own thread
+ROLLUP_INTERVAL = float(os.environ.get('ROLLUP_INTERVAL', '60'))
+rollup_refresher = RollupRefresher(interval=ROLLUP_INTERVAL)
+
 # MQTT configuration
 MQTT_BROKER = '192.168.18.28'
 MQTT_PORT = 1883
 MQTT_TOPICS = ['cstr-level', 'cstr-temp', 'cstr-ph', 'cstr-orp', 'cstr-ec', 'cstr-tds', 'feed-level', 'feed-temp', 'feed-tds', 'ds-level', 'ds-tds']
-FLUX_TOPIC = 'flux'
+SENSORS = sensor_registry.dispatch_table(MQTT_TOPICS)
+FLUX_TOPIC = sensor_registry.MD_FLUX.topic
 
 # Global variables to store sensor data
 fo_sensor_data = {
@@ -50,6 +61,21 @@ fo_sensor_data = {
     'published': False
 }
 
+# Buffered, group-committed writer for sensor snapshots. BATCH_MAX_DELAY bounds how many
+# seconds of samples can be lost on a crash; BATCH_MAX_ROWS caps the size of one batch.
+# Batches that cannot be written while PostgreSQL is down are spooled to disk and replayed.
+BATCH_MAX_ROWS = int(os.environ.get('BATCH_MAX_ROWS', '100'))
+BATCH_MAX_DELAY = float(os.environ.get('BATCH_MAX_DELAY', '60'))
+SENSOR_COLUMNS = ['timestamp', 'cstr_temp', 'cstr_level', 'cstr_ph', 'cstr_orp', 'cstr_ec', 'cstr_tds', 'feed_temp',
+                  'feed_level', 'feed_tds', 'ds_level', 'ds_tds', 'flux', 'published']
+sensor_writer = BatchWriter('fo_sensor_data', SENSOR_COLUMNS, max_rows=BATCH_MAX_ROWS, max_delay=BATCH_MAX_DELAY,
+                            spool=Spool('fo_sensor_data'))
+
+# Lagged ds level history used to derive flux without querying the database
+FLUX_LAG_INTERVAL = timedelta(minutes=1)
+LAG_BUFFER_CAPACITY = 4096
+ds_level_history = LagBuffer(LAG_BUFFER_CAPACITY)
+
 # Utility function to convert datetime to string
 def datetime_to_str(dt):
     return dt.strftime('%Y-%m-%d %H:%M:%S') if dt else None
@@ -62,153 +88,112 @@ def on_connect(client, userdata, flags, rc):
 
 def on_message(client, userdata, msg):
     global fo_sensor_data
-    topic = msg.topic
-    payload = json.loads(msg.payload.decode())
-    fo_sensor_data['timestamp'] = datetime.now()
-
-    if topic == 'cstr-temp':
-        fo_sensor_data['cstr_temp'] = float(payload)
-    elif topic == 'cstr-level':
-        fo_sensor_data['cstr_level'] = float(payload)
-    elif topic == 'cstr-ph':
-        fo_sensor_data['cstr_ph'] = float(payload)
-    elif topic == 'cstr-ec':
-        fo_sensor_data['cstr_ec'] = float(payload)
-    elif topic == 'cstr-orp':
-        fo_sensor_data['cstr_orp'] = float(payload)
-    elif topic == 'cstr-tds':
-        fo_sensor_data['cstr_tds'] = float(payload)
-    elif topic == 'feed-temp':
-        fo_sensor_data['feed_temp'] = float(payload)
-    elif topic == 'feed-level':
-        fo_sensor_data['feed_level'] = float(payload)
-    elif topic == 'feed-tds':
-        fo_sensor_data['feed_tds'] = float(payload)
-    elif topic == 'ds-level':
-        fo_sensor_data['ds_level'] = float(payload)
-    elif topic == 'ds-tds':
-        fo_sensor_data['ds_tds'] = float(payload)
-
-# Function to calculate flux
-def calculate_flux(current_level, conn, mqtt_client):
+    sensor = SENSORS.get(msg.topic)
+    if sensor is None:
+        return
+    value = sensor.parse(msg.payload)
+    if value is None:
+        print(f"Rejected payload on {msg.topic}: {msg.payload!r}")
+        return
+
+    now = datetime.now()
+    fo_sensor_data['timestamp'] = now
+    fo_sensor_data[sensor.column] = value
+    if sensor.column == 'ds_level':
+        ds_level_history.append(now, value)
+
+# Function to calculate flux from the in-memory ds level history
+def calculate_flux(current_level, mqtt_client):
     try:
-        cursor = conn.cursor()
-        one_minute_ago = datetime.now() - timedelta(minutes=1)
-        query = '''
-        SELECT ds_level 
-        FROM fo_sensor_data 
-        WHERE timestamp <= %s 
-        ORDER BY timestamp DESC 
-        LIMIT 1;
-        '''
-        cursor.execute(query, (one_minute_ago,))
-        result = cursor.fetchone()
-        cursor.close()
-        if result:
-            previous_level = result[0]
+        one_minute_ago = datetime.now() - FLUX_LAG_INTERVAL
+        previous_level = ds_level_history.value_at(one_minute_ago)
+        if previous_level is not None:
             flux = current_level - previous_level
         else:
             flux = 0  # If no previous data is found, assume no change
 
-        mqtt_client.publish(FLUX_TOPIC, flux)
+        # Retained, so dashboards get the current flux as soon as they subscribe
+        mqtt_client.publish(FLUX_TOPIC, flux, retain=True)
         return flux
     except Exception as e:
         print(f"Error calculating flux: {e}")
         return 0
 
-# Function to save data to the PostgreSQL database
-def save_to_database(data, mqtt_client):
+# Function to warm the ds level history from the database once at startup
+def warm_lag_buffers():
     try:
-        conn = psycopg2.connect(**DATABASE_CONFIG)
-        flux = calculate_flux(data['ds_level'], conn, mqtt_client)
-        cursor = conn.cursor()
-        insert_query = '''
-        INSERT INTO fo_sensor_data (timestamp, cstr_temp, cstr_level, cstr_ph, cstr_orp, cstr_ec, cstr_tds, feed_temp, feed_level, feed_tds,  ds_level, ds_tds, flux, published)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        lagged_time = datetime.now() - FLUX_LAG_INTERVAL
+        # Start from the last row at or before the lag horizon so the first lookups resolve
+        query = '''
+        SELECT timestamp, ds_level
+        FROM fo_sensor_data
+        WHERE timestamp >= COALESCE(
+            (SELECT MAX(timestamp) FROM fo_sensor_data WHERE timestamp <= %s), %s)
+        ORDER BY timestamp DESC
+        LIMIT %s;
         '''
-        cursor.execute(insert_query, (data['timestamp'], data['cstr_temp'], data['cstr_level'], data['cstr_ph'], data['cstr_orp'], data['cstr_ec'], data['cstr_tds'], data['mtank_temp'], data['mtank_level'], data['effluent_level'], flux, data['published']))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        print("Data saved to database.")
+        with database.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, (lagged_time, lagged_time, LAG_BUFFER_CAPACITY))
+            rows = cursor.fetchall()[::-1]
+            cursor.close()
+        ds_level_history.extend(rows)
+        print(f"Warmed lag buffers with {len(rows)} rows from database.")
+    except Exception as e:
+        print(f"Error warming lag buffers: {e}")
+
+# Function to queue a sensor snapshot for the next batch insert into the PostgreSQL database
+def save_to_database(data, mqtt_client):
+    try:
+        flux = calculate_flux(data['ds_level'], mqtt_client)
+        row = dict(data, flux=flux)
+        sensor_writer.add(tuple(row[column] for column in SENSOR_COLUMNS))
         return True, flux
     except Exception as e:
         print(f"Error saving data to database: {e}")
         return False, None
 
-# Function to check internet connectivity
+# Function to check connectivity to the upload target (cached; never blocks)
 def is_connected():
-    try:
-        requests.get('http://www.google.com', timeout=5)
-        return True
-    except requests.ConnectionError:
-        return False
+    return health.is_up()
 
-# Function to upload unpublished data to Supabase
-def upload_unpublished_data():
-    try:
-        conn = psycopg2.connect(**DATABASE_CONFIG)
-        cursor = conn.cursor()
-        
-        # Fetch and upload unpublished sensor data
-        cursor.execute("SELECT * FROM fo_sensor_data WHERE published = FALSE")
-        data = cursor.fetchall()
-        if data:
-            formatted_data = []
-            ids = []
-            for row in data:
-                ids.append(row[0])  # Assuming id is the first column
-                formatted_data.append({
-                    'timestamp': datetime_to_str(row[1]),
-                    'cstr_temp': row[2],
-                    'cstr_level': row[3],
-                    'cstr_ph': row[4],
-                    'cstr_orp': row[5],
-                    'cstr_ec': row[6],
-                    'cstr_tds': row[7],
-                    'mtank_temp': row[8],
-                    'mtank_level': row[9],
-                    'effluent_level': row[10],
-                    'flux': row[11]
-                })
-            response = upload_data_to_supabase(formatted_data)
-            if response and response.data:
-                update_published_status(ids)
-                print("Sensor data uploaded and marked as published successfully.")
-            else:
-                print("Error uploading sensor data to Supabase")
-
-        # Fetch and upload unpublished temp settings
-        cursor.execute("SELECT * FROM fo_temp_setting WHERE published = FALSE")
-        temp_data = cursor.fetchall()
-        if temp_data:
-            formatted_temp_data = []
-            temp_ids = []
-            for row in temp_data:
-                temp_ids.append(row[0])  # Assuming id is the first column
-                formatted_temp_data.append({
-                    'timestamp': datetime_to_str(row[1]),
-                    'set_temp': row[2]
-                })
-            response = upload_data_to_supabase_temp(formatted_temp_data)
-            if response and response.data:
-                update_published_status_temp(temp_ids)
-                print("Temp setting data uploaded and marked as published successfully.")
-            else:
-                print("Error uploading temp setting data to Supabase")
-
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        print(f"Error uploading unpublished data to Supabase: {e}")
+# Function to wake the upload worker as soon as the link comes back
+def on_connectivity_change(up):
+    if up:
+        upload_worker.wake()
+
+# Function to convert a fo_sensor_data row into the Supabase format
+def format_sensor_row(row):
+    return {
+        'timestamp': datetime_to_str(row[1]),
+        'cstr_temp': row[2],
+        'cstr_level': row[3],
+        'cstr_ph': row[4],
+        'cstr_orp': row[5],
+        'cstr_ec': row[6],
+        'cstr_tds': row[7],
+        'mtank_temp': row[8],
+        'mtank_level': row[9],
+        'effluent_level': row[10],
+        'flux': row[11]
+    }
+
+# Function to convert a fo_temp_setting row into the Supabase format
+def format_temp_row(row):
+    return {
+        'timestamp': datetime_to_str(row[1]),
+        'set_temp': row[2]
+    }
 
 # Function to upload sensor data to Supabase
 def upload_data_to_supabase(data):
     try:
         response = supabase.table('fo_sensor_data').insert(data).execute()
+        health.report_success()
         return response
     except Exception as e:
+        if isinstance(e, TRANSPORT_ERRORS):
+            health.report_failure()  # Only a network error means the link is down
         print(f"Error uploading data to Supabase: {e}")
         return None
 
@@ -216,38 +201,20 @@ def upload_data_to_supabase(data):
 def upload_data_to_supabase_temp(data):
     try:
         response = supabase.table('fo_temp_setting').insert(data).execute()
+        health.report_success()
         return response
     except Exception as e:
+        if isinstance(e, TRANSPORT_ERRORS):
+            health.report_failure()  # Only a network error means the link is down
         print(f"Error uploading temp setting data to Supabase: {e}")
         return None
 
-# Function to update published status in the PostgreSQL database
-def update_published_status(ids):
-    try:
-        conn = psycopg2.connect(**DATABASE_CONFIG)
-        cursor = conn.cursor()
-        ids_tuple = tuple(ids)
-        update_query = "UPDATE fo_sensor_data SET published = TRUE WHERE id IN %s"
-        cursor.execute(update_query, (ids_tuple,))
-        conn.commit()
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        print(f"Error updating published status: {e}")
-
-# Function to update published status for temp setting in the PostgreSQL database
-def update_published_status_temp(ids):
-    try:
-        conn = psycopg2.connect(**DATABASE_CONFIG)
-        cursor = conn.cursor()
-        ids_tuple = tuple(ids)
-        update_query = "UPDATE fo_temp_setting SET published = TRUE WHERE id IN %s"
-        cursor.execute(update_query, (ids_tuple,))
-        conn.commit()
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        print(f"Error updating published status: {e}")
+# Streaming uploaders, tracked in the fo_sync_watermark table;
+# chunk size adapts to upload latency and failures
+sensor_uploader = ChunkedUploader('fo_sensor_data', format_sensor_row, upload_data_to_supabase)
+temp_uploader = ChunkedUploader('fo_temp_setting', format_temp_row, upload_data_to_supabase_temp)
+upload_worker = UploadWorker([sensor_uploader, temp_uploader], health=health, interval=UPLOAD_INTERVAL,
+                             max_in_flight=UPLOAD_MAX_IN_FLIGHT)
 
 # Main loop to handle data processing
 def main_loop():
@@ -255,20 +222,43 @@ def main_loop():
     client.on_connect = on_connect
     client.on_message = on_message
 
+    warm_lag_buffers()
+    sensor_writer.start()
+    health.add_listener(on_connectivity_change)
+    health.start()
+    upload_worker.start()
+    rollup_refresher.start()
     client.connect(MQTT_BROKER, MQTT_PORT, 60)
     client.loop_start()
 
-    while True:
-        time.sleep(30)  # Check every minute
+    # Turn SIGTERM into a normal exit so buffered rows are flushed on shutdown
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        next_sample = time.monotonic()
+        while True:
+            # Sleep until the next sample on a fixed schedule, however long the last iteration took
+            next_sample += SAMPLE_INTERVAL
+            time.sleep(max(0.0, next_sample - time.monotonic()))
 
-        # Save data to local database
-        success, flux = save_to_database(fo_sensor_data, client)
-        if success:
-            fo_sensor_data['published'] = False
+            # Save data to local database
+            success, flux = save_to_database(fo_sensor_data, client)
+            if success:
+                fo_sensor_data['published'] = False
 
-        # Check for internet connection and upload unpublished data
-        if is_connected():
-            upload_unpublished_data()
+            # Report upload lag from the background worker
+            for table, metrics in upload_worker.metrics().items():
+                if metrics['lag_rows']:
+                    print(f"Upload lag for {table}: {metrics['lag_rows']} rows, {metrics['lag_seconds']:.0f} s")
+    except KeyboardInterrupt:
+        print("Exiting")
+    finally:
+        client.loop_stop()
+        health.stop()
+        upload_worker.stop(timeout=10)
+        rollup_refresher.stop(timeout=10)
+        sensor_writer.close()
+        database.pool.closeall()
 
 if __name__ == '__main__':
     main_loop()
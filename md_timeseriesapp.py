@@ -5,8 +5,11 @@ from tkcalendar import DateEntry
 from tkinter import Canvas, Scrollbar
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import pandas as pd
-import psycopg2
+import database
+import rollups
+import downsample
+from live_graph import LiveGraph
+from db_executor import TkExecutor, LoadingLabel
 from datetime import datetime, timedelta
 
 # Initialize the main application
@@ -14,9 +17,8 @@ app = ctk.CTk()
 app.title("Aquameter Forward Osmosis")
 app.geometry('1920x1080')
 
-# Database connection
-conn = psycopg2.connect(dbname="sensordata", user="postgres", password="399584")
-cur = conn.cursor()
+# Database work runs on these workers; results come back on the Tk thread
+db = TkExecutor(app)
 
 # Create a transparent frame for the top title bar
 title_frame = ctk.CTkFrame(master=app, fg_color="transparent")
@@ -89,6 +91,7 @@ def clear_main_area():
 # Function to display all graphs
 def display_all_graphs():
     clear_main_area()
+    db.cancel('detail')
     canvas.grid(row=1, column=0, columnspan=4, sticky="nsew")
     scrollbar.grid(row=1, column=4, sticky="ns")
 
@@ -154,6 +157,9 @@ app.config(menu=menu_bar)
 view_all_menu = tk.Menu(menu_bar, tearoff=0)
 menu_bar.add_command(label="View All", command=display_all_graphs)
 
+# Sliding window shown on the dashboard graphs
+LIVE_WINDOW = timedelta(days=1)
+
 # Parameters
 parameters = ['cstr_ph', 'cstr_temp', 'cstr_level', 'cstr_orp', 'cstr_ec', 'cstr_tds', 'mtank_temp', 'mtank_level', 'effluent_level', 'flux']
 
@@ -161,67 +167,82 @@ parameters = ['cstr_ph', 'cstr_temp', 'cstr_level', 'cstr_orp', 'cstr_ec', 'cstr
 for param in parameters:
     menu_bar.add_command(label=param.replace('_', ' ').title(), command=lambda p=param: display_graph(p))
 
-# Function to fetch data from the database
-def fetch_data(param, from_datetime, to_datetime):
-    query = f"SELECT timestamp, {param} FROM fo_sensor_data WHERE timestamp BETWEEN '{from_datetime}' AND '{to_datetime}' ORDER BY timestamp ASC"
-    cur.execute(query)
-    data = cur.fetchall()
-    if data:
-        df = pd.DataFrame(data, columns=['timestamp', param])
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        return df
-    else:
-        return pd.DataFrame(columns=['timestamp', param])
-
-# Function to update the graphs with data from the database
-def update_graphs():
+# Function to fetch data from the database: one query for all columns, aligned on a common
+# timestamp column; long ranges are served from the rollup tables unless a resolution
+# ('raw' or a rollup name) is given
+def fetch_data(columns, from_datetime, to_datetime, resolution=None):
+    return rollups.fetch_series(columns, from_datetime, to_datetime, resolution=resolution)
+
+# Resolution of the dashboard graphs, the same for the initial load and every append so
+# the lines never mix raw rows with (possibly still filling) rollup buckets; the live
+# graphs decimate the raw rows themselves
+LIVE_RESOLUTION = 'raw'
+
+# Multi-graph column pairs
+multi_graphs = [
+    ('ORP and EC', 'cstr_orp', 'cstr_ec'),
+    ('ORP and PH', 'cstr_orp', 'cstr_ph'),
+    ('EC and PH', 'cstr_ec', 'cstr_ph')
+]
+
+# Function to create a live graph the first time it is shown
+def create_live_graph(key, columns, master, title, ylabel):
+    fig, ax = plt.subplots(figsize=(6, 4))
+    canvas = FigureCanvasTkAgg(fig, master=master)
+    graph = LiveGraph(ax, canvas, columns, LIVE_WINDOW)
+    ax.set_title(title, fontsize=16, fontname='Times New Roman', fontweight='bold')
+    ax.set_xlabel('Time')
+    ax.set_ylabel(ylabel)
+    ax.legend()
+    graph_widgets[key] = (fig, ax, canvas, graph)
+    return canvas
+
+# Function to update the graphs with data from the database.
+# The first call loads the whole window; later calls fetch only rows newer than the last
+# one seen and append them to the existing lines. The query runs on a db worker and
+# done() is called on the Tk thread once the graphs are updated (or the query failed).
+def update_graphs(done=None):
     now = datetime.now()
-    one_day_ago = now - timedelta(days=1)
-    from_datetime = one_day_ago.strftime('%Y-%m-%d %H:%M:%S')
-    to_datetime = now.strftime('%Y-%m-%d %H:%M:%S')
+    from_datetime = last_seen if last_seen is not None else now - LIVE_WINDOW
+
+    def show(data):
+        try:
+            render_graphs(data, now)
+        finally:
+            if done is not None:
+                done()
+
+    def failed(e):
+        print(f"Error fetching dashboard data: {e}")
+        if done is not None:
+            done()
+
+    # One query for every single and multi-graph column; graphs plot column views of it
+    columns = parameters + [col for _, col1, col2 in multi_graphs for col in (col1, col2)]
+    db.submit(fetch_data, columns, from_datetime, now, LIVE_RESOLUTION, on_done=show, on_error=failed, key='dashboard',
+              loading=LoadingLabel(scrollable_frame) if last_seen is None else None)
+
+def render_graphs(data, now):
+    global last_seen
+    if len(data):
+        last_seen = max(last_seen or data['timestamp'].iloc[-1], data['timestamp'].iloc[-1])
 
     for param in parameters:
-        data = fetch_data(param, from_datetime, to_datetime)
-        if not data.empty:
-            if param not in graph_widgets:
-                fig, ax = plt.subplots(figsize=(6, 4))
-                graph_widgets[param] = (fig, ax, FigureCanvasTkAgg(fig, master=param_frames[param]))
-                graph_widgets[param][2].get_tk_widget().pack(fill=tk.BOTH, expand=1)
-
-            ax = graph_widgets[param][1]
-            ax.clear()
-            ax.plot(data['timestamp'], data[param], marker='o', linestyle='-', label=param)
-            ax.set_title(param.replace("_", " ").title(), fontsize=16, fontname='Times New Roman', fontweight='bold')
-            ax.set_xlabel('Time')
-            ax.set_ylabel(param)
-            ax.legend()
-            graph_widgets[param][2].draw()
+        if param not in graph_widgets:
+            if not data[param].notna().any():
+                continue
+            canvas = create_live_graph(param, [param], param_frames[param], param.replace("_", " ").title(), param)
+            canvas.get_tk_widget().pack(fill=tk.BOTH, expand=1)
+        graph_widgets[param][3].update(data, now)
 
     # Multi-graphs
-    multi_graphs = [
-        ('ORP and EC', 'cstr_orp', 'cstr_ec'),
-        ('ORP and PH', 'cstr_orp', 'cstr_ph'),
-        ('EC and PH', 'cstr_ec', 'cstr_ph')
-    ]
     for i, (title, col1, col2) in enumerate(multi_graphs):
-        data_col1 = fetch_data(col1, from_datetime, to_datetime)
-        data_col2 = fetch_data(col2, from_datetime, to_datetime)
-        
-        if not data_col1.empty and not data_col2.empty:
-            if title not in graph_widgets:
-                fig, ax = plt.subplots(figsize=(6, 4))
-                graph_widgets[title] = (fig, ax, FigureCanvasTkAgg(fig, master=scrollable_frame))
-                graph_widgets[title][2].get_tk_widget().grid(row=(i + 12) // 3, column=(i + 12) % 3, padx=10, pady=10, sticky='nsew')
-
-            ax = graph_widgets[title][1]
-            ax.clear()
-            ax.plot(data_col1['timestamp'], data_col1[col1], marker='o', linestyle='-', label=col1)
-            ax.plot(data_col2['timestamp'], data_col2[col2], marker='o', linestyle='-', label=col2)
-            ax.set_title(title, fontsize=16, fontname='Times New Roman', fontweight='bold')
-            ax.set_xlabel('Time')
-            ax.set_ylabel('Values')
-            ax.legend()
-            graph_widgets[title][2].draw()
+        if title not in graph_widgets:
+            if not (data[col1].notna().any() and data[col2].notna().any()):
+                continue
+            canvas = create_live_graph(title, [col1, col2], scrollable_frame, title, 'Values')
+            canvas.get_tk_widget().grid(row=(i + 12) // 3, column=(i + 12) % 3, padx=10, pady=10, sticky='nsew')
+        graph_widgets[title][3].update(data, now)
 
     scrollable_frame.update_idletasks()
 
@@ -237,18 +258,22 @@ def fetch_and_display(param, from_date_input, from_time_input, to_date_input, to
 
     fetch_and_display_timeseries(param, from_datetime, to_datetime, canvas, figure, timeseries_window)
 
-# Function to fetch and display time series from the database
+# Function to fetch and display time series from the database; the query runs on a db
+# worker and a newer range replaces a request still in flight
 def fetch_and_display_timeseries(param, from_datetime, to_datetime, canvas, figure, timeseries_window):
-    data = fetch_data(param, from_datetime, to_datetime)
-    if not data.empty:
-        ax = figure.add_subplot(111)
-        ax.clear()
-        ax.plot(data['timestamp'], data[param], marker='o', linestyle='-', label=param)
-        ax.set_title(param.replace("_", " ").title(), fontsize=16, fontname='Times New Roman', fontweight='bold')
-        ax.set_xlabel('Time')
-        ax.set_ylabel(param)
-        ax.legend()
-        canvas.draw()
+    def show(data):
+        if data[param].notna().any():
+            ax = figure.add_subplot(111)
+            ax.clear()
+            ax.plot(*downsample.for_plot(data['timestamp'], data[param], downsample.point_budget(canvas)), marker='o', linestyle='-', label=param)
+            ax.set_title(param.replace("_", " ").title(), fontsize=16, fontname='Times New Roman', fontweight='bold')
+            ax.set_xlabel('Time')
+            ax.set_ylabel(param)
+            ax.legend()
+            canvas.draw()
+
+    db.submit(fetch_data, [param], from_datetime, to_datetime, on_done=show, key='detail',
+              loading=LoadingLabel(canvas.get_tk_widget()))
 
 # Function to save the graph as an image
 def save_graph_as_image(figure, timeseries_window):
@@ -256,13 +281,14 @@ def save_graph_as_image(figure, timeseries_window):
     if file_path:
         figure.savefig(file_path)
 
-# Function to periodically update graphs
+# Function to periodically update graphs; the next update is scheduled once this one has
+# finished so slow queries never pile up
 def periodic_update():
-    update_graphs()
-    app.after(5000, periodic_update)
+    update_graphs(done=lambda: app.after(5000, periodic_update))
 
-# Store the FigureCanvasTkAgg objects to avoid redrawing
+# Store the figure, axes, canvas and LiveGraph of every dashboard graph to avoid redrawing
 graph_widgets = {}
+last_seen = None  # Timestamp of the newest row fetched by update_graphs
 
 # Create a dictionary of parameter frames
 param_frames = {param: ctk.CTkFrame(scrollable_frame, width=600, height=400, fg_color="transparent") for param in parameters}
@@ -284,5 +310,6 @@ display_all_graphs()
 
 app.mainloop()
 
-# Close the database connection on exit
-conn.close()
+# Stop the db workers and close the database connections on exit
+db.shutdown()
+database.pool.closeall()
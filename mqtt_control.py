@@ -1,135 +1,199 @@
 import paho.mqtt.client as mqtt
-import psycopg2
+import os
 import time
-import threading
 from datetime import datetime, timedelta
+import database
+import sensor_registry
+from notify_listener import NotifyListener, ensure_notify_trigger, notify_latency
+from scheduler import Scheduler
+from control_engine import ControlEngine
+import control_rules
 
 # MQTT settings
 broker = "192.168.18.28"
 port = 1883
-topics = ['cstr-temp', 'cstr-level', 'feed-level', 'ds-tds', 'cstr-temp']
 
-# Database settings
-dbname = "sensordata"
-user = "postgres"
-password = "400220"
-host = "localhost"
+# Database settings (connection parameters come from the shared database module).
+# New settings rows are pushed by a NOTIFY trigger; the poll only reconciles anything
+# missed while the listener was disconnected.
 table = "fo_setting"
-
-# Connect to PostgreSQL database
-conn = psycopg2.connect(dbname=dbname, user=user, password=password, host=host)
-cursor = conn.cursor()
-print("Connected to the PostgreSQL database")
+SETTINGS_CHANNEL = "fo_setting"
+SETTINGS_RECONCILE_INTERVAL = float(os.environ.get('SETTINGS_RECONCILE_INTERVAL', '300'))
 
 # MQTT client setup
 client = mqtt.Client()
 
-# Global variables for sensor values and previous states
-sensor_values = {
-    "cstr-temp": None,
-    "cstr-level": None,
-    "feed-level": None,
-    "ds-tds": None
-}
-previous_states = {
-    "cstr/in": None,
-    "cstr/heater1": None,
-    "cstr/heater2": None,
-    "ds/out": None
-}
-current_settings = {
-    "set_cstr_temp": None,
-    "hyst_tds": None,
-    "set_tds": None
-}
-
-
-# Callback when a message is received
+# Every control decision, settings update and database query runs on this one worker;
+# the MQTT and LISTEN threads only hand work over to it
+control_scheduler = Scheduler("mqtt-control")
+
+# Global variables for sensor values, previous states and the latest fo_setting row
+# (every column except SETTINGS_EXCLUDED); the control rules read them in place
+sensor_values = {}
+previous_states = {}
+current_settings = {}
+current_settings_id = None  # id of the fo_setting row currently applied
+SETTINGS_EXCLUDED = ('id', 'timestamp', 'published')
+
+# Control loops run only when an input they declare changes; outputs are published only
+# on a state change, with the time from message receipt to publish traced per output
+control_engine = ControlEngine(client.publish, previous_states)
+
+# Control rules from the rule table, or from the rules file or the built-in defaults while
+# the table has no enabled rows. Startup waits for the database instead of falling back,
+# and the rules are reloaded whenever fo_control_rule changes. Each rule is compiled into
+# an engine loop keyed by the sensor and settings it reads.
+RULES_CHANNEL = "fo_control_rule"
+rules = []
+rule_definitions = None
+topics = []
+sensors = {}
+
+# Function to compile and install rule definitions in place of the current rules; raises
+# on an invalid rule before anything is replaced. Returns the previous input topics.
+def install_rules(definitions, source):
+    global rules, rule_definitions, topics, sensors
+    new_rules = control_rules.parse_rules(definitions)
+    new_topics = control_rules.input_topics(new_rules)
+    new_sensors = sensor_registry.dispatch_table(new_topics)
+    control_engine.clear()
+    control_rules.register_rules(new_rules, control_engine, sensor_values, current_settings)
+    for topic in new_topics:
+        sensor_values.setdefault(topic, None)
+    outputs = {output for rule in new_rules for output in rule.outputs}
+    for output in [output for output in previous_states if output not in outputs]:
+        del previous_states[output]
+    for output in outputs:
+        previous_states.setdefault(output, None)
+    old_topics = topics
+    rules, rule_definitions, topics, sensors = new_rules, definitions, new_topics, new_sensors
+    print(f"Loaded {len(rules)} control rules from {source}")
+    return old_topics
+
+install_rules(*control_rules.wait_for_rules())
+
+# Setpoint-to-actuation latency: from the insert of a settings row in the database until
+# the control logic has run (and published any state change) with it
+settings_latency = {'count': 0, 'total': 0.0, 'max': 0.0, 'last': None}
+
+
+# Callback when a message is received (paho's network thread)
 def on_message(client, userdata, message):
     global sensor_values
-    print(f"Received message: {message.topic} -> {message.payload.decode('utf-8')}")
-    sensor_values[message.topic] = float(message.payload.decode("utf-8"))
+    received = time.monotonic()
+    sensor = sensors.get(message.topic)
+    if sensor is None:
+        return
+    value = sensor.parse(message.payload)
+    if value is None:
+        print(f"Rejected payload on {message.topic}")
+        return
+    if sensor_values[message.topic] == value:
+        return  # Same reading, no loop can change its output
+    sensor_values[message.topic] = value
 
-    # Control logic
-    cstr_control()
-    feed_control()
-    ds_control()
+    # Control logic: only the loops reading this sensor
+    control_scheduler.call_soon(lambda topic=message.topic: control_engine.changed(topic, received=received))
 
-# Function to get settings from database
+# Function to get the latest settings row from database as a dict
 def get_settings():
-    cursor.execute(f"SELECT set_cstr_temp, hyst_tds, set_tds FROM {table} ORDER BY id DESC LIMIT 1")
-    return cursor.fetchone()
+    try:
+        with database.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT * FROM {table} ORDER BY id DESC LIMIT 1")
+            settings = cursor.fetchone()
+            if settings is not None:
+                settings = dict(zip([column[0] for column in cursor.description], settings))
+            cursor.close()
+        return settings
+    except Exception as e:
+        print(f"Error fetching settings from database: {e}")
+        return None
+
+# Function to apply a settings row unless a newer one is already applied; returns True if applied.
+# received is the monotonic time a pushed row arrived, for the actuation latency histograms.
+def apply_settings(row, received=None):
+    global current_settings_id
+    if current_settings_id is not None and row['id'] < current_settings_id:
+        return False
+    changed = row['id'] != current_settings_id
+    current_settings_id = row['id']
+    new_settings = {name: value for name, value in row.items() if name not in SETTINGS_EXCLUDED}
+    changed_names = [name for name in new_settings if new_settings[name] != current_settings.get(name)]
+    current_settings.update(new_settings)
+    if changed:
+        print(f"Updated settings from database: {current_settings}")
+    # Ensure control logic is applied with updated settings
+    control_engine.changed(*changed_names, received=received)
+    return changed
 
-# Function to update settings
+# Function to reconcile with the latest settings row in the database
 def update_settings():
-    global current_settings
     new_settings = get_settings()
     if new_settings:
-        current_settings = {
-            "set_cstr_temp": new_settings[0],
-            "hyst_tds": new_settings[1],
-            "set_tds": new_settings[2]
-        }
-    print(f"Updated settings from database: {current_settings}")
-    # Ensure control logic is applied with updated settings
-    cstr_control()
-    feed_control()
-    ds_control()
-
-# Function to publish MQTT messages only on state change
-def publish_state(topic, state):
-    if previous_states[topic] != state:
-        client.publish(topic, state)
-        previous_states[topic] = state
-        print(f"Published state change: {topic} -> {state}")
-
-# Feed control logic
-def feed_control():
-    if sensor_values["feed-level"] is not None:
-        if sensor_values["feed-level"] <= 20:
-            publish_state("cstr/in", "on")
-        elif sensor_values["feed-level"] >= 25:
-            publish_state("cstr/in", "off")
-
-# CSTR control logic
-def cstr_control():
-    if current_settings["set_cstr_temp"] is None or sensor_values["cstr-temp"] is None:
+        apply_settings(new_settings)
+
+# Function to apply a settings row pushed by the fo_setting NOTIFY trigger; received is
+# the monotonic time the listener got the notification
+def on_settings_notify(payload, received):
+    row = payload['row']
+    if apply_settings(row, received):
+        latency = notify_latency(payload)
+        settings_latency['count'] += 1
+        settings_latency['total'] += latency
+        settings_latency['max'] = max(settings_latency['max'], latency)
+        settings_latency['last'] = latency
+        print(f"Applied settings {row['id']} {latency * 1000:.1f} ms after they were saved")
+
+settings_listener = NotifyListener(SETTINGS_CHANNEL,
+                                   lambda payload: control_scheduler.call_soon(on_settings_notify, payload, time.monotonic()),
+                                   on_connect=lambda: control_scheduler.call_soon(update_settings))
+
+# Function to reload the rules if their definitions changed, keeping the current rules
+# when the database is unreachable or a new rule is invalid
+def reload_rules():
+    try:
+        definitions, source = control_rules.load_rules()
+        if definitions == rule_definitions:
+            return
+        old_topics = install_rules(definitions, source)
+    except Exception as e:
+        print(f"Error reloading control rules, keeping the current ones: {e}")
         return
-
-    set_cstr_temp = current_settings["set_cstr_temp"]
-    if sensor_values["cstr-temp"] < set_cstr_temp:
-        publish_state("cstr/heater1", "on")
-        publish_state("cstr/heater2", "on")
-    else:
-        publish_state("cstr/heater1", "off")
-        publish_state("cstr/heater2", "off")
-
-# DS control logic
-def ds_control():
-    if current_settings["set_tds"] is None or current_settings["hyst_tds"] is None or sensor_values["ds-tds"] is None:
-        return
-
-    set_tds = current_settings["set_tds"]
-    hyst_tds = current_settings["hyst_tds"]
-    if sensor_values["ds-tds"] >= set_tds + hyst_tds:
-        publish_state("ds/out", "on")
-    elif sensor_values["ds-tds"] < set_tds - hyst_tds:
-        publish_state("ds/out", "off")
+    for topic in old_topics:
+        if topic not in topics:
+            client.unsubscribe(topic)
+            print(f"Unsubscribed from topic: {topic}")
+    for topic in topics:
+        if topic not in old_topics:
+            client.subscribe(topic)
+            print(f"Subscribed to topic: {topic}")
+    control_engine.run_all()
+
+rules_listener = NotifyListener(RULES_CHANNEL,
+                                lambda payload: control_scheduler.call_soon(reload_rules),
+                                on_connect=lambda: control_scheduler.call_soon(reload_rules))
 
 # Periodic status update
 def periodic_status_update():
-    threading.Timer(120, periodic_status_update).start()  # Schedule the function to run every 2 minutes
     print("Performing periodic status update")
+    if settings_latency['count']:
+        print(f"Settings latency: last {settings_latency['last'] * 1000:.1f} ms, "
+              f"avg {settings_latency['total'] / settings_latency['count'] * 1000:.1f} ms, "
+              f"max {settings_latency['max'] * 1000:.1f} ms over {settings_latency['count']} updates")
     for topic in previous_states:
         if previous_states[topic] is not None:
             client.publish(topic, previous_states[topic])
             print(f"Published periodic status: {topic} -> {previous_states[topic]}")
+    print({'control': control_engine.metrics()})
+    for metrics in control_scheduler.metrics():
+        print(metrics)
 
-# Periodic database check
+# Periodic database check, a fallback for notifications missed by the listeners
 def periodic_db_check():
-    threading.Timer(10, periodic_db_check).start()  # Check database every 10 seconds for new settings
-    print("Checking database for updated settings")
+    print("Checking database for updated settings and rules")
     update_settings()
+    reload_rules()
 
 # MQTT connection setup
 client.on_message = on_message
@@ -145,9 +209,20 @@ for topic in topics:
 client.loop_start()
 print("Started MQTT loop")
 
-# Start periodic status updates and database checks
-periodic_status_update()
-periodic_db_check()
+# Push new settings rows and rule changes to the listeners; they also reconcile on every
+# (re)connect
+try:
+    ensure_notify_trigger(table, SETTINGS_CHANNEL)
+    ensure_notify_trigger(control_rules.RULES_TABLE, RULES_CHANNEL, 'INSERT OR UPDATE OR DELETE')
+except Exception as e:
+    print(f"Error creating notify triggers, relying on polling: {e}")
+settings_listener.start()
+rules_listener.start()
+
+# Start periodic status updates (every 2 minutes) and database checks
+control_scheduler.every(120, periodic_status_update)
+control_scheduler.every(SETTINGS_RECONCILE_INTERVAL, periodic_db_check)
+control_scheduler.start()
 
 try:
     while True:
@@ -156,6 +231,8 @@ except KeyboardInterrupt:
     print("Exiting")
 finally:
     client.loop_stop()
-    cursor.close()
-    conn.close()
+    settings_listener.stop(timeout=5)
+    rules_listener.stop(timeout=5)
+    control_scheduler.stop(timeout=5)
+    database.pool.closeall()
     print("Closed MQTT loop and database connection")
@@ -0,0 +1,103 @@
+import json
+import select
+import threading
+import time
+import psycopg2
+import psycopg2.extensions
+import database
+
+
+# Function to make every insert into table (or each of the given events, e.g.
+# 'INSERT OR UPDATE OR DELETE') send a NOTIFY on channel. The payload is JSON with the new
+# row (null for a delete) and the database time of the change in epoch seconds ('at'), so
+# the receiver can apply the row without querying it and measure how long delivery took.
+def ensure_notify_trigger(table, channel, events='INSERT'):
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+        CREATE OR REPLACE FUNCTION {table}_notify() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{channel}', json_build_object(
+                'row', row_to_json(NEW),
+                'at', EXTRACT(EPOCH FROM clock_timestamp())
+            )::text);
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+        DROP TRIGGER IF EXISTS {table}_notify ON {table};
+        CREATE TRIGGER {table}_notify AFTER {events} ON {table}
+            FOR EACH ROW EXECUTE PROCEDURE {table}_notify();
+        ''')
+        cursor.close()
+
+
+# Background thread that LISTENs on a channel and calls callback(payload) for every
+# notification, with payload decoded from JSON. It holds its own connection outside the
+# pool, since LISTEN is tied to the session, and reconnects with backoff when it drops.
+# on_connect is called after every (re)connect, e.g. to reconcile anything missed while
+# the listener was down.
+class NotifyListener:
+    def __init__(self, channel, callback, on_connect=None, max_backoff=60.0):
+        self.channel = channel
+        self.callback = callback
+        self.on_connect = on_connect
+        self.max_backoff = max_backoff
+        self._stopping = threading.Event()
+        self._thread = None
+        self.stats = {'notifications': 0, 'reconnects': 0, 'errors': 0}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"listen-{self.channel}", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        backoff = 1.0
+        while not self._stopping.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**database.DATABASE_CONFIG)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cursor = conn.cursor()
+                cursor.execute(f"LISTEN {self.channel}")
+                cursor.close()
+                print(f"Listening for notifications on {self.channel}")
+                backoff = 1.0
+                if self.on_connect is not None:
+                    self.on_connect()
+                self._listen(conn)
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"Error listening on {self.channel}: {e}")
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                self.stats['reconnects'] += 1
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    # Wait for notifications until stopped; the select timeout bounds the shutdown delay
+    def _listen(self, conn):
+        while not self._stopping.is_set():
+            if select.select([conn], [], [], 1.0) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                self.stats['notifications'] += 1
+                try:
+                    self.callback(json.loads(notify.payload))
+                except Exception as e:
+                    print(f"Error handling notification on {self.channel}: {e}")
+
+
+# Seconds between the database time a notification was sent and now
+def notify_latency(payload):
+    return time.time() - payload['at']
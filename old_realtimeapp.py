@@ -2,7 +2,6 @@ from customtkinter import *
 from PIL import Image
 import tkinter as tk
 from tkinter import Menu, filedialog, messagebox
-import psycopg2
 import pandas as pd
 import matplotlib.pyplot as plt
 from tkcalendar import DateEntry
@@ -10,25 +9,29 @@ from datetime import datetime, timedelta
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import paho.mqtt.client as mqtt
 import os
+import database
+import sensor_registry
 
 
 # MQTT Configuration
 MQTT_BROKER = "192.168.18.28"
 MQTT_PORT = 1883
-MQTT_TOPICS = {
-    "cstr-ph": "cstr_ph",
-    "cstr-ec": "cstr_ec",
-    "cstr-tds": "cstr_tds",
-    "cstr-orp": "cstr_orp",
-    "cstr-temp": "cstr_temp",
-    "cstr-level": "cstr_level",
-    "feed-temp": "feed_temp",
-    "feed-level": "feed_level",
-    "feed-tds": "feed_tds",
-    "ds-tds": "ds_tds",
-    "ds-level": "ds_level",
-    "flux": "flux"
-}
+# Topics shown on the dashboard; columns, units and validation come from the shared
+# sensor registry
+MQTT_TOPICS = {topic: sensor_registry.BY_TOPIC[topic].column for topic in [
+    "cstr-ph",
+    "cstr-ec",
+    "cstr-tds",
+    "cstr-orp",
+    "cstr-temp",
+    "cstr-level",
+    "feed-temp",
+    "feed-level",
+    "feed-tds",
+    "ds-tds",
+    "ds-level",
+    "md/flux"
+]}
 
 # Initialize MQTT values storage
 mqtt_values = {topic: None for topic in MQTT_TOPICS.keys()}
@@ -41,7 +44,11 @@ def on_connect(client, userdata, flags, rc):
 
 def on_message(client, userdata, msg):
     topic = msg.topic
-    value = msg.payload.decode()
+    if topic not in mqtt_values:
+        return
+    value = sensor_registry.BY_TOPIC[topic].parse(msg.payload)
+    if value is None:
+        return
     mqtt_values[topic] = value
     update_ui_values()
 
@@ -52,22 +59,12 @@ mqtt_client.on_message = on_message
 mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
 mqtt_client.loop_start()
 
-# Database configuration
-DB_NAME = "sensordata"
-DB_USER = "postgres"
-DB_PASSWORD = "400220"
-DB_HOST = "localhost"
-DB_PORT = "5432"
-
 # Function to fetch data and display time series graph
 def fetch_and_display_timeseries(param, from_date, to_date, canvas, figure, parent_window):
     try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
-        )
         query = f"SELECT timestamp, {param} FROM sensor_data WHERE timestamp BETWEEN '{from_date}' AND '{to_date}'"
-        df = pd.read_sql_query(query, conn)
-        conn.close()
+        with database.connection() as conn:
+            df = pd.read_sql_query(query, conn)
 
         if df.empty:
             messagebox.showinfo("No Data", "No data found for the selected range.")
@@ -168,18 +165,14 @@ def save_settings(set_temp_input, settings_window):
     set_temp = set_temp_input.get()
 
     try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
-        )
         now = datetime.now()
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO fo_temp_setting (timestamp, set_temp, published) VALUES (%s, %s, %s, %s, %s)",
-            (now, set_temp, False)
-        )
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with database.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO fo_temp_setting (timestamp, set_temp, published) VALUES (%s, %s, %s, %s, %s)",
+                (now, set_temp, False)
+            )
+            cursor.close()
         messagebox.showinfo("Success", "Settings have been saved successfully.")
         settings_window.destroy()
     except Exception as e:
@@ -205,13 +198,11 @@ def open_settings():
 
     # Fetch the latest settings from the database
     try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
-        )
-        cursor = conn.cursor()
-        cursor.execute("SELECT set_temp FROM fo_temp_setting ORDER BY timestamp DESC LIMIT 1")
-        latest_settings = cursor.fetchone()
-        conn.close()
+        with database.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT set_temp FROM fo_temp_setting ORDER BY timestamp DESC LIMIT 1")
+            latest_settings = cursor.fetchone()
+            cursor.close()
 
         if latest_settings:
             set_temp_input.insert(0, latest_settings[0])
@@ -226,15 +217,12 @@ def download_data(from_date_input, to_date_input, download_window):
     to_date = to_date_input.get_date().strftime('%Y-%m-%d %H:%M:%S')
 
     try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
-        )
         query = f"SELECT * FROM sensor_data WHERE timestamp BETWEEN '{from_date}' AND '{to_date}'"
-        df = pd.read_sql_query(query, conn)
+        with database.connection() as conn:
+            df = pd.read_sql_query(query, conn)
         file_path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")], initialdir="/home/resurgencefo/pictures")
         if file_path:
             df.to_csv(file_path, index=False)
-            conn.close()
             messagebox.showinfo("Success", "Data has been downloaded successfully.")
             download_window.destroy()
     except Exception as e:
@@ -296,27 +284,32 @@ right_logo_label.grid(row=0, column=2, padx=20, sticky="e")
 title_label = CTkLabel(master=title_frame, text="Foward Osmosis", font=("Times New Roman", 44, 'bold'))
 title_label.grid(row=0, column=1, pady=10)
 
+# Display row for one sensor: (label, topic, column, unit suffix)
+def sensor_param(topic):
+    sensor = sensor_registry.BY_TOPIC[topic]
+    return (sensor.label, sensor.topic, sensor.column, f" {sensor.unit}")
+
 sections = ["Anaerobic CSTR", "Feed Tank", "DS Tank"]
 
 anaerobic_cstr_params = [
-    ("PH", "cstr-ph", "cstr_ph", " /14"),
-    ("TDS", "cstr-tds", "cstr_tds", " PPM"),
-    ("ORP", "cstr-orp", "cstr_orp", " mV"),
-    ("Temp", "cstr-temp", "cstr_temp", " °C"),
-    ("EC", "cstr-ec", "cstr_ec", " mS/cm"),
-    ("Level", "cstr-level", "cstr_level", " Liters"),
+    sensor_param("cstr-ph"),
+    sensor_param("cstr-tds"),
+    sensor_param("cstr-orp"),
+    sensor_param("cstr-temp"),
+    sensor_param("cstr-ec"),
+    sensor_param("cstr-level"),
 ]
 
 feed_tank_params = [
-    ("Temp", "feed-temp", "feed_temp", " °C"),
-    ("Level", "feed-level", "feed_level", " mL"),
-    ("TDS", "feed-tds", "feed_tds", " PPM")
+    sensor_param("feed-temp"),
+    sensor_param("feed-level"),
+    sensor_param("feed-tds")
 ]
 
 ds_params = [
-    ("Level", "ds-level", "ds_level", " mL"),
-    ("TDS", "ds-tds", "ds_tds", " PPM"),
-    ("Flux", "flux", "flux", " LMH")
+    sensor_param("ds-level"),
+    sensor_param("ds-tds"),
+    sensor_param("md/flux")
 ]
 
 parameters = [anaerobic_cstr_params, feed_tank_params, ds_params]
@@ -2,36 +2,50 @@ from customtkinter import *
 from PIL import Image
 import tkinter as tk
 from tkinter import Menu, filedialog, messagebox
-import psycopg2
-import pandas as pd
 import matplotlib.pyplot as plt
 from tkcalendar import DateEntry
 from datetime import datetime, timedelta
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import paho.mqtt.client as mqtt
 import os
+import time
+import database
+import sensor_registry
+import rollups
+from series_cache import SeriesCache
+import downsample
+from db_executor import TkExecutor, LoadingLabel
+from latest_values import LatestValues
+import export
 
 # MQTT Configuration
 MQTT_BROKER = "192.168.18.28"
 MQTT_PORT = 1883
-MQTT_TOPICS = {
-    "cstr-ph": "cstr_ph",
-    "cstr-orp": "cstr_orp",
-    "cstr-temp": "cstr_temp",
-    "cstr-level": "cstr_level",
-    "feed-ec": "feed_ec",
-    "feed-temp": "feed_temp",
-    "feed-level": "feed_level",
-    "feed-tds": "feed_tds",
-    "ds-tds": "ds_tds",
-    "ds-ec": "ds_ec",
-    "ds-level": "ds_level",
-    "weight": "weight",
-    # "flux": "flux"  # Flux data will be fetched from the database
-}
-
-# Initialize MQTT values storage
-mqtt_values = {topic: None for topic in MQTT_TOPICS.keys()}
+# Topics shown on the dashboard; columns, units and validation come from the shared
+# sensor registry. Flux is derived by the ingestion process and published (retained) on
+# its own topic, so no tile needs a database query.
+MQTT_TOPICS = {topic: sensor_registry.BY_TOPIC[topic].column for topic in [
+    "cstr-ph",
+    "cstr-orp",
+    "cstr-temp",
+    "cstr-level",
+    "feed-ec",
+    "feed-temp",
+    "feed-level",
+    "feed-tds",
+    "ds-tds",
+    "ds-ec",
+    "ds-level",
+    "weight",
+    "fo/flux"
+]}
+
+# Latest MQTT values, written by paho's network thread and rendered by the Tk render tick
+mqtt_values = LatestValues(MQTT_TOPICS.keys())
+
+# Tile refresh rate, and how often render metrics are printed (0 disables the report)
+UI_FPS = float(os.environ.get('UI_FPS', '4'))
+UI_METRICS_INTERVAL = float(os.environ.get('UI_METRICS_INTERVAL', '0'))
 
 # Add global variables for settings
 set_cstr_temp_value = None
@@ -44,11 +58,15 @@ def on_connect(client, userdata, flags, rc):
     for topic in MQTT_TOPICS.keys():
         client.subscribe(topic)
 
+# Runs on paho's network thread: only stores the value, never touches Tk
 def on_message(client, userdata, msg):
     topic = msg.topic
-    value = msg.payload.decode()
-    mqtt_values[topic] = value
-    update_ui_values()
+    if topic not in MQTT_TOPICS:
+        return
+    value = sensor_registry.BY_TOPIC[topic].parse(msg.payload)
+    if value is None:
+        return
+    mqtt_values.set(topic, value)
 
 # Initialize MQTT client and connect
 mqtt_client = mqtt.Client()
@@ -57,42 +75,19 @@ mqtt_client.on_message = on_message
 mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
 mqtt_client.loop_start()
 
-# Database configuration
-DB_NAME = "sensordata"
-DB_USER = "postgres"
-DB_PASSWORD = "400220"
-DB_HOST = "localhost"
-DB_PORT = "5432"
-
-# Function to fetch flux data from the database
-def fetch_flux_data():
-    try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
-        )
-        cursor = conn.cursor()
-        cursor.execute("SELECT flux FROM fo_sensor_data ORDER BY timestamp DESC LIMIT 1")
-        flux_value = cursor.fetchone()
-        conn.close()
+# Series loaded by earlier time series windows are reused; only missing ranges are queried
+series = SeriesCache()
 
-        if flux_value:
-            return flux_value[0]
-        else:
-            return None
-    except Exception as e:
-        messagebox.showerror("Error", f"An error occurred while fetching flux data: {e}")
-        return None
-
-# Function to fetch data and display time series graph
-def fetch_and_display_timeseries(param, from_date, to_date, canvas, figure, parent_window):
-    try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
-        )
-        query = f"SELECT timestamp, {param} FROM fo_sensor_data WHERE timestamp BETWEEN '{from_date}' AND '{to_date}'"
-        df = pd.read_sql_query(query, conn)
-        conn.close()
+# Function to fetch a series through the cache (runs on a db worker thread)
+def fetch_series(columns, from_date, to_date):
+    data = series.get(columns, from_date, to_date)
+    print(series.describe())
+    return data
 
+# Function to fetch data and display time series graph; the query runs on a db worker and
+# a newer request for the same window replaces one still in flight
+def fetch_and_display_timeseries(param, from_date, to_date, canvas, figure, parent_window, loading=None):
+    def show(df):
         if df.empty:
             messagebox.showinfo("No Data", "No data found for the selected range.")
             parent_window.grab_release()
@@ -102,18 +97,21 @@ def fetch_and_display_timeseries(param, from_date, to_date, canvas, figure, pare
         # Plotting the data
         ax = figure.add_subplot(111)
         ax.clear()
-        ax.plot(pd.to_datetime(df['timestamp']), df[param], marker='o', linestyle='-')
+        ax.plot(*downsample.for_plot(df['timestamp'], df[param], downsample.point_budget(canvas)), marker='o', linestyle='-')
         ax.set_title(f'Time Series Data for {param}')
         ax.set_xlabel('Timestamp')
         ax.set_ylabel(param)
         ax.grid(True)
         canvas.draw()
 
-    except Exception as e:
+    def failed(e):
         messagebox.showerror("Error", f"An error occurred: {e}")
         parent_window.grab_release()
         parent_window.destroy()
 
+    db.submit(fetch_series, [param], from_date, to_date, on_done=show, on_error=failed,
+              key=('timeseries', str(parent_window)), loading=loading)
+
 # Function to save the graph as an image
 def save_graph_as_image(figure, parent_window):
     file_path = filedialog.asksaveasfilename(initialdir="/home/resurgencefo/pictures", defaultextension=".png", filetypes=[("PNG files", "*.png"), ("JPEG files", "*.jpg")])
@@ -171,6 +169,7 @@ def open_timeseries_window(param):
     figure = plt.Figure()
     canvas = FigureCanvasTkAgg(figure, master=timeseries_window)
     canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+    loading = LoadingLabel(canvas.get_tk_widget())
 
     def fetch_and_display():
         from_date_str = from_date_input.get_date().strftime('%Y-%m-%d')
@@ -181,54 +180,66 @@ def open_timeseries_window(param):
         from_datetime = f"{from_date_str} {from_time_str}:00"
         to_datetime = f"{to_date_str} {to_time_str}:00"
 
-        fetch_and_display_timeseries(param, from_datetime, to_datetime, canvas, figure, timeseries_window)
+        fetch_and_display_timeseries(param, from_datetime, to_datetime, canvas, figure, timeseries_window, loading)
 
     now = datetime.now()
     one_hour_ago = now - timedelta(hours=1)
-    fetch_and_display_timeseries(param, one_hour_ago.strftime('%Y-%m-%d %H:%M:%S'), now.strftime('%Y-%m-%d %H:%M:%S'), canvas, figure, timeseries_window)
+    fetch_and_display_timeseries(param, one_hour_ago.strftime('%Y-%m-%d %H:%M:%S'), now.strftime('%Y-%m-%d %H:%M:%S'), canvas, figure, timeseries_window, loading)
 
 # Example function to bind to a parameter frame click event
 def on_param_frame_click(param):
     open_timeseries_window(param)
 
-# Function to save settings to the database
-def save_settings(set_cstr_temp_input, set_ec_input, set_feed_level_input, settings_window):
-    global set_cstr_temp_value, set_ec_value, set_feed_level_value
-    try:
-        # Convert input values to float
-        set_cstr_temp = float(set_cstr_temp_input.get())
-        set_ec = float(set_ec_input.get())
-        set_feed_level = float(set_feed_level_input.get())
-
-        # Save settings to the database
-        conn = psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
-        )
-        now = datetime.now()
+# Function to insert a settings row (runs on a db worker thread)
+def insert_settings(set_cstr_temp, set_ec, set_feed_level):
+    now = datetime.now()
+    with database.connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "INSERT INTO fo_setting (timestamp, set_cstr_temp, set_ec, published, set_feed_level) VALUES (%s, %s, %s, %s, %s)",
             (now, set_cstr_temp, set_ec, False, set_feed_level)
         )
-        conn.commit()
         cursor.close()
-        conn.close()
+    return set_cstr_temp, set_ec, set_feed_level
+
+# Function to read the latest settings row (runs on a db worker thread)
+def query_latest_settings():
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT set_cstr_temp, set_ec, set_feed_level FROM fo_setting ORDER BY timestamp DESC LIMIT 1")
+        latest_settings = cursor.fetchone()
+        cursor.close()
+    return latest_settings
 
+# Function to save settings to the database
+def save_settings(set_cstr_temp_input, set_ec_input, set_feed_level_input, settings_window, save_button=None):
+    try:
+        # Convert input values to float
+        set_cstr_temp = float(set_cstr_temp_input.get())
+        set_ec = float(set_ec_input.get())
+        set_feed_level = float(set_feed_level_input.get())
+    except ValueError:
+        messagebox.showerror("Invalid Input", "All fields must be numeric values.")
+        return
+
+    def saved(values):
+        global set_cstr_temp_value, set_ec_value, set_feed_level_value
         # Update the global variables
-        set_cstr_temp_value = set_cstr_temp
-        set_ec_value = set_ec
-        set_feed_level_value = set_feed_level
+        set_cstr_temp_value, set_ec_value, set_feed_level_value = values
 
         messagebox.showinfo("Success", "Settings have been saved successfully.")
         settings_window.grab_release()
         settings_window.destroy()
-    except ValueError:
-        messagebox.showerror("Invalid Input", "All fields must be numeric values.")
-    except Exception as e:
+
+    def failed(e):
         messagebox.showerror("Error", f"An error occurred: {e}")
         settings_window.grab_release()
         settings_window.destroy()
 
+    if save_button is not None:
+        save_button.configure(state="disabled", text="Saving...")
+    db.submit(insert_settings, set_cstr_temp, set_ec, set_feed_level, on_done=saved, on_error=failed, key='save_settings')
+
 def open_settings():
     global set_cstr_temp_value, set_ec_value, set_feed_level_value
     settings_window = CTkToplevel()
@@ -254,19 +265,12 @@ def open_settings():
     set_feed_level_input = CTkEntry(settings_window, font=("Helvetica", 18))
     set_feed_level_input.pack(pady=5)
 
-    save_button = CTkButton(settings_window, text="Save Settings", command=lambda: save_settings(set_cstr_temp_input, set_ec_input, set_feed_level_input, settings_window), font=("Helvetica", 18))
+    save_button = CTkButton(settings_window, text="Save Settings", command=lambda: save_settings(set_cstr_temp_input, set_ec_input, set_feed_level_input, settings_window, save_button), font=("Helvetica", 18))
     save_button.pack(pady=20)
 
-    # Fetch the latest settings from the database
-    try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
-        )
-        cursor = conn.cursor()
-        cursor.execute("SELECT set_cstr_temp, set_ec, set_feed_level FROM fo_setting ORDER BY timestamp DESC LIMIT 1")
-        latest_settings = cursor.fetchone()
-        conn.close()
-
+    # Fetch the latest settings from the database in the background
+    def fill(latest_settings):
+        global set_cstr_temp_value, set_ec_value, set_feed_level_value
         if latest_settings:
             set_cstr_temp_input.insert(0, str(latest_settings[0]))
             set_ec_input.insert(0, str(latest_settings[1]))
@@ -278,24 +282,18 @@ def open_settings():
             set_ec_value = latest_settings[1]
             set_feed_level_value = latest_settings[2]
 
-    except Exception as e:
+    def failed(e):
         messagebox.showerror("Error", f"An error occurred while fetching settings: {e}")
         settings_window.grab_release()
         settings_window.destroy()
 
+    db.submit(query_latest_settings, on_done=fill, on_error=failed, key='open_settings', loading=LoadingLabel(settings_window))
 
-# Function to fetch the latest settings at startup
-def fetch_latest_settings():
-    global set_cstr_temp_value, set_ec_value, set_feed_level_value
-    try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
-        )
-        cursor = conn.cursor()
-        cursor.execute("SELECT set_cstr_temp, set_ec, set_feed_level FROM fo_setting ORDER BY timestamp DESC LIMIT 1")
-        latest_settings = cursor.fetchone()
-        conn.close()
 
+# Function to fetch the latest settings at startup, then start publishing them
+def fetch_latest_settings():
+    def loaded(latest_settings):
+        global set_cstr_temp_value, set_ec_value, set_feed_level_value
         if latest_settings:
             set_cstr_temp_value = latest_settings[0]
             set_ec_value = latest_settings[1]
@@ -304,9 +302,13 @@ def fetch_latest_settings():
             set_cstr_temp_value = None
             set_ec_value = None
             set_feed_level_value = None
+        publish_settings()
 
-    except Exception as e:
+    def failed(e):
         messagebox.showerror("Error", f"An error occurred while fetching settings: {e}")
+        publish_settings()
+
+    db.submit(query_latest_settings, on_done=loaded, on_error=failed, key='latest_settings')
 
 # Function to publish settings to MQTT topics every 1 minute
 def publish_settings():
@@ -315,56 +317,151 @@ def publish_settings():
     mqtt_client.publish("set-feed-level", str(set_feed_level_value))
     app.after(60000, publish_settings)  # Schedule to run every 1 minute
 
-# Function to download data as CSV
-def download_data(from_date_input, to_date_input, download_window):
-    from_date = from_date_input.get_date().strftime('%Y-%m-%d %H:%M:%S')
-    to_date = to_date_input.get_date().strftime('%Y-%m-%d %H:%M:%S')
-
+# Function to download data as CSV or Parquet (by file extension), raw or from a rollup.
+# The export streams from the database on a db worker; the window shows its progress and
+# the Cancel button stops it.
+def download_data(from_date_input, to_date_input, from_time_input, to_time_input, column_vars, resolution_input, progress_bar, cancel_button, download_window):
+    running = getattr(download_window, 'export_job', None)
+    if running is not None and running.finished is None:
+        return
+    from_date = from_date_input.get_date().strftime('%Y-%m-%d 00:00:00')
+    to_date = to_date_input.get_date().strftime('%Y-%m-%d 23:59:59')
+    columns = [column for column, var in column_vars.items() if var.get()]
+    if not columns:
+        messagebox.showerror("Error", "Select at least one column to download.")
+        return
+
+    # Optional time-of-day window, applied to every day of the range
+    day_start, day_end = from_time_input.get().strip(), to_time_input.get().strip()
     try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
-        )
-        query = f"SELECT * FROM fo_sensor_data WHERE timestamp BETWEEN '{from_date}' AND '{to_date}'"
-        df = pd.read_sql_query(query, conn)
-        file_path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")], initialdir="/home/resurgencefo/pictures")
-        if file_path:
-            df.to_csv(file_path, index=False)
-            conn.close()
-            messagebox.showinfo("Success", "Data has been downloaded successfully.")
+        if day_start or day_end:
+            day_start = datetime.strptime(day_start or "00:00", '%H:%M').strftime('%H:%M:00')
+            day_end = datetime.strptime(day_end or "23:59", '%H:%M').strftime('%H:%M:59')
+        else:
+            day_start = day_end = None
+    except ValueError:
+        messagebox.showerror("Error", "Times of day must be in HH:MM format.")
+        return
+
+    file_path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv"), ("Parquet files", "*.parquet")], initialdir="/home/resurgencefo/pictures")
+    if not file_path:
+        return
+
+    job = export.ExportJob()
+    download_window.export_job = job
+    cancel_button.configure(state="normal", command=job.cancel)
+
+    # The window may have been closed (cancelling the job) before these run
+    def show_progress():
+        if job.finished is None and download_window.winfo_exists():
+            progress_bar.set(job.progress or 0)
+            download_window.after(200, show_progress)
+
+    def downloaded(rows):
+        messagebox.showinfo("Success", f"{rows} rows have been downloaded successfully.")
+        if download_window.winfo_exists():
             download_window.grab_release()
             download_window.destroy()
-    except Exception as e:
+
+    def failed(e):
+        if isinstance(e, export.ExportCancelled):
+            if download_window.winfo_exists():
+                progress_bar.set(0)
+                cancel_button.configure(state="disabled")
+            return
         messagebox.showerror("Error", f"An error occurred: {e}")
-        download_window.grab_release()
-        download_window.destroy()
+        if download_window.winfo_exists():
+            download_window.grab_release()
+            download_window.destroy()
+
+    db.submit(export.export_file, file_path, from_date, to_date, columns, day_start, day_end, job, resolution_input.get(),
+              on_done=downloaded, on_error=failed, key='download')
+    show_progress()
+
+# Function to cancel a running download when its window is closed
+def close_download(download_window):
+    job = getattr(download_window, 'export_job', None)
+    if job is not None:
+        job.cancel()
+    download_window.grab_release()
+    download_window.destroy()
 
 # Function to open the download window
 def open_download():
     download_window = CTkToplevel()
     download_window.title("Download Data")
-    download_window.geometry("600x400")
+    download_window.geometry("700x780")
+    download_window.protocol("WM_DELETE_WINDOW", lambda: close_download(download_window))
 
     # Ensure the window is visible before grabbing
     download_window.update_idletasks()
     download_window.after(100, lambda: download_window.grab_set())
 
-    from_date_label = CTkLabel(download_window, text="From Date:", font=("Helvetica", 18))
-    from_date_label.pack(pady=10)
-    from_date_input = DateEntry(download_window, date_pattern='yyyy-mm-dd', font=("Helvetica", 18))
-    from_date_input.pack(pady=10)
+    range_frame = CTkFrame(download_window, fg_color="transparent")
+    range_frame.pack(pady=10)
+
+    from_date_label = CTkLabel(range_frame, text="From Date:", font=("Helvetica", 18))
+    from_date_label.grid(row=0, column=0, padx=10, pady=10, sticky="e")
+    from_date_input = DateEntry(range_frame, date_pattern='yyyy-mm-dd', font=("Helvetica", 18))
+    from_date_input.grid(row=0, column=1, padx=10, pady=10)
+
+    to_date_label = CTkLabel(range_frame, text="To Date:", font=("Helvetica", 18))
+    to_date_label.grid(row=1, column=0, padx=10, pady=10, sticky="e")
+    to_date_input = DateEntry(range_frame, date_pattern='yyyy-mm-dd', font=("Helvetica", 18))
+    to_date_input.grid(row=1, column=1, padx=10, pady=10)
+
+    # Optional time-of-day bounds (HH:MM); empty means the whole day
+    from_time_label = CTkLabel(range_frame, text="Daily From:", font=("Helvetica", 18))
+    from_time_label.grid(row=2, column=0, padx=10, pady=10, sticky="e")
+    from_time_input = CTkEntry(range_frame, placeholder_text="HH:MM", font=("Helvetica", 18))
+    from_time_input.grid(row=2, column=1, padx=10, pady=10)
+
+    to_time_label = CTkLabel(range_frame, text="Daily To:", font=("Helvetica", 18))
+    to_time_label.grid(row=3, column=0, padx=10, pady=10, sticky="e")
+    to_time_input = CTkEntry(range_frame, placeholder_text="HH:MM", font=("Helvetica", 18))
+    to_time_input.grid(row=3, column=1, padx=10, pady=10)
+
+    # Column checkboxes, filled in once the table's columns are loaded
+    columns_frame = CTkScrollableFrame(download_window, label_text="Columns", height=200)
+    columns_frame.pack(fill="x", padx=20, pady=10)
+    column_vars = {}
+
+    def fill_columns(columns):
+        if not download_window.winfo_exists():
+            return
+        for i, column in enumerate(columns):
+            column_vars[column] = tk.BooleanVar(value=True)
+            checkbox = CTkCheckBox(columns_frame, text=column, variable=column_vars[column])
+            checkbox.grid(row=i // 3, column=i % 3, padx=10, pady=5, sticky="w")
+
+    db.submit(export.table_columns, on_done=fill_columns, key=('columns', str(download_window)),
+              loading=LoadingLabel(columns_frame))
+
+    # Raw rows, or one averaged row per rollup bucket
+    resolution_label = CTkLabel(range_frame, text="Resolution:", font=("Helvetica", 18))
+    resolution_label.grid(row=4, column=0, padx=10, pady=10, sticky="e")
+    resolution_input = CTkOptionMenu(range_frame, values=["raw"] + [name for name, _, _ in reversed(rollups.RESOLUTIONS)], font=("Helvetica", 18))
+    resolution_input.grid(row=4, column=1, padx=10, pady=10)
+
+    progress_bar = CTkProgressBar(download_window)
+    progress_bar.set(0)
+    progress_bar.pack(fill="x", padx=20, pady=10)
 
-    to_date_label = CTkLabel(download_window, text="To Date:", font=("Helvetica", 18))
-    to_date_label.pack(pady=10)
-    to_date_input = DateEntry(download_window, date_pattern='yyyy-mm-dd', font=("Helvetica", 18))
-    to_date_input.pack(pady=10)
+    buttons_frame = CTkFrame(download_window, fg_color="transparent")
+    buttons_frame.pack(pady=10)
 
-    download_button = CTkButton(download_window, text="Download", command=lambda: download_data(from_date_input, to_date_input, download_window), font=("Helvetica", 18))
-    download_button.pack(pady=20)
+    cancel_button = CTkButton(buttons_frame, text="Cancel", state="disabled", font=("Helvetica", 18))
+    download_button = CTkButton(buttons_frame, text="Download", command=lambda: download_data(from_date_input, to_date_input, from_time_input, to_time_input, column_vars, resolution_input, progress_bar, cancel_button, download_window), font=("Helvetica", 18))
+    download_button.grid(row=0, column=0, padx=10)
+    cancel_button.grid(row=0, column=1, padx=10)
 
 app = CTk()
 app.title("Aquameter Forward Osmosis")
 app.geometry('1024x600')
 
+# Database work runs on these workers; results come back on the Tk thread
+db = TkExecutor(app)
+
 # Create a menu
 menu_bar = Menu(app)
 app.config(menu=menu_bar)
@@ -393,32 +490,39 @@ right_logo_label.grid(row=0, column=2, padx=20, sticky="e")
 title_label = CTkLabel(master=title_frame, text="Forward Osmosis", font=("Times New Roman", 44, 'bold'))
 title_label.grid(row=0, column=1, pady=10)
 
+# Display row for one sensor: (label, topic, column, unit suffix)
+def sensor_param(topic):
+    sensor = sensor_registry.BY_TOPIC[topic]
+    return (sensor.label, sensor.topic, sensor.column, f" {sensor.unit}")
+
 sections = ["Anaerobic CSTR", "Feed Tank", "DS Tank"]
 
 anaerobic_cstr_params = [
-    ("PH", "cstr-ph", "cstr_ph", " /14"),
-    ("ORP", "cstr-orp", "cstr_orp", " mV"),
-    ("Temp", "cstr-temp", "cstr_temp", " °C"),
-    ("Level", "cstr-level", "cstr_level", " Liters"),
-    ("DS Weight", "weight", "weight", " g"),
-    ("Flux", "flux", "flux", " LMH")  # Flux data fetched from database
+    sensor_param("cstr-ph"),
+    sensor_param("cstr-orp"),
+    sensor_param("cstr-temp"),
+    sensor_param("cstr-level"),
+    sensor_param("weight"),
+    sensor_param("fo/flux")
 ]
 
 feed_tank_params = [
-    ("EC", "feed-ec", "feed_ec", " mS/cm"),
-    ("TDS", "feed-tds", "feed_tds", " PPM"),
-    ("Level", "feed-level", "feed_level", " mL"),
+    sensor_param("feed-ec"),
+    sensor_param("feed-tds"),
+    sensor_param("feed-level"),
 ]
 
 ds_params = [
-    ("EC", "ds-ec", "ds_ec", " mS/cm"),
-    ("TDS", "ds-tds", "ds_tds", " PPM"),
-    ("Level", "ds-level", "ds_level", " mL"),
+    sensor_param("ds-ec"),
+    sensor_param("ds-tds"),
+    sensor_param("ds-level"),
 ]
 
 parameters = [anaerobic_cstr_params, feed_tank_params, ds_params]
 
 value_labels = {}
+value_units = {}
+displayed_text = {}  # Text currently shown by each value label
 
 for i, section in enumerate(sections):
     section_frame = CTkFrame(master=app, fg_color="transparent")
@@ -429,16 +533,15 @@ for i, section in enumerate(sections):
 
     if section == "Anaerobic CSTR":
         for j, (param, topic, col, unit) in enumerate(parameters[i]):
-            if topic == "flux":
-                value = fetch_flux_data()  # Fetch flux data from the database
-            else:
-                value = mqtt_values[topic]
+            value = mqtt_values.get(topic)
             param_frame = CTkFrame(master=section_frame, height=100, width=200, fg_color="#cfeaf7")
             param_frame.grid(row=(j // 2) + 1, column=j % 2, pady=10, padx=20, sticky="nsew")
 
             value_label = CTkLabel(master=param_frame, text=f"{value}{unit}", font=("Times New Roman", 32, 'bold'))
             value_label.place(relx=0.5, rely=0.3, anchor="center")
             value_labels[topic] = value_label
+            value_units[topic] = unit
+            displayed_text[topic] = f"{value}{unit}"
             border_line = CTkFrame(master=param_frame, height=2, width=200, fg_color="black")
             border_line.place(relx=0.5, rely=0.6, anchor="center")
             param_label = CTkLabel(master=param_frame, text=f"{param}", font=("Times New Roman", 20, 'bold'))
@@ -448,13 +551,15 @@ for i, section in enumerate(sections):
 
     else:
         for j, (param, topic, col, unit) in enumerate(parameters[i]):
-            value = mqtt_values[topic]
+            value = mqtt_values.get(topic)
             param_frame = CTkFrame(master=section_frame, height=100, width=200, fg_color="#cfeaf7")
             param_frame.grid(row=j + 1, column=0, pady=10, padx=20, sticky="nsew")
 
             value_label = CTkLabel(master=param_frame, text=f"{value}{unit}", font=("Times New Roman", 32, 'bold'))
             value_label.place(relx=0.5, rely=0.3, anchor="center")
             value_labels[topic] = value_label
+            value_units[topic] = unit
+            displayed_text[topic] = f"{value}{unit}"
             border_line = CTkFrame(master=param_frame, height=2, width=200, fg_color="black")
             border_line.place(relx=0.5, rely=0.6, anchor="center")
             param_label = CTkLabel(master=param_frame, text=f"{param}", font=("Times New Roman", 20, 'bold'))
@@ -477,29 +582,52 @@ for i in range(3):
     app.grid_columnconfigure(i, weight=1)
 app.grid_rowconfigure(1, weight=1)
 
+# Render tick counters: time spent per tick and labels actually reconfigured
+render_stats = {
+    'ticks': 0,
+    'labels_updated': 0,
+    'render_seconds_total': 0.0,
+    'render_seconds_max': 0.0
+}
+
+# Function to update the labels whose displayed text changed since the last tick; any
+# number of messages for a topic between two ticks result in one label update
 def update_ui_values():
-    for i, section in enumerate(sections):
-        if section == "Anaerobic CSTR":
-            for j, (param, topic, col, unit) in enumerate(parameters[i]):
-                if topic == "flux":
-                    # Fetch flux data from the database
-                    value = fetch_flux_data()
-                else:
-                    value = mqtt_values[topic]
-                value_label = value_labels[topic]
-                value_label.configure(text=f"{value}{unit}")
-        else:
-            for j, (param, topic, col, unit) in enumerate(parameters[i]):
-                value = mqtt_values[topic]
-                value_label = value_labels[topic]
-                value_label.configure(text=f"{value}{unit}")
+    started = time.perf_counter()
+    for topic, value in mqtt_values.take_changed().items():
+        text = f"{value}{value_units[topic]}"
+        if displayed_text[topic] != text:
+            value_labels[topic].configure(text=text)
+            displayed_text[topic] = text
+            render_stats['labels_updated'] += 1
+    elapsed = time.perf_counter() - started
+    render_stats['ticks'] += 1
+    render_stats['render_seconds_total'] += elapsed
+    render_stats['render_seconds_max'] = max(render_stats['render_seconds_max'], elapsed)
+
+# Function to report render time per tick and how many messages were coalesced
+def ui_metrics():
+    ticks = render_stats['ticks']
+    return {
+        'ticks': ticks,
+        'labels_updated': render_stats['labels_updated'],
+        'render_ms_avg': render_stats['render_seconds_total'] / ticks * 1000 if ticks else 0.0,
+        'render_ms_max': render_stats['render_seconds_max'] * 1000,
+        'messages': mqtt_values.stats['updates'],
+        'coalesced': mqtt_values.stats['coalesced']
+    }
 
 def periodically_update_ui():
     update_ui_values()
-    app.after(1000, periodically_update_ui)
+    app.after(int(1000 / UI_FPS), periodically_update_ui)
+
+def periodically_report_ui_metrics():
+    print(ui_metrics())
+    app.after(int(UI_METRICS_INTERVAL * 1000), periodically_report_ui_metrics)
 
-# Fetch the latest settings at startup and start publishing
+# Fetch the latest settings at startup; publishing starts once they are loaded
 fetch_latest_settings()
-publish_settings()
-app.after(1000, periodically_update_ui)
+app.after(int(1000 / UI_FPS), periodically_update_ui)
+if UI_METRICS_INTERVAL > 0:
+    app.after(int(UI_METRICS_INTERVAL * 1000), periodically_report_ui_metrics)
 app.mainloop()
@@ -0,0 +1,244 @@
+import threading
+import time
+from datetime import timedelta
+import database
+from uploader import ensure_sync_table
+
+SOURCE_TABLE = 'fo_sensor_data'
+WATERMARK_NAME = 'rollup_fo_sensor_data'  # Row in fo_sync_watermark tracking the last rolled-up id
+
+# Rollup resolutions, coarsest first: (name, table, bucket width in seconds)
+RESOLUTIONS = [
+    ('1h', 'fo_sensor_rollup_1h', 3600),
+    ('15m', 'fo_sensor_rollup_15m', 900),
+    ('1m', 'fo_sensor_rollup_1m', 60),
+]
+
+REFRESH_CHUNK = 50000  # Source rows rolled up per transaction, bounds the initial backfill
+MIN_POINTS = 300       # Fewest points a routed query should return before falling back to finer data
+
+# Columns of the source table that are never rolled up
+_EXCLUDED_COLUMNS = ('id', 'timestamp', 'published')
+_NUMERIC_TYPES = ('double precision', 'real', 'numeric', 'integer', 'bigint', 'smallint')
+_sensor_columns = None
+
+
+# Function to create the rollup tables and the source timestamp index used by raw queries.
+# Rollups are stored long (one row per bucket and sensor) so columns can be added to the
+# source table without touching them; avg is sum / count.
+def ensure_rollup_tables():
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        for _, table, _ in RESOLUTIONS:
+            cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket TIMESTAMP NOT NULL,
+                sensor TEXT NOT NULL,
+                sum DOUBLE PRECISION NOT NULL,
+                min DOUBLE PRECISION NOT NULL,
+                max DOUBLE PRECISION NOT NULL,
+                count BIGINT NOT NULL,
+                PRIMARY KEY (sensor, bucket)
+            )
+            ''')
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {SOURCE_TABLE}_timestamp_idx ON {SOURCE_TABLE} (timestamp)")
+        cursor.close()
+
+    # Seed the watermark row so refreshes can lock it
+    ensure_sync_table()
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+        INSERT INTO fo_sync_watermark (name, last_id) VALUES (%s, 0)
+        ON CONFLICT (name) DO NOTHING
+        ''', (WATERMARK_NAME,))
+        cursor.close()
+
+
+# Function to list the numeric sensor columns of the source table (cached after the first call)
+def sensor_columns():
+    global _sensor_columns
+    if _sensor_columns is not None:
+        return list(_sensor_columns)
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = %s AND data_type = ANY(%s) AND column_name <> ALL(%s)
+        ORDER BY ordinal_position
+        ''', (SOURCE_TABLE, list(_NUMERIC_TYPES), list(_EXCLUDED_COLUMNS)))
+        columns = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+    _sensor_columns = columns
+    return list(columns)
+
+
+# Incrementally maintained 1-minute, 15-minute and 1-hour rollups of fo_sensor_data.
+# Each refresh() folds only the rows added since the last one (tracked by id in
+# fo_sync_watermark) into every resolution, merging sum/min/max/count into existing
+# buckets, and advances the watermark in the same transaction so no row is counted twice.
+class Rollups:
+    def __init__(self, columns=None):
+        self._columns = columns
+        self._queries = None
+        self.stats = {
+            'refreshes': 0,
+            'rows_rolled_up': 0,
+            'last_refresh_seconds': 0.0
+        }
+
+    def _prepare(self):
+        if self._queries is None:
+            ensure_rollup_tables()
+            if self._columns is None:
+                self._columns = sensor_columns()
+            values = ', '.join(f"('{column}', d.{column}::DOUBLE PRECISION)" for column in self._columns)
+            self._queries = [f'''
+            INSERT INTO {table} AS r (bucket, sensor, sum, min, max, count)
+            SELECT TIMESTAMP 'epoch' + FLOOR(EXTRACT(EPOCH FROM d.timestamp) / {width}) * {width} * INTERVAL '1 second',
+                   v.sensor, SUM(v.value), MIN(v.value), MAX(v.value), COUNT(*)
+            FROM {SOURCE_TABLE} d
+            CROSS JOIN LATERAL (VALUES {values}) AS v (sensor, value)
+            WHERE d.id > %(after)s AND d.id <= %(upto)s AND d.timestamp IS NOT NULL AND v.value IS NOT NULL
+            GROUP BY 1, 2
+            ON CONFLICT (sensor, bucket) DO UPDATE SET
+                sum = r.sum + EXCLUDED.sum,
+                min = LEAST(r.min, EXCLUDED.min),
+                max = GREATEST(r.max, EXCLUDED.max),
+                count = r.count + EXCLUDED.count
+            ''' for _, table, width in RESOLUTIONS]
+
+    @property
+    def columns(self):
+        self._prepare()
+        return list(self._columns)
+
+    # Fold new source rows into every rollup; returns the number of source rows processed
+    def refresh(self):
+        self._prepare()
+        started = time.monotonic()
+        processed = 0
+        while True:
+            with database.connection() as conn:
+                cursor = conn.cursor()
+                # Row lock serializes concurrent refreshers
+                cursor.execute("SELECT last_id FROM fo_sync_watermark WHERE name = %s FOR UPDATE", (WATERMARK_NAME,))
+                after = cursor.fetchone()[0]
+                cursor.execute(f"SELECT MAX(id) FROM {SOURCE_TABLE}")
+                latest = cursor.fetchone()[0] or 0
+                if latest <= after:
+                    cursor.close()
+                    break
+                upto = min(latest, after + REFRESH_CHUNK)
+                for query in self._queries:
+                    cursor.execute(query, {'after': after, 'upto': upto})
+                cursor.execute("UPDATE fo_sync_watermark SET last_id = %s, updated_at = NOW() WHERE name = %s",
+                               (upto, WATERMARK_NAME))
+                cursor.close()
+            processed += upto - after
+        self.stats['refreshes'] += 1
+        self.stats['rows_rolled_up'] += processed
+        self.stats['last_refresh_seconds'] = time.monotonic() - started
+        return processed
+
+
+# Background thread that refreshes the rollups every interval seconds
+class RollupRefresher:
+    def __init__(self, rollups=None, interval=60.0):
+        self.rollups = rollups or Rollups()
+        self.interval = interval
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="rollup-refresher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                processed = self.rollups.refresh()
+                if processed:
+                    print(f"Rolled up {processed} rows in {self.rollups.stats['last_refresh_seconds']:.2f} s.")
+            except Exception as e:
+                print(f"Error refreshing rollups: {e}")
+            self._wakeup.wait(self.interval)
+
+
+# Pick the coarsest rollup that still yields min_points buckets over [start, end];
+# returns (name, table, width), or None when only raw rows are fine enough
+def choose_resolution(start, end, min_points=MIN_POINTS):
+    span = (end - start).total_seconds()
+    for resolution in RESOLUTIONS:
+        if span / resolution[2] >= min_points:
+            return resolution
+    return None
+
+
+# Query router for the dashboards: one range query returning a wide frame with a timestamp
+# column and one column per requested sensor, all aligned on the same rows, read from the
+# coarsest resolution that gives enough points. Sensors missing from the table come back
+# as all-NaN columns. With with_bounds, every sensor also gets {column}_min and
+# {column}_max (equal to the value for raw rows). With resample (a pandas offset alias such
+# as '5min'), rows are regridded onto a regular index. resolution ('raw' or a rollup name)
+# overrides the routing. The frame's attrs record the resolution used.
+def fetch_series(columns, start, end, min_points=MIN_POINTS, with_bounds=False, resample=None, resolution=None):
+    import pandas as pd  # Only the dashboards need pandas
+
+    columns = list(dict.fromkeys(columns))
+    known = set(sensor_columns())
+    present = [column for column in columns if column in known]
+    start, end = pd.Timestamp(start).to_pydatetime(), pd.Timestamp(end).to_pydatetime()
+    if resolution is None:
+        resolution = choose_resolution(start, end, min_points)
+    elif resolution == 'raw':
+        resolution = None
+    else:
+        resolution = next(r for r in RESOLUTIONS if r[0] == resolution)
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        if resolution is None:
+            cursor.execute(f'''
+            SELECT timestamp{''.join(f", {column}" for column in present)} FROM {SOURCE_TABLE}
+            WHERE timestamp BETWEEN %s AND %s ORDER BY timestamp ASC
+            ''', (start, end))
+            df = pd.DataFrame(cursor.fetchall(), columns=['timestamp'] + present).reindex(columns=['timestamp'] + columns)
+            if with_bounds:
+                for column in columns:
+                    df[f"{column}_min"] = df[column]
+                    df[f"{column}_max"] = df[column]
+        else:
+            cursor.execute(f'''
+            SELECT bucket, sensor, sum / count, min, max FROM {resolution[1]}
+            WHERE sensor = ANY(%s) AND bucket > %s AND bucket <= %s
+            ''', (present, start - timedelta(seconds=resolution[2]), end))
+            long = pd.DataFrame(cursor.fetchall(), columns=['timestamp', 'sensor', 'avg', 'min', 'max'])
+            df = long.pivot(index='timestamp', columns='sensor', values='avg').reindex(columns=columns)
+            if with_bounds:
+                for bound in ('min', 'max'):
+                    values = long.pivot(index='timestamp', columns='sensor', values=bound).reindex(columns=columns)
+                    for column in columns:
+                        df[f"{column}_{bound}"] = values[column]
+            df = df.sort_index().rename_axis(columns=None).reset_index()
+        cursor.close()
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    df[df.columns[1:]] = df[df.columns[1:]].astype('float64')
+
+    if resample:
+        aggregations = {column: 'mean' for column in df.columns[1:]}
+        if with_bounds:
+            aggregations.update({f"{column}_min": 'min' for column in columns})
+            aggregations.update({f"{column}_max": 'max' for column in columns})
+        df = df.set_index('timestamp').resample(resample).agg(aggregations).reset_index()
+    df.attrs['resolution'] = resolution[0] if resolution else 'raw'
+    return df
@@ -0,0 +1,132 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+
+
+# A job run by the Scheduler: periodic when interval is set, otherwise once.
+# Jitter is how late a run started relative to its due time; overruns count periodic
+# ticks skipped because the previous run (or another job) took too long.
+class Job:
+    def __init__(self, name, fn, args, interval):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.interval = interval
+        self.cancelled = False
+        self.runs = 0
+        self.errors = 0
+        self.overruns = 0
+        self.jitter_total = 0.0
+        self.jitter_max = 0.0
+        self.duration_max = 0.0
+
+    def cancel(self):
+        self.cancelled = True
+
+    def summary(self):
+        return {
+            'job': self.name,
+            'runs': self.runs,
+            'errors': self.errors,
+            'overruns': self.overruns,
+            'jitter_avg_ms': self.jitter_total / self.runs * 1000 if self.runs else 0.0,
+            'jitter_max_ms': self.jitter_max * 1000,
+            'duration_max_ms': self.duration_max * 1000
+        }
+
+
+# Single-threaded job scheduler on a heap of due times.
+# Every job runs on the one worker thread, so jobs never run concurrently with each other
+# and anything they share (database access, control state) needs no further locking.
+# Periodic jobs are due at first + k * interval on the monotonic clock, so intervals do
+# not drift with run time; ticks missed while the worker was busy are skipped, not queued.
+# call_soon() hands one-off work (e.g. from the MQTT or LISTEN threads) to the worker.
+class Scheduler:
+    def __init__(self, name="scheduler"):
+        self.name = name
+        self._heap = []
+        self._seq = itertools.count()  # Tie-breaker so jobs due at the same time run in order
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self._jobs = {}                # name -> Job, for the metrics
+        self._one_off = Job('call_soon', None, (), None)
+
+    # Run fn(*args) every interval seconds, the first time after first seconds
+    def every(self, interval, fn, *args, name=None, first=0.0):
+        job = Job(name or fn.__name__, fn, args, interval)
+        self._jobs[job.name] = job
+        self._push(time.monotonic() + first, job)
+        return job
+
+    # Run fn(*args) on the worker as soon as possible; safe to call from any thread
+    def call_soon(self, fn, *args):
+        job = Job(self._one_off.name, fn, args, None)
+        self._push(time.monotonic(), job)
+        return job
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    # Stop after the job currently running, if any; pending jobs are dropped
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def metrics(self):
+        return [job.summary() for job in list(self._jobs.values()) + [self._one_off]]
+
+    def _push(self, due, job):
+        with self._cond:
+            heapq.heappush(self._heap, (due, next(self._seq), job))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    if self._heap:
+                        wait = self._heap[0][0] - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+                if self._stopping:
+                    return
+                due, _, job = heapq.heappop(self._heap)
+            if not job.cancelled:
+                self._execute(job, due)
+
+    def _execute(self, job, due):
+        stats = self._one_off if job.interval is None else job
+        started = time.monotonic()
+        try:
+            job.fn(*job.args)
+        except Exception as e:
+            stats.errors += 1
+            print(f"Error in scheduled job {job.name}: {e}")
+        finished = time.monotonic()
+
+        jitter = started - due
+        stats.runs += 1
+        stats.jitter_total += jitter
+        stats.jitter_max = max(stats.jitter_max, jitter)
+        stats.duration_max = max(stats.duration_max, finished - started)
+
+        if job.interval is not None and not job.cancelled:
+            due += job.interval
+            if due <= finished:
+                skipped = math.ceil((finished - due) / job.interval)
+                job.overruns += skipped
+                due += skipped * job.interval
+            self._push(due, job)
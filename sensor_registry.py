@@ -0,0 +1,119 @@
+import json
+import sys
+
+# Bounds used when a sensor has no physical limit; they also reject inf and nan
+_LOWEST = -sys.float_info.max
+_HIGHEST = sys.float_info.max
+
+
+# First byte of JSON-encoded payloads, as bytes (paho) or str
+_QUOTE = (b'"', '"')
+
+
+# Slow path for anything the fast paths do not handle: any JSON document holding a
+# number, a quoted number ("7.1") or an object with a "value" field ({"value": 7.1})
+def _parse_json(payload):
+    try:
+        value = json.loads(payload)
+        if isinstance(value, dict):
+            value = value.get('value')
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# One sensor reading published on its own MQTT topic.
+# parse() turns a raw payload into a float, or None when the payload is malformed or
+# outside [minimum, maximum]; rejected payloads are counted per sensor.
+class Sensor:
+    __slots__ = ('topic', 'column', 'label', 'unit', 'minimum', 'maximum', 'derived', 'rejected')
+
+    def __init__(self, topic, column, label, unit, minimum=None, maximum=None, derived=False):
+        self.topic = topic
+        self.column = column
+        self.label = label
+        self.unit = unit
+        self.minimum = _LOWEST if minimum is None else minimum
+        self.maximum = _HIGHEST if maximum is None else maximum
+        self.derived = derived  # Published by our own scripts rather than by a probe
+        self.rejected = 0
+
+    def parse(self, payload):
+        try:
+            if payload[:1] in _QUOTE:
+                value = float(payload[1:-1])  # Quoted number, without going through json
+            else:
+                value = float(payload)  # float() accepts plain numbers as bytes or str
+        except (TypeError, ValueError):
+            value = _parse_json(payload)
+            if value is None:
+                self.rejected += 1
+                return None
+        if self.minimum <= value <= self.maximum:
+            return value
+        self.rejected += 1
+        return None
+
+
+# Derived values are published under the prefix of the rig whose ingestion process
+# computed them, so the FO and MD processes never overwrite each other's retained messages
+# on the shared broker
+FO_PREFIX = 'fo/'
+MD_PREFIX = 'md/'
+
+# Every sensor topic in the plant; the single source for topic, column, unit and limits
+SENSORS = [
+    Sensor('cstr-ph', 'cstr_ph', 'PH', '/14', 0, 14),
+    Sensor('cstr-orp', 'cstr_orp', 'ORP', 'mV', -2000, 2000),
+    Sensor('cstr-temp', 'cstr_temp', 'Temp', '°C', -20, 150),
+    Sensor('cstr-level', 'cstr_level', 'Level', 'Liters', 0),
+    Sensor('cstr-ec', 'cstr_ec', 'EC', 'mS/cm', 0),
+    Sensor('cstr-tds', 'cstr_tds', 'TDS', 'PPM', 0),
+    Sensor('feed-ec', 'feed_ec', 'EC', 'mS/cm', 0),
+    Sensor('feed-temp', 'feed_temp', 'Temp', '°C', -20, 150),
+    Sensor('feed-level', 'feed_level', 'Level', 'mL', 0),
+    Sensor('feed-tds', 'feed_tds', 'TDS', 'PPM', 0),
+    Sensor('ds-ec', 'ds_ec', 'EC', 'mS/cm', 0),
+    Sensor('ds-tds', 'ds_tds', 'TDS', 'PPM', 0),
+    Sensor('ds-level', 'ds_level', 'Level', 'mL', 0),
+    Sensor('weight', 'weight', 'DS Weight', 'g'),
+    Sensor(FO_PREFIX + 'flux', 'flux', 'Flux', 'LMH', derived=True),
+    Sensor(FO_PREFIX + 'vol-to-ds', 'vol_to_ds', 'Volume to DS', 'mL', derived=True),
+    Sensor(FO_PREFIX + 'com-vol-fs', 'com_vol_fs', 'FS Volume', 'mL', derived=True),
+    Sensor(FO_PREFIX + 'increase-in-fs', 'increase_in_fs', 'FS TDS Increase', 'PPM', derived=True),
+]
+
+# Flux derived by the MD ingestion process (md_data_control); kept out of SENSORS so the
+# FO flux column maps to the FO topic
+MD_FLUX = Sensor(MD_PREFIX + 'flux', 'flux', 'Flux', 'LMH', derived=True)
+
+# Values computed by the FO ingestion process (data_control) and published on their
+# topics (retained)
+DERIVED = [sensor for sensor in SENSORS if sensor.derived]
+
+BY_TOPIC = {sensor.topic: sensor for sensor in SENSORS + [MD_FLUX]}
+BY_COLUMN = {sensor.column: sensor for sensor in SENSORS}
+
+
+# Topic -> Sensor dispatch table for the given topics, in the given order
+def dispatch_table(topics):
+    return {topic: BY_TOPIC[topic] for topic in topics}
+
+
+# Sensors for the given columns, e.g. to build a UI section
+def by_columns(columns):
+    return [BY_COLUMN[column] for column in columns]
+
+
+# Parse a payload from any known topic; returns (sensor, value), with value None if
+# the payload was rejected and sensor None if the topic is unknown
+def decode(topic, payload):
+    sensor = BY_TOPIC.get(topic)
+    if sensor is None:
+        return None, None
+    return sensor, sensor.parse(payload)
+
+
+# Rejected payload counts per topic, for sensors that had any
+def rejected_counts():
+    return {sensor.topic: sensor.rejected for sensor in BY_TOPIC.values() if sensor.rejected}
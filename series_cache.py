@@ -0,0 +1,179 @@
+import os
+import threading
+from datetime import datetime, timedelta
+import rollups
+
+# Memory budget for cached series, and how far behind the wall clock data is treated as
+# final: rows newer than that may still be arriving (batched writes, rollup refreshes),
+# so that edge is never cached and is fetched again on the next request.
+SERIES_CACHE_MAX_BYTES = int(os.environ.get('SERIES_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+SERIES_CACHE_LIVE_EDGE = timedelta(seconds=float(os.environ.get('SERIES_CACHE_LIVE_EDGE', '120')))
+
+
+# A cached time range [start, end] of one column at one resolution; frame holds its rows
+# (timestamp, value)
+class _Segment:
+    __slots__ = ('start', 'end', 'frame', 'nbytes', 'used')
+
+    def __init__(self, start, end, frame, used):
+        self.start = start
+        self.end = end
+        self.frame = frame
+        self.nbytes = int(frame.memory_usage(index=True, deep=True).sum())
+        self.used = used
+
+
+# Range-keyed cache in front of rollups.fetch_series for the dashboards.
+# Series are cached per column and resolution as sorted, non-overlapping segments of
+# time. A request is served from the segments it overlaps and only the gaps between them
+# are queried, in one query per distinct gap for all columns missing it; new rows are
+# merged into the neighbouring segments. Segments are evicted least recently used first
+# once the cached frames exceed max_bytes. Data closer to now than live_edge (plus one
+# rollup bucket) is returned but not cached, so only the open "now" edge is re-fetched.
+class SeriesCache:
+    def __init__(self, fetch=rollups.fetch_series, max_bytes=SERIES_CACHE_MAX_BYTES, live_edge=SERIES_CACHE_LIVE_EDGE):
+        self.fetch = fetch
+        self.max_bytes = max_bytes
+        self.live_edge = live_edge
+        self._segments = {}  # (column, resolution) -> segments sorted by start
+        self._bytes = 0
+        self._clock = 0      # Use counter for LRU eviction
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'hits': 0, 'partial_hits': 0, 'misses': 0, 'gap_queries': 0, 'evictions': 0}
+
+    # Same result as rollups.fetch_series(columns, start, end, min_points)
+    def get(self, columns, start, end, min_points=rollups.MIN_POINTS):
+        import pandas as pd
+
+        columns = list(dict.fromkeys(columns))
+        start, end = pd.Timestamp(start).to_pydatetime(), pd.Timestamp(end).to_pydatetime()
+        resolution = rollups.choose_resolution(start, end, min_points)
+        name = resolution[0] if resolution else 'raw'
+        width = timedelta(seconds=resolution[2]) if resolution else timedelta(0)
+
+        # Collect cached rows and the gaps each column is missing
+        pieces = {column: [] for column in columns}
+        gaps = {}  # (gap start, gap end) -> columns missing it
+        with self._lock:
+            for column in columns:
+                cursor = start
+                for segment in self._overlapping((column, name), start, end):
+                    if segment.start > cursor:
+                        gaps.setdefault((cursor, segment.start), []).append(column)
+                    pieces[column].append(segment.frame)
+                    cursor = max(cursor, segment.end)
+                if cursor < end:
+                    gaps.setdefault((cursor, end), []).append(column)
+
+            cached = any(pieces.values())
+            self.stats['requests'] += 1
+            if not gaps:
+                self.stats['hits'] += 1
+            elif cached:
+                self.stats['partial_hits'] += 1
+            else:
+                self.stats['misses'] += 1
+            self.stats['gap_queries'] += len(gaps)
+
+        # Query the gaps outside the lock, then keep what is final
+        final_until = datetime.now() - self.live_edge - width
+        for (gap_start, gap_end), gap_columns in gaps.items():
+            data = self.fetch(gap_columns, gap_start, gap_end, resolution=name)
+            for column in gap_columns:
+                frame = data[['timestamp', column]]
+                pieces[column].append(frame)
+                covered_until = min(gap_end, final_until)
+                if covered_until > gap_start:
+                    self._insert((column, name), gap_start, covered_until, frame[frame['timestamp'] <= covered_until])
+        return self._assemble(columns, pieces, start, end, name)
+
+    # Drop everything cached for the given columns (all columns if None)
+    def invalidate(self, columns=None):
+        with self._lock:
+            for key in list(self._segments):
+                if columns is None or key[0] in columns:
+                    for segment in self._segments.pop(key):
+                        self._bytes -= segment.nbytes
+
+    # Hit rate and memory use
+    def metrics(self):
+        with self._lock:
+            stats = dict(self.stats)
+            segments = sum(len(segments) for segments in self._segments.values())
+            size = self._bytes
+        requests = stats['requests']
+        return dict(stats,
+                    hit_rate=stats['hits'] / requests if requests else 0.0,
+                    segments=segments,
+                    bytes=size,
+                    max_bytes=self.max_bytes)
+
+    # One-line summary of metrics() for the logs
+    def describe(self):
+        metrics = self.metrics()
+        return (f"Series cache: {metrics['hit_rate']:.0%} hits ({metrics['partial_hits']} partial) "
+                f"of {metrics['requests']} requests, {metrics['bytes'] / 1e6:.1f}/{metrics['max_bytes'] / 1e6:.0f} MB "
+                f"in {metrics['segments']} segments")
+
+    # Segments of key overlapping [start, end], in time order; marks them as used
+    def _overlapping(self, key, start, end):
+        self._clock += 1
+        found = []
+        for segment in self._segments.get(key, ()):
+            if segment.end >= start and segment.start <= end:
+                segment.used = self._clock
+                found.append(segment)
+        return found
+
+    # Add rows covering [start, end], merging with every segment it overlaps or touches
+    def _insert(self, key, start, end, frame):
+        import pandas as pd
+
+        with self._lock:
+            self._clock += 1
+            segments = self._segments.setdefault(key, [])
+            merged = [segment for segment in segments if segment.end >= start and segment.start <= end]
+            if merged:
+                frame = pd.concat([segment.frame for segment in merged] + [frame])
+                frame = frame.drop_duplicates('timestamp', keep='last').sort_values('timestamp', ignore_index=True)
+                start = min(start, merged[0].start)
+                end = max(end, merged[-1].end)
+                for segment in merged:
+                    segments.remove(segment)
+                    self._bytes -= segment.nbytes
+            segment = _Segment(start, end, frame, self._clock)
+            segments.append(segment)
+            segments.sort(key=lambda s: s.start)
+            self._bytes += segment.nbytes
+            self._evict()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes:
+            key, oldest = min(((key, segment) for key, segments in self._segments.items() for segment in segments),
+                              key=lambda item: item[1].used)
+            self._segments[key].remove(oldest)
+            if not self._segments[key]:
+                del self._segments[key]
+            self._bytes -= oldest.nbytes
+            self.stats['evictions'] += 1
+
+    # Wide frame in fetch_series' layout from the per-column pieces, limited to [start, end]
+    def _assemble(self, columns, pieces, start, end, name):
+        import pandas as pd
+
+        series = []
+        for column in columns:
+            frame = pd.concat(pieces[column]) if pieces[column] else pd.DataFrame(columns=['timestamp', column])
+            frame = frame.drop_duplicates('timestamp', keep='last').set_index('timestamp')[column]
+            series.append(frame.astype('float64'))
+        df = pd.concat(series, axis=1).sort_index() if series else pd.DataFrame()
+        if name != 'raw':
+            # Rollup queries also return the bucket containing start
+            start = start - timedelta(seconds=next(r[2] for r in rollups.RESOLUTIONS if r[0] == name))
+            df = df[(df.index > start) & (df.index <= end)]
+        else:
+            df = df[(df.index >= start) & (df.index <= end)]
+        df = df.rename_axis('timestamp').reset_index()
+        df['timestamp'] = pd.to_datetime(df['timestamp'])
+        df.attrs['resolution'] = name
+        return df
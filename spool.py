@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import date, datetime
+
+# Directory holding spool segments, next to the scripts
+SPOOL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spool')
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat(' ')
+    raise TypeError(f"Cannot spool value of type {type(value).__name__}")
+
+
+# Append-only, segmented on-disk log of rows that could not be written to PostgreSQL.
+# Rows are appended as JSON lines and fsynced in batches (every sync_rows rows or
+# sync_interval seconds), segments roll over at segment_bytes, and replay() feeds whole
+# segments back in bulk, deleting each one only after its rows were committed. Each segment
+# starts with a header line holding a random segment id, and is replayed under a key made
+# of that id and a hash of its contents, so the writer can record the key in the same
+# transaction and skip a segment that was committed but not yet deleted when the process
+# died. A segment that fails replay max_attempts times (for errors other than the
+# transient ones) is moved to the quarantine directory so it no longer blocks the rest.
+class Spool:
+    def __init__(self, name, directory=SPOOL_DIR, segment_bytes=4 * 1024 * 1024, sync_rows=500, sync_interval=1.0,
+                 max_attempts=5):
+        self.name = name
+        self.directory = directory
+        self.quarantine_dir = os.path.join(directory, 'quarantine')
+        self.max_attempts = max_attempts
+        self._attempts = {}  # Segment path -> failed replay attempts
+        self.segment_bytes = segment_bytes
+        self.sync_rows = sync_rows
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        segments = self._segments()
+        self._next_segment = int(segments[-1].rsplit('-', 1)[1].split('.')[0]) + 1 if segments else 1
+        self._depth_rows = sum(self._count_rows(path) for path in segments)
+        self._depth_bytes = sum(os.path.getsize(path) for path in segments)
+        self._stats = {
+            'spooled_rows': 0,
+            'replayed_rows': 0,
+            'quarantined_segments': 0,
+            'replay_seconds': 0.0
+        }
+
+    # Durably queue rows; they are fsynced as part of the current sync batch
+    def append(self, rows):
+        with self._lock:
+            if self._file is None or self._file.tell() >= self.segment_bytes:
+                self._roll()
+            data = ''.join(json.dumps(list(row), default=_json_default) + '\n' for row in rows)
+            self._file.write(data)
+            self._depth_rows += len(rows)
+            self._depth_bytes += len(data)
+            self._stats['spooled_rows'] += len(rows)
+            self._unsynced += len(rows)
+            if self._unsynced >= self.sync_rows or time.monotonic() - self._last_sync >= self.sync_interval:
+                self._sync()
+
+    # Force any unsynced rows to disk
+    def sync(self):
+        with self._lock:
+            if self._file is not None and self._unsynced:
+                self._sync()
+
+    # Replay segments oldest first through write_rows(rows, key); returns rows replayed.
+    # write_rows must commit the rows together with a record of key, and write nothing for
+    # a key already recorded. Stops at the first failing segment, which stays on disk for
+    # the next attempt; errors of the transient types (e.g. the database being down) do
+    # not count towards quarantining it.
+    def replay(self, write_rows, transient=()):
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+            segments = self._segments()
+
+        replayed = 0
+        started = time.monotonic()
+        for path in segments:
+            size = os.path.getsize(path)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                segment_id, rows = self._parse_segment(data.decode())
+                if rows:
+                    write_rows(rows, f"{self.name}/{segment_id}/{hashlib.sha1(data).hexdigest()}")
+            except transient:
+                raise
+            except Exception as e:
+                attempts = self._attempts.get(path, 0) + 1
+                self._attempts[path] = attempts
+                if attempts < self.max_attempts:
+                    raise
+                rows = self._count_rows(path)
+                self._quarantine(path, e)
+                with self._lock:
+                    self._depth_rows -= rows
+                    self._depth_bytes -= size
+                continue
+            os.remove(path)
+            self._attempts.pop(path, None)
+            with self._lock:
+                self._depth_rows -= len(rows)
+                self._depth_bytes -= size
+                self._stats['replayed_rows'] += len(rows)
+            replayed += len(rows)
+        with self._lock:
+            self._stats['replay_seconds'] += time.monotonic() - started
+        return replayed
+
+    # Rows currently waiting on disk
+    def depth(self):
+        with self._lock:
+            return self._depth_rows
+
+    # Spool depth and replay counters, including the average replay rate in rows per second
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['depth_rows'] = self._depth_rows
+            stats['depth_bytes'] = self._depth_bytes
+        stats['segments'] = len(self._segments())
+        stats['replay_rows_per_second'] = stats['replayed_rows'] / stats['replay_seconds'] if stats['replay_seconds'] else 0.0
+        return stats
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+
+    def _roll(self):
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+        path = os.path.join(self.directory, f"{self.name}-{self._next_segment:06d}.log")
+        self._next_segment += 1
+        self._file = open(path, 'a')
+        header = json.dumps({'segment': uuid.uuid4().hex}) + '\n'
+        self._file.write(header)
+        self._depth_bytes += len(header)
+
+    # Move a segment that keeps failing replay out of the way, keeping it for inspection
+    def _quarantine(self, path, error):
+        os.makedirs(self.quarantine_dir, exist_ok=True)
+        # Segment numbers restart once the spool is empty, so make the name unique
+        target = os.path.join(self.quarantine_dir, f"{os.path.basename(path)[:-4]}-{uuid.uuid4().hex[:8]}.log")
+        os.replace(path, target)
+        self._attempts.pop(path, None)
+        with self._lock:
+            self._stats['quarantined_segments'] += 1
+        print(f"Quarantined spool segment {target} after {self.max_attempts} failed replays: {error}")
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _segments(self):
+        prefix = f"{self.name}-"
+        return sorted(
+            os.path.join(self.directory, entry) for entry in os.listdir(self.directory)
+            if entry.startswith(prefix) and entry.endswith('.log')
+        )
+
+    # Segment id from the header line ('' for segments written before headers) and rows
+    @staticmethod
+    def _parse_segment(text):
+        segment_id = ''
+        rows = []
+        for line in text.splitlines():
+            try:
+                value = json.loads(line)
+            except ValueError:
+                continue  # Torn final line from a crash mid-write
+            if isinstance(value, dict):
+                segment_id = value.get('segment', '')
+            else:
+                rows.append(tuple(value))
+        return segment_id, rows
+
+    @classmethod
+    def _count_rows(cls, path):
+        try:
+            with open(path) as f:
+                return len(cls._parse_segment(f.read())[1])
+        except (OSError, ValueError):
+            return 0
@@ -5,8 +5,9 @@ from tkcalendar import DateEntry
 from tkinter import Canvas, Scrollbar, filedialog, messagebox
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import pandas as pd
-import psycopg2
+from series_cache import SeriesCache
+import downsample
+from db_executor import TkExecutor, LoadingLabel
 from datetime import datetime, timedelta
 
 # Initialize the main application
@@ -14,9 +15,11 @@ app = ctk.CTk()
 app.title("Aquameter Forward Osmosis")
 app.geometry('1920x1080')
 
-# Database connection
-conn = psycopg2.connect(dbname="sensordata", user="postgres", password="400220", host="localhost", port="5432")
-cur = conn.cursor()
+# Database work runs on these workers; results come back on the Tk thread
+db = TkExecutor(app)
+
+# Series already loaded are reused when switching views; only missing ranges are queried
+series = SeriesCache()
 
 # Create a transparent frame for the top title bar
 title_frame = ctk.CTkFrame(master=app, fg_color="transparent")
@@ -89,6 +92,7 @@ def clear_main_area():
 # Function to display all graphs
 def display_all_graphs():
     clear_main_area()
+    db.cancel('detail')
     canvas.grid(row=1, column=0, columnspan=4, sticky="nsew")
     scrollbar.grid(row=1, column=4, sticky="ns")
 
@@ -146,69 +150,72 @@ def display_graph(param):
 
     fetch_and_display_timeseries(param, one_day_ago.strftime('%Y-%m-%d %H:%M:%S'), now.strftime('%Y-%m-%d %H:%M:%S'), canvas, figure, timeseries_window)
 
-# Function to fetch data from the database
-def fetch_data(param, from_datetime, to_datetime):
-    query = f"SELECT timestamp, {param} FROM fo_sensor_data WHERE timestamp BETWEEN '{from_datetime}' AND '{to_datetime}' ORDER BY timestamp ASC"
-    cur.execute(query)
-    data = cur.fetchall()
-    if data:
-        df = pd.DataFrame(data, columns=['timestamp', param])
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        return df
-    else:
-        return pd.DataFrame(columns=['timestamp', param])
-
-# Function to update the graphs with data from the database
+# Function to fetch data from the database: one query for all columns, aligned on a common
+# timestamp column; long ranges are served from the rollup tables and ranges already
+# loaded come from the series cache
+def fetch_data(columns, from_datetime, to_datetime):
+    data = series.get(columns, from_datetime, to_datetime)
+    print(series.describe())
+    return data
+
+# Function to update the graphs with data from the database. The query runs on a db worker;
+# the graphs are then drawn one per Tk tick so the dashboard fills in progressively.
 def update_graphs():
     now = datetime.now()
     one_day_ago = now - timedelta(days=1)
     from_datetime = one_day_ago.strftime('%Y-%m-%d %H:%M:%S')
     to_datetime = now.strftime('%Y-%m-%d %H:%M:%S')
 
-    for param in parameters:
-        data = fetch_data(param, from_datetime, to_datetime)
-        if not data.empty:
-            if param not in graph_widgets:
-                fig, ax = plt.subplots(figsize=(6, 4))
-                graph_widgets[param] = (fig, ax, FigureCanvasTkAgg(fig, master=param_frames[param]))
-                graph_widgets[param][2].get_tk_widget().pack(fill=tk.BOTH, expand=1)
-
-            ax = graph_widgets[param][1]
-            ax.clear()
-            ax.plot(data['timestamp'], data[param], marker='o', linestyle='-', label=param)
-            ax.set_title(param.replace("_", " ").title(), fontsize=16, fontname='Times New Roman', fontweight='bold')
-            ax.set_xlabel('Time')
-            ax.set_ylabel(param)
-            ax.legend()
-            graph_widgets[param][2].draw()
+    # One query for every single and multi-graph column; graphs plot column views of it
+    columns = parameters + [col for cols in multi_graphs.values() for col in cols]
+    db.submit(fetch_data, columns, from_datetime, to_datetime, on_done=render_graphs, key='dashboard',
+              loading=LoadingLabel(scrollable_frame))
 
-    # Multi-graphs
-    for title, cols in multi_graphs.items():
-        data_combined = []
-        for col in cols:
-            data = fetch_data(col, from_datetime, to_datetime)
-            if not data.empty:
-                data_combined.append(data)
-        
-        if data_combined:
-            combined_df = pd.concat(data_combined, axis=1)
-            combined_df = combined_df.loc[:, ~combined_df.columns.duplicated()]
-            if title not in graph_widgets:
-                fig, ax = plt.subplots(figsize=(6, 4))
-                graph_widgets[title] = (fig, ax, FigureCanvasTkAgg(fig, master=scrollable_frame))
-                graph_widgets[title][2].get_tk_widget().grid(row=(len(parameters) + list(multi_graphs.keys()).index(title)) // 3, column=(len(parameters) + list(multi_graphs.keys()).index(title)) % 3, padx=10, pady=10, sticky='nsew')
-            
-            ax = graph_widgets[title][1]
-            ax.clear()
-            for col in cols:
-                ax.plot(combined_df['timestamp'], combined_df[col], marker='o', linestyle='-', label=col)
-            ax.set_title(title, fontsize=16, fontname='Times New Roman', fontweight='bold')
-            ax.set_xlabel('Time')
-            ax.set_ylabel('Values')
-            ax.legend()
-            graph_widgets[title][2].draw()
+def render_graphs(data):
+    jobs = [lambda param=param: draw_param_graph(param, data) for param in parameters]
+    jobs += [lambda title=title, cols=cols: draw_multi_graph(title, cols, data) for title, cols in multi_graphs.items()]
+
+    def next_job():
+        if jobs:
+            jobs.pop(0)()
+            app.after(1, next_job)
+        else:
+            scrollable_frame.update_idletasks()
+
+    next_job()
+
+def draw_param_graph(param, data):
+    if data[param].notna().any():
+        if param not in graph_widgets:
+            fig, ax = plt.subplots(figsize=(6, 4))
+            graph_widgets[param] = (fig, ax, FigureCanvasTkAgg(fig, master=param_frames[param]))
+            graph_widgets[param][2].get_tk_widget().pack(fill=tk.BOTH, expand=1)
 
-    scrollable_frame.update_idletasks()
+        ax = graph_widgets[param][1]
+        ax.clear()
+        ax.plot(*downsample.for_plot(data['timestamp'], data[param], downsample.point_budget(graph_widgets[param][2])), marker='o', linestyle='-', label=param)
+        ax.set_title(param.replace("_", " ").title(), fontsize=16, fontname='Times New Roman', fontweight='bold')
+        ax.set_xlabel('Time')
+        ax.set_ylabel(param)
+        ax.legend()
+        graph_widgets[param][2].draw()
+
+def draw_multi_graph(title, cols, data):
+    if data[cols].notna().any().any():
+        if title not in graph_widgets:
+            fig, ax = plt.subplots(figsize=(6, 4))
+            graph_widgets[title] = (fig, ax, FigureCanvasTkAgg(fig, master=scrollable_frame))
+            graph_widgets[title][2].get_tk_widget().grid(row=(len(parameters) + list(multi_graphs.keys()).index(title)) // 3, column=(len(parameters) + list(multi_graphs.keys()).index(title)) % 3, padx=10, pady=10, sticky='nsew')
+
+        ax = graph_widgets[title][1]
+        ax.clear()
+        for col in cols:
+            ax.plot(*downsample.for_plot(data['timestamp'], data[col], downsample.point_budget(graph_widgets[title][2])), marker='o', linestyle='-', label=col)
+        ax.set_title(title, fontsize=16, fontname='Times New Roman', fontweight='bold')
+        ax.set_xlabel('Time')
+        ax.set_ylabel('Values')
+        ax.legend()
+        graph_widgets[title][2].draw()
 
 # Function to fetch and display the time series
 def fetch_and_display(param, from_date_input, from_time_input, to_date_input, to_time_input, canvas, figure, timeseries_window):
@@ -222,18 +229,22 @@ def fetch_and_display(param, from_date_input, from_time_input, to_date_input, to
 
     fetch_and_display_timeseries(param, from_datetime, to_datetime, canvas, figure, timeseries_window)
 
-# Function to fetch and display time series from the database
+# Function to fetch and display time series from the database; the query runs on a db
+# worker and a newer range replaces a request still in flight
 def fetch_and_display_timeseries(param, from_datetime, to_datetime, canvas, figure, timeseries_window):
-    data = fetch_data(param, from_datetime, to_datetime)
-    if not data.empty:
-        ax = figure.add_subplot(111)
-        ax.clear()
-        ax.plot(data['timestamp'], data[param], marker='o', linestyle='-', label=param)
-        ax.set_title(param.replace("_", " ").title(), fontsize=16, fontname='Times New Roman', fontweight='bold')
-        ax.set_xlabel('Time')
-        ax.set_ylabel(param)
-        ax.legend()
-        canvas.draw()
+    def show(data):
+        if data[param].notna().any():
+            ax = figure.add_subplot(111)
+            ax.clear()
+            ax.plot(*downsample.for_plot(data['timestamp'], data[param], downsample.point_budget(canvas)), marker='o', linestyle='-', label=param)
+            ax.set_title(param.replace("_", " ").title(), fontsize=16, fontname='Times New Roman', fontweight='bold')
+            ax.set_xlabel('Time')
+            ax.set_ylabel(param)
+            ax.legend()
+            canvas.draw()
+
+    db.submit(fetch_data, [param], from_datetime, to_datetime, on_done=show, on_error=show_error, key='detail',
+              loading=LoadingLabel(canvas.get_tk_widget()))
 
 # Function to fetch and display multi-parameter time series
 def display_multi_graph(params, title):
@@ -274,7 +285,7 @@ def display_multi_graph(params, title):
     canvas = FigureCanvasTkAgg(figure, master=timeseries_window)
     canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
 
-    fetch_button = ctk.CTkButton(row2_frame, text="Show Graph", command=lambda: fetch_and_display_multi(params, from_date_input, from_time_input, to_date_input, to_time_input, canvas, figure, timeseries_window))
+    fetch_button = ctk.CTkButton(row2_frame, text="Show Graph", command=lambda: fetch_and_display_multi(params, title, from_date_input, from_time_input, to_date_input, to_time_input, canvas, figure, timeseries_window))
     fetch_button.pack(side=tk.LEFT, padx=5)
 
     save_button = ctk.CTkButton(row2_frame, text="Save Image", command=lambda: save_graph_as_image(figure, timeseries_window))
@@ -287,10 +298,10 @@ def display_multi_graph(params, title):
     to_date_input.set_date(now)
     to_time_input.insert(0, now.strftime('%H:%M'))
 
-    fetch_and_display_multi(params, one_day_ago.strftime('%Y-%m-%d %H:%M:%S'), now.strftime('%Y-%m-%d %H:%M:%S'), canvas, figure, timeseries_window)
+    fetch_and_display_multi_timeseries(params, title, one_day_ago.strftime('%Y-%m-%d %H:%M:%S'), now.strftime('%Y-%m-%d %H:%M:%S'), canvas, figure, timeseries_window)
 
 # Function to fetch and display multi-parameter time series from the database
-def fetch_and_display_multi(params, from_date_input, from_time_input, to_date_input, to_time_input, canvas, figure, timeseries_window):
+def fetch_and_display_multi(params, title, from_date_input, from_time_input, to_date_input, to_time_input, canvas, figure, timeseries_window):
     from_date_str = from_date_input.get_date().strftime('%Y-%m-%d')
     from_time_str = from_time_input.get()
     to_date_str = to_date_input.get_date().strftime('%Y-%m-%d')
@@ -299,25 +310,28 @@ def fetch_and_display_multi(params, from_date_input, from_time_input, to_date_in
     from_datetime = f"{from_date_str} {from_time_str}:00"
     to_datetime = f"{to_date_str} {to_time_str}:00"
 
-    data_combined = []
-    for param in params:
-        data = fetch_data(param, from_datetime, to_datetime)
-        if not data.empty:
-            data_combined.append(data)
+    fetch_and_display_multi_timeseries(params, title, from_datetime, to_datetime, canvas, figure, timeseries_window)
 
-    if data_combined:
-        combined_df = pd.concat(data_combined, axis=1)
-        combined_df = combined_df.loc[:, ~combined_df.columns.duplicated()]
+# Function to fetch multi-parameter time series on a db worker and display them
+def fetch_and_display_multi_timeseries(params, title, from_datetime, to_datetime, canvas, figure, timeseries_window):
+    def show(data):
+        if data[params].notna().any().any():
+            ax = figure.add_subplot(111)
+            ax.clear()
+            for param in params:
+                ax.plot(*downsample.for_plot(data['timestamp'], data[param], downsample.point_budget(canvas)), marker='o', linestyle='-', label=param)
+            ax.set_title(title, fontsize=16, fontname='Times New Roman', fontweight='bold')
+            ax.set_xlabel('Time')
+            ax.set_ylabel('Values')
+            ax.legend()
+            canvas.draw()
 
-        ax = figure.add_subplot(111)
-        ax.clear()
-        for param in params:
-            ax.plot(combined_df['timestamp'], combined_df[param], marker='o', linestyle='-', label=param)
-        ax.set_title(title, fontsize=16, fontname='Times New Roman', fontweight='bold')
-        ax.set_xlabel('Time')
-        ax.set_ylabel('Values')
-        ax.legend()
-        canvas.draw()
+    db.submit(fetch_data, params, from_datetime, to_datetime, on_done=show, on_error=show_error, key='detail',
+              loading=LoadingLabel(canvas.get_tk_widget()))
+
+# Function to report a failed background query
+def show_error(e):
+    messagebox.showerror("Error", f"An error occurred while fetching data: {e}")
 
 # Function to save the graph as an image
 def save_graph_as_image(figure, parent_window):
@@ -366,7 +380,7 @@ def create_menu_bar():
 
     # Add multi-parameter graph buttons
     for title, params in multi_graphs.items():
-        menu_bar.add_command(label=title, command=lambda p=params: display_multi_graph(p, title))
+        menu_bar.add_command(label=title, command=lambda p=params, t=title: display_multi_graph(p, t))
 
 create_menu_bar()
 update_graphs()
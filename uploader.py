@@ -0,0 +1,270 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+import database
+
+# Legacy file-based watermark state, only read once to migrate it into fo_sync_watermark
+UPLOAD_STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'upload_state.json')
+
+
+# Function to create the sync state table; upload progress lives here instead of in a
+# per-row published flag, so the data tables stay append-only
+def ensure_sync_table():
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fo_sync_watermark (
+            name TEXT PRIMARY KEY,
+            last_id BIGINT NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        ''')
+        cursor.close()
+
+
+# Function to read the upload watermark for a table, or None if there is none yet
+def load_watermark(name):
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT last_id FROM fo_sync_watermark WHERE name = %s", (name,))
+        row = cursor.fetchone()
+        cursor.close()
+    return row[0] if row else None
+
+
+# Function to persist the upload watermark for a table
+def save_watermark(name, last_id):
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+        INSERT INTO fo_sync_watermark (name, last_id, updated_at) VALUES (%s, %s, NOW())
+        ON CONFLICT (name) DO UPDATE SET last_id = EXCLUDED.last_id, updated_at = EXCLUDED.updated_at
+        ''', (name, last_id))
+        cursor.close()
+
+
+# Function to seed the watermark of a table that has none yet.
+# Existing deployments are migrated from the legacy state file if present, otherwise from
+# the published flags: everything below the oldest unpublished row counts as uploaded.
+def migrate_watermark(table, state_file=UPLOAD_STATE_FILE):
+    try:
+        with open(state_file) as f:
+            legacy = json.load(f).get(table)
+    except (FileNotFoundError, ValueError):
+        legacy = None
+
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        if legacy is not None:
+            watermark = legacy
+        else:
+            cursor.execute(f'''
+            SELECT COALESCE(
+                (SELECT MIN(id) - 1 FROM {table} WHERE published = FALSE),
+                (SELECT MAX(id) FROM {table}),
+                0)
+            ''')
+            watermark = cursor.fetchone()[0]
+        cursor.execute('''
+        INSERT INTO fo_sync_watermark (name, last_id) VALUES (%s, %s)
+        ON CONFLICT (name) DO NOTHING
+        ''', (table, watermark))
+        cursor.close()
+    print(f"Migrated upload watermark for {table} to id {watermark}.")
+    return load_watermark(table)
+
+
+# Raised when the external service rejects a chunk
+class UploadError(Exception):
+    pass
+
+
+# Chunk size controller: grows while uploads are fast, shrinks when they are slow or failing
+class ChunkSizer:
+    def __init__(self, initial=200, minimum=20, maximum=2000, target_seconds=2.0):
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+
+    def record_success(self, rows, seconds):
+        if seconds > self.target_seconds:
+            # Scale down in proportion to how far over target the round trip was
+            self.size = max(self.minimum, int(self.size * self.target_seconds / seconds))
+        elif seconds < self.target_seconds / 2 and rows >= self.size:
+            self.size = min(self.maximum, self.size * 2)
+
+    def record_failure(self):
+        self.size = max(self.minimum, self.size // 2)
+
+
+# Streams new rows of one append-only table to the external service in chunks.
+# Each chunk is read by keyset pagination on id in its own short transaction, so memory
+# stays bounded by the chunk size and no snapshot is held open (holding back vacuum) while
+# a long backlog uploads. The id watermark in fo_sync_watermark is advanced after every
+# chunk so an interrupted upload resumes where it stopped instead of starting over.
+class ChunkedUploader:
+    def __init__(self, table, format_row, upload, sizer=None):
+        self.table = table
+        self.format_row = format_row
+        self.upload = upload
+        self.sizer = sizer or ChunkSizer()
+        self._watermark = None
+
+    # Current watermark; the first call creates and migrates the sync state if needed
+    def watermark(self):
+        if self._watermark is None:
+            ensure_sync_table()
+            watermark = load_watermark(self.table)
+            if watermark is None:
+                watermark = migrate_watermark(self.table)
+            self._watermark = watermark
+        return self._watermark
+
+    # Upload everything above the watermark; returns the number of rows uploaded.
+    # Up to max_in_flight chunks are read ahead while the current one is being sent;
+    # raises UploadError when a chunk is rejected.
+    def run(self, max_in_flight=1):
+        uploaded = 0
+        # The single reader thread runs the reads in order, each continuing after the last
+        # id read by the one before
+        position = {'after': self.watermark()}
+
+        def read_chunk(size):
+            rows = self._read_chunk(position['after'], size)
+            if rows:
+                position['after'] = rows[-1][0]  # Assuming id is the first column
+            return rows
+
+        with ThreadPoolExecutor(max_workers=1) as reader:
+            chunks = deque()
+            try:
+                while True:
+                    while len(chunks) < max(1, max_in_flight):
+                        chunks.append(reader.submit(read_chunk, self.sizer.size))
+                    rows = chunks.popleft().result()
+                    if not rows:
+                        break
+
+                    started = time.monotonic()
+                    response = self.upload([self.format_row(row) for row in rows])
+                    elapsed = time.monotonic() - started
+                    if not (response and response.data):
+                        self.sizer.record_failure()
+                        raise UploadError(f"Upload of {len(rows)} rows from {self.table} failed after {uploaded} rows; "
+                                          f"next chunk size {self.sizer.size}")
+                    self.sizer.record_success(len(rows), elapsed)
+
+                    last_id = rows[-1][0]
+                    save_watermark(self.table, last_id)
+                    self._watermark = last_id
+                    uploaded += len(rows)
+            finally:
+                for chunk in chunks:
+                    chunk.cancel()
+                wait(chunks)
+        return uploaded
+
+    # Read up to size rows above after_id, in id order, in one short transaction
+    def _read_chunk(self, after_id, size):
+        with database.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT * FROM {self.table} WHERE id > %s ORDER BY id LIMIT %s", (after_id, size))
+            rows = cursor.fetchall()
+            cursor.close()
+        return rows
+
+    # Rows not uploaded yet and the age in seconds of the oldest of them
+    def lag(self):
+        with database.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT COUNT(*), MIN(timestamp) FROM {self.table} WHERE id > %s", (self.watermark(),))
+            rows, oldest = cursor.fetchone()
+            cursor.close()
+        seconds = (datetime.now() - oldest).total_seconds() if oldest else 0.0
+        return rows, seconds
+
+
+# Background upload worker, decoupled from the sampling loop.
+# Runs every interval seconds (or immediately after wake(), e.g. when the link comes
+# back), skips runs while the health monitor reports the link down, backs off
+# exponentially after failures, and keeps upload lag in rows and seconds per table.
+# A failure while the link is still up (a rejected batch, a bad key) is not cut short by
+# wake(), so it keeps backing off up to max_backoff.
+class UploadWorker:
+    def __init__(self, uploaders, health=None, interval=30.0, max_in_flight=2, max_backoff=300.0):
+        self.uploaders = uploaders
+        self.health = health
+        self.interval = interval
+        self.max_in_flight = max_in_flight
+        self.max_backoff = max_backoff
+        self._delay = interval
+        self._rejected = False  # Last run failed although the link was up
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="upload-worker", daemon=True)
+            self._thread.start()
+        return self
+
+    # Run an upload cycle now instead of waiting for the schedule, unless the last run
+    # failed for a reason other than the link
+    def wake(self):
+        if not self._rejected:
+            self._wakeup.set()
+
+    def stop(self, timeout=None):
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    # Per-table upload lag and counters from the last cycle
+    def metrics(self):
+        with self._lock:
+            return {table: dict(values) for table, values in self._metrics.items()}
+
+    def _run(self):
+        while not self._stopping:
+            if self.health is None or self.health.is_up():
+                failed = False
+                for uploader in self.uploaders:
+                    failed = not self._upload(uploader) or failed
+                self._delay = min(self.max_backoff, self._delay * 2) if failed else self.interval
+                self._rejected = failed and (self.health is None or self.health.is_up())
+            if self._wakeup.wait(self._delay):
+                self._wakeup.clear()
+
+    def _upload(self, uploader):
+        ok = True
+        uploaded = 0
+        try:
+            uploaded = uploader.run(max_in_flight=self.max_in_flight)
+            if uploaded:
+                print(f"Uploaded {uploaded} rows from {uploader.table} successfully.")
+        except Exception as e:
+            print(f"Error uploading {uploader.table}: {e}")
+            ok = False
+        try:
+            lag_rows, lag_seconds = uploader.lag()
+        except Exception as e:
+            print(f"Error measuring upload lag for {uploader.table}: {e}")
+            lag_rows, lag_seconds = None, None
+        with self._lock:
+            metrics = self._metrics.setdefault(uploader.table, {'uploaded_rows': 0, 'failed_runs': 0})
+            metrics['uploaded_rows'] += uploaded
+            metrics['failed_runs'] += 0 if ok else 1
+            metrics['chunk_size'] = uploader.sizer.size
+            metrics['lag_rows'] = lag_rows
+            metrics['lag_seconds'] = lag_seconds
+        return ok